@@ -1,10 +1,13 @@
 '''
 Basic class definitions
 '''
+import math
 import numpy as np
 from projections import ecef2latlonheight,latlonheight2ecef
 
 class SpaceVector:
+    __slots__ = ("x","y","z","lat","lon","height")
+
     def __init__(self,x,y,z,lat=None,lon=None,height=None,skip_llh=True):
         self.x = x
         self.y = y
@@ -45,7 +48,7 @@ class SpaceVector:
         return str(self)
 
     def norm(self):
-        return np.linalg.norm([self.x,self.y,self.z])
+        return math.sqrt(self.x*self.x+self.y*self.y+self.z*self.z)
 
     def dot(self,other):
         return self.x*other.x+self.y*other.y+self.z*other.z
@@ -61,4 +64,122 @@ class SpaceVector:
         x,y,z = latlonheight2ecef(lat,lon,height)
         return SpaceVector(x,y,z,lat,lon,height)
 
-    
\ No newline at end of file
+
+class SpaceVectorArray:
+    '''
+    Struct of arrays holding many positions: x, y and z are float64 arrays of the same length.
+    The geodetic coordinates are only computed when first accessed, unless provided.
+    '''
+    __slots__ = ("x","y","z","_lat","_lon","_height")
+
+    def __init__(self,x,y,z,lat=None,lon=None,height=None):
+        self.x = np.asarray(x,dtype=float)
+        self.y = np.asarray(y,dtype=float)
+        self.z = np.asarray(z,dtype=float)
+        if not (self.x.shape==self.y.shape==self.z.shape):
+            raise Exception(f"Coordinate arrays with different shapes provided: {self.x.shape}, {self.y.shape}, {self.z.shape}")
+
+        if lat is None or lon is None or height is None:
+            self._lat,self._lon,self._height = None,None,None
+        else:
+            self._lat = np.asarray(lat,dtype=float)
+            self._lon = np.asarray(lon,dtype=float)
+            self._height = np.asarray(height,dtype=float)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self,index):
+        if isinstance(index,(int,np.integer)):
+            if self._lat is None:
+                return SpaceVector(float(self.x[index]),float(self.y[index]),float(self.z[index]))
+            return SpaceVector(float(self.x[index]),float(self.y[index]),float(self.z[index]),float(self._lat[index]),float(self._lon[index]),float(self._height[index]))
+        if self._lat is None:
+            return SpaceVectorArray(self.x[index],self.y[index],self.z[index])
+        return SpaceVectorArray(self.x[index],self.y[index],self.z[index],self._lat[index],self._lon[index],self._height[index])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __add__(self,other):
+        return SpaceVectorArray(self.x+other.x,self.y+other.y,self.z+other.z)
+
+    def __sub__(self,other):
+        return SpaceVectorArray(self.x-other.x,self.y-other.y,self.z-other.z)
+
+    def __truediv__(self,other):
+        return SpaceVectorArray(self.x/other,self.y/other,self.z/other)
+
+    def __mul__(self,other):
+        return SpaceVectorArray(self.x*other,self.y*other,self.z*other)
+
+    def __str__(self):
+        return f"SpaceVectorArray({len(self)} positions)"
+
+    def __repr__(self):
+        return str(self)
+
+    def norm(self):
+        return np.sqrt(self.x*self.x+self.y*self.y+self.z*self.z)
+
+    def dot(self,other):
+        return self.x*other.x+self.y*other.y+self.z*other.z
+
+    @property
+    def xyz(self):
+        '''
+        Positions as a (n,3) array.
+        '''
+        return np.column_stack([self.x,self.y,self.z])
+
+    @property
+    def lat(self):
+        return self.to_llh()[0]
+
+    @property
+    def lon(self):
+        return self.to_llh()[1]
+
+    @property
+    def height(self):
+        return self.to_llh()[2]
+
+    def to_llh(self):
+        if self._lat is None:
+            lat,lon,height = ecef2latlonheight(self.x,self.y,self.z,method="closed_form")
+            self._lat = np.asarray(lat,dtype=float)
+            self._lon = np.asarray(lon,dtype=float)
+            self._height = np.asarray(height,dtype=float)
+        return (self._lat,self._lon,self._height)
+
+    @classmethod
+    def from_xyz(cls,xyz):
+        xyz = np.asarray(xyz,dtype=float).reshape(-1,3)
+        return SpaceVectorArray(xyz[:,0],xyz[:,1],xyz[:,2])
+
+    @classmethod
+    def from_llh(cls,lat,lon,height):
+        x,y,z = latlonheight2ecef(lat,lon,height)
+        return SpaceVectorArray(x,y,z,lat,lon,height)
+
+    @classmethod
+    def from_vectors(cls,vectors):
+        vectors = list(vectors)
+        with_llh = all(vector.lat is not None for vector in vectors)
+        return SpaceVectorArray(
+            [vector.x for vector in vectors],
+            [vector.y for vector in vectors],
+            [vector.z for vector in vectors],
+            [vector.lat for vector in vectors] if with_llh else None,
+            [vector.lon for vector in vectors] if with_llh else None,
+            [vector.height for vector in vectors] if with_llh else None)
+
+    @classmethod
+    def from_df(cls,df):
+        '''
+        Build the array from the x,y,z (and lat,lon,height, when present) columns of a dataframe.
+        '''
+        if all(column in df.columns for column in ["lat","lon","height"]):
+            return SpaceVectorArray(df.x.to_numpy(),df.y.to_numpy(),df.z.to_numpy(),df.lat.to_numpy(),df.lon.to_numpy(),df.height.to_numpy())
+        return SpaceVectorArray(df.x.to_numpy(),df.y.to_numpy(),df.z.to_numpy())
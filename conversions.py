@@ -20,21 +20,101 @@ class GlonassInfo:
         req = requests.get("https://www.glonass-iac.ru/en/CUSGLONASS/getCUSMessage.php")
         with filepath.open("wb") as f:
             f.write(req.content)
+        # Glonass PRNs resolved with an older (or a neighbouring day's) message are stale
+        _prn_cache.clear()
 
     @classmethod
-    def get_cus_msg(cls):
-        yesterday = datetime.now() - timedelta(days=1)
-        yesterday_date = yesterday.date()
-        year = yesterday_date.year
-        month = str(yesterday_date.month).zfill(2)
-        day = str(yesterday_date.day).zfill(2)
-        filepath = Path(f"./output/{year}/{month}/{day}/glonass_cus/CUSMessage_{year}{month}{day}.txt")
+    def get_cus_path(cls,date):
+        year = date.year
+        month = str(date.month).zfill(2)
+        day = str(date.day).zfill(2)
+        return Path(f"./output/{year}/{month}/{day}/glonass_cus/CUSMessage_{year}{month}{day}.txt")
+
+    @classmethod
+    def find_cus_file(cls,date=None):
+        '''
+        Return the CUS message file for the provided date (yesterday if not provided). If there
+        is no message for that date, the closest message within a week is used.
+        '''
+        if date is None:
+            date = (datetime.now() - timedelta(days=1)).date()
+        if isinstance(date,datetime):
+            date = date.date()
+
+        for offset in [0,-1,1,-2,2,-3,3,-4,4,-5,5,-6,6,-7,7]:
+            filepath = cls.get_cus_path(date + timedelta(days=offset))
+            if filepath.exists():
+                return filepath
+        return None
+
+    @classmethod
+    def get_cus_msg(cls,date=None):
+        filepath = cls.find_cus_file(date)
         result = []
-        if filepath.exists():
+        if filepath:
             with filepath.open("r") as f:
                 result = f.readlines()
         return result
 
+    @classmethod
+    def get_cus_key(cls,date=None):
+        '''
+        Return a key identifying the CUS message used for the provided date: (path,mtime).
+        '''
+        filepath = cls.find_cus_file(date)
+        if not filepath:
+            return None
+        return (str(filepath),filepath.stat().st_mtime_ns)
+
+    @classmethod
+    def is_current(cls,cus_key,date):
+        '''
+        Check if the CUS message identified by cus_key is still the one used for the date: the
+        file is unchanged, and no message of the date itself appeared if it is a neighbour's.
+        '''
+        filepath = Path(cus_key[0])
+        try:
+            if filepath.stat().st_mtime_ns!=cus_key[1]:
+                return False
+        except FileNotFoundError:
+            return False
+        exact_path = cls.get_cus_path(date)
+        return filepath==exact_path or not exact_path.exists()
+
+    @classmethod
+    def get_cus_table(cls,date=None):
+        '''
+        Return the parsed CUS message as a dict: {cosmos_number:slot}. The table is parsed
+        once and reparsed only when the file changes.
+        '''
+        cus_key = cls.get_cus_key(date)
+        if not cus_key:
+            return {}
+
+        filepath,mtime = cus_key
+        if filepath in _cus_tables and _cus_tables[filepath][0]==mtime:
+            return _cus_tables[filepath][1]
+
+        n = "[0-9]"
+        date_pattern = n*2+"."+n*2+"."+n*4
+        pattern = re.compile(f"^\\|  {n}{n}{n}  \\| {n}{n}{n}{n} \\| {n}/{n}{n} \\|  .{n}  \\| {date_pattern} \\| {date_pattern} \\| .* \\| .* \\|.*")
+
+        table = {}
+        with Path(filepath).open("r") as f:
+            for line in f:
+                if pattern.match(line):
+                    elems = line.split('|')
+                    cosmos_number = elems[2].strip()
+                    slot = elems[3].split('/')[1].strip()
+                    table[cosmos_number] = slot
+
+        _cus_tables[filepath] = (mtime,table)
+        return table
+
+# Parsed CUS messages {filepath:(mtime,table)} and resolved PRNs {(norad_id,date):(prn,cus_key)}
+_cus_tables = {}
+_prn_cache = {}
+
 BEIDOU_EXTRA = {
     "BEIDOU-2 G8":"C01",
     "BEIDOU-3 IGSO-3":"C40",
@@ -49,16 +129,41 @@ BEIDOU_EXTRA = {
 #for example from http://www.csno-tarc.cn/en/system/constellation and 
 #conversions from NORAD IDs to PRNs
 
-def norad2prn(norad_id):
+def norad2prn(norad_id,date=None):
     '''
-    Convert the provided Norad ID to PRN
+    Convert the provided Norad ID to PRN. For Glonass satellites, the CUS message
+    for the provided date is used (yesterday if not provided). Results are cached per
+    date, Glonass satellites are only cached once their CUS message resolved them, and
+    until that message changes (e.g. downloaded again by another process).
     '''
+    if "COSMOS" not in norad_id:
+        key = (norad_id,None)
+    else:
+        if date is None:
+            date = (datetime.now() - timedelta(days=1)).date()
+        if isinstance(date,datetime):
+            date = date.date()
+        key = (norad_id,date)
+
+    if key in _prn_cache:
+        prn,cus_key = _prn_cache[key]
+        if cus_key is None or GlonassInfo.is_current(cus_key,date):
+            return prn
+        del _prn_cache[key]
+
+    cus_key = GlonassInfo.get_cus_key(date) if key[1] else None
+    prn = _norad2prn(norad_id,date)
+    if prn or key[1] is None:
+        _prn_cache[key] = (prn,cus_key)
+    return prn
+
+def _norad2prn(norad_id,date=None):
     if "GPS" in norad_id:
         return "G"+norad_id.split('PRN')[1].strip().replace(')','')
     elif "GSAT" in norad_id and "PRN E" in norad_id:
         return norad_id.split('PRN')[1].strip().replace(')','')
     elif "COSMOS" in norad_id:
-        prn = cosmos2prn(int(norad_id.split(" ")[1]))
+        prn = cosmos2prn(int(norad_id.split(" ")[1]),date)
         if prn:
             return "R"+prn
         else:
@@ -72,27 +177,14 @@ def norad2prn(norad_id):
             else:
                 return 'N/A'
 
-def cosmos2prn(input_number):
-    n = "[0-9]"
-    date = n*2+"."+n*2+"."+n*4
-    pattern = f"^\\|  {n}{n}{n}  \\| {n}{n}{n}{n} \\| {n}/{n}{n} \\|  .{n}  \\| {date} \\| {date} \\| .* \\| .* \\|.*"
-
-    result = {}
-    glo_msg_lines = GlonassInfo.get_cus_msg()
-    if not glo_msg_lines:
+def cosmos2prn(input_number,date=None):
+    result = GlonassInfo.get_cus_table(date)
+    if not result:
         print(f"GLENNY glonass cus message not found!")
         return False
-    
-    for line in glo_msg_lines:
-        if re.match(pattern,line):
-            elems = line.split('|')
-            cosmos_number = elems[2].strip()
-            slot = elems[3].split('/')[1].strip()
-            result[cosmos_number] = slot
 
     if not str(input_number) in result:
         print(f"GLENNY cosmos number {input_number} not found!")
         return False
 
     return result[str(input_number)]
-    
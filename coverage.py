@@ -0,0 +1,49 @@
+'''
+Global GNSS coverage computations
+'''
+import numpy as np
+
+from grid import Grid
+
+CONSTELLATIONS = ["G","E","R","C"]
+
+
+class CoverageEngine:
+    '''
+    Count, for every grid cell and epoch, the number of satellites per constellation
+    above the elevation mask. The cell ECEF positions and normals are computed once.
+    '''
+    def __init__(self,resolution=5.0,layout="equal_angle",height=0,elevation_mask=5,batch_mb=64):
+        self.grid = Grid.get_grid(resolution=resolution,height=height,layout=layout)
+        self.cell_xyz = self.grid.ecef
+        self.cell_normals = self.grid.normals
+        self.elevation_mask = elevation_mask
+        self.batch_mb = batch_mb
+
+    def count_visible(self,sat_xyz,constellations):
+        '''
+        sat_xyz: ECEF positions of all satellites, shape (satellites,epochs,3)
+        constellations: constellation letter per satellite
+        returns counts of shape (len(CONSTELLATIONS),epochs,cells) as uint8
+        '''
+        sat_xyz = np.asarray(sat_xyz,dtype=float)
+        number_of_sats,number_of_epochs,_ = sat_xyz.shape
+        number_of_cells = len(self.cell_xyz)
+        membership = np.array([[constellation==name for constellation in constellations] for name in CONSTELLATIONS],dtype=np.float32)
+
+        # Elevation >= mask  <=>  (sat-cell).normal >= sin(mask)*|sat-cell|, evaluated with matrix products
+        sin_mask = np.sin(np.radians(self.elevation_mask))
+        cell_dot_normal = np.sum(self.cell_xyz*self.cell_normals,axis=1)
+        cell_norm2 = np.sum(self.cell_xyz**2,axis=1)
+
+        bytes_per_epoch = max(number_of_sats*number_of_cells*8*4,1)
+        batch = max(1,int(self.batch_mb*1024*1024/bytes_per_epoch))
+        counts = np.zeros((len(CONSTELLATIONS),number_of_epochs,number_of_cells),dtype=np.uint8)
+        for start in range(0,number_of_epochs,batch):
+            sats = sat_xyz[:,start:start+batch].reshape(-1,3)
+            dot = sats @ self.cell_normals.T - cell_dot_normal
+            distance2 = np.sum(sats**2,axis=1)[:,np.newaxis] + cell_norm2 - 2.0*(sats @ self.cell_xyz.T)
+            visible = (dot >= sin_mask*np.sqrt(np.maximum(distance2,0.0))).reshape(number_of_sats,-1,number_of_cells)
+            counts[:,start:start+batch] = np.einsum("kn,nec->kec",membership,visible.astype(np.float32)).astype(np.uint8)
+
+        return counts
@@ -17,22 +17,29 @@ Elevation::Elevation(std::string epoch,std::string station,std::string sat,Space
 
 bool Elevation::calculate_elevation()
 {
-    SpaceVector station_to_sat = sat_pos_ - station_pos_;
-    double distance = station_to_sat.get_distance();
+    elevation_ = Elevation::elevation(station_pos_,Elevation::station_normal(station_pos_),sat_pos_);
+    return true;
+}
 
-    if (distance<1e-10){
-        elevation_ = 0;
-        return true;
-    }
-    SpaceVector station_normal = station_pos_;
+SpaceVector Elevation::station_normal(SpaceVector station_pos)
+{
+    SpaceVector station_normal = station_pos;
     double new_z = station_normal.get_z()/((1.0 - EARTH_FLATTE_GRS80) * (1.0 - EARTH_FLATTE_GRS80));
     station_normal.set_z(new_z);
     double aux_distance = station_normal.get_distance();
-    SpaceVector station_normal_unit = station_normal/aux_distance;
+    return station_normal/aux_distance;
+}
+
+double Elevation::elevation(SpaceVector station_pos,SpaceVector station_normal_unit,SpaceVector sat_pos)
+{
+    SpaceVector station_to_sat = sat_pos - station_pos;
+    double distance = station_to_sat.get_distance();
+
+    if (distance<1e-10){
+        return 0;
+    }
     double aux = station_to_sat.dot_product(station_normal_unit);
     
     double sinE = aux/distance;
-    elevation_ = asin(sinE) * 180 / PI;
-    return true;
-
+    return asin(sinE) * 180 / PI;
 }
\ No newline at end of file
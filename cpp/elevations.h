@@ -24,5 +24,8 @@ public:
     }
 
     bool calculate_elevation();
+
+    static SpaceVector station_normal(SpaceVector station_pos);
+    static double elevation(SpaceVector station_pos,SpaceVector station_normal_unit,SpaceVector sat_pos);
 };
 #endif
\ No newline at end of file
@@ -3,10 +3,27 @@
 #include <vector>
 #include <string>
 #include <map>
+#include <cstring>
+#include <cstdint>
+#include <stdexcept>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 #include "spacevector.h"
 #include "elevations.h"
 
+// Binary exchange format (little endian):
+//   char[8]  magic "ELEVBIN1"
+//   uint64   number of stations
+//   uint64   number of epochs
+//   float64  station positions [stations][3]
+//   float64  satellite positions [epochs][3]
+// The output file holds the float32 elevation matrix [epochs][stations].
+const char BINARY_MAGIC[8] = {'E','L','E','V','B','I','N','1'};
+const size_t BINARY_HEADER_SIZE = 8 + 2*sizeof(uint64_t);
+
 bool write_csv(
     const std::string &filename,
     const std::map<std::string, std::vector<std::string>> &values,
@@ -158,17 +175,124 @@ bool read_csv(
     return true;
 }
 
+// Closes the file descriptor when going out of scope, also when an error is thrown
+struct FileDescriptor
+{
+    int fd;
+    explicit FileDescriptor(int fd) : fd(fd) {}
+    ~FileDescriptor()
+    {
+        if (fd >= 0)
+            close(fd);
+    }
+};
+
+// Unmaps the memory map when going out of scope, also when an error is thrown
+struct MemoryMap
+{
+    void *address;
+    size_t size;
+    MemoryMap(void *address, size_t size) : address(address), size(size) {}
+    ~MemoryMap()
+    {
+        if (address != MAP_FAILED)
+            munmap(address, size);
+    }
+};
+
+bool calculate_binary(
+    const std::string &filename,
+    const std::string &output)
+{
+    FileDescriptor fd_in(open(filename.c_str(), O_RDONLY));
+    if (fd_in.fd < 0)
+        throw std::runtime_error("Could not open file: " + filename);
+
+    struct stat file_stat;
+    if (fstat(fd_in.fd, &file_stat) != 0)
+        throw std::runtime_error("Could not stat file: " + filename);
+    size_t input_size = file_stat.st_size;
+    if (input_size < BINARY_HEADER_SIZE)
+        throw std::runtime_error("File " + filename + " is too small");
+
+    MemoryMap input_map(mmap(nullptr, input_size, PROT_READ, MAP_PRIVATE, fd_in.fd, 0), input_size);
+    if (input_map.address == MAP_FAILED)
+        throw std::runtime_error("Could not map file: " + filename);
+    const char *input_bytes = static_cast<const char *>(input_map.address);
+
+    if (std::memcmp(input_bytes, BINARY_MAGIC, sizeof(BINARY_MAGIC)) != 0)
+        throw std::runtime_error("File " + filename + " is not a binary elevation file");
+
+    uint64_t number_of_stations, number_of_epochs;
+    std::memcpy(&number_of_stations, input_bytes + 8, sizeof(uint64_t));
+    std::memcpy(&number_of_epochs, input_bytes + 16, sizeof(uint64_t));
+    if (input_size != BINARY_HEADER_SIZE + 3 * sizeof(double) * (number_of_stations + number_of_epochs))
+        throw std::runtime_error("File " + filename + " has an unexpected size");
+
+    const double *stations = reinterpret_cast<const double *>(input_bytes + BINARY_HEADER_SIZE);
+    const double *sats = stations + 3 * number_of_stations;
+
+    std::vector<SpaceVector> station_positions;
+    std::vector<SpaceVector> station_normals;
+    for (uint64_t j = 0; j < number_of_stations; j++)
+    {
+        SpaceVector station_pos(stations[3 * j], stations[3 * j + 1], stations[3 * j + 2]);
+        station_positions.push_back(station_pos);
+        station_normals.push_back(Elevation::station_normal(station_pos));
+    }
+
+    FileDescriptor fd_out(open(output.c_str(), O_RDWR | O_CREAT | O_TRUNC, 0644));
+    if (fd_out.fd < 0)
+        throw std::runtime_error("Could not open file: " + output);
+
+    size_t output_size = number_of_epochs * number_of_stations * sizeof(float);
+    if (output_size > 0)
+    {
+        if (ftruncate(fd_out.fd, output_size) != 0)
+            throw std::runtime_error("Could not resize file: " + output);
+        MemoryMap output_map(mmap(nullptr, output_size, PROT_READ | PROT_WRITE, MAP_SHARED, fd_out.fd, 0), output_size);
+        if (output_map.address == MAP_FAILED)
+            throw std::runtime_error("Could not map file: " + output);
+        float *elevations = static_cast<float *>(output_map.address);
+
+        for (uint64_t i = 0; i < number_of_epochs; i++)
+        {
+            SpaceVector sat_pos(sats[3 * i], sats[3 * i + 1], sats[3 * i + 2]);
+            for (uint64_t j = 0; j < number_of_stations; j++)
+            {
+                elevations[i * number_of_stations + j] = Elevation::elevation(station_positions[j], station_normals[j], sat_pos);
+            }
+        }
+        if (msync(output_map.address, output_size, MS_SYNC) != 0)
+            throw std::runtime_error("Could not write file: " + output);
+    }
+
+    return true;
+}
+
 int main(int argc, char** argv)
 {
+    try {
+        if (argc==4 && std::string(argv[1])=="--binary"){
+            calculate_binary(argv[2], argv[3]);
+            return 0;
+        }
 
-    if (argc!=3){
-        std::cout<<"Usage: ./main input_file output_file\n";
-        return 0;
+        if (argc!=3){
+            std::cerr<<"Usage: ./main [--binary] input_file output_file\n";
+            return 2;
+        }
+
+        std::string filename = argv[1];
+        std::string output = argv[2];
+        std::vector<Elevation> data;
+        read_csv(filename, data);
+        write_csv(output,data);
+    }
+    catch (const std::exception& e){
+        std::cerr<<"Error: "<<e.what()<<"\n";
+        return 1;
     }
 
-    std::string filename = argv[1];
-    std::string output = argv[2];
-    std::vector<Elevation> data;
-    read_csv(filename, data);
-    write_csv(output,data);
-}
\ No newline at end of file
+    return 0;
+}
@@ -1,6 +1,8 @@
 
 from conversions import norad2prn
-from basics import SpaceVector
+from projections import ecef2latlonheight
+from tle_store import TLEStore,tle_epoch
+from elevations import station_normals
 from satplots_logging import get_logger
 import os
 import requests
@@ -21,13 +23,13 @@ class TLE_element:
         self.line1 = line1
         self.line2 = line2
         self.norad_id = norad_id
-        elems1 = line1.split()
-        self.epoch = datetime(
-            int("20"+elems1[3][:2]), 1, 1) + timedelta(days=float(elems1[3][2:]))
+        self.epoch = tle_epoch(line1)
 
 
 class Celestrak:
     ARCHIVE_PATH = "./downloads/celestrak"
+    STORE_PATH = "./downloads/celestrak/celestrak.sqlite"
+    GROUPS = ["galileo", "gps-ops", "glo-ops", "beidou"]
 
     def __init__(self, config_file="./config/download_config.ini"):
 
@@ -61,31 +63,52 @@ class Celestrak:
         for line in lines:
             if not line.startswith("1 "):
                 continue
-            new_date = datetime(
-                int("20"+line.split()[3][:2]), 1, 1) + timedelta(days=float(line.split()[3][2:]))
-            dates.append(new_date.date())
+            # The archive date is the day after the TLE epoch, the convention of the legacy
+            # directory tree (and of the archive dates migrated from it) which is kept for
+            # consistency: queries by archive date must see the same days for old and new TLEs.
+            dates.append((tle_epoch(line) + timedelta(days=1)).date())
 
         date = Counter(dates).most_common(1)[0][0]
-        date_str = datetime.strftime(date, "%Y%m%d")
-
-        output_dir = Path(self.archive_path) / str(date.year) / \
-                          str(date.month) / str(date.day)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        output_file = output_dir / f"TLE_{date_str}_{group}.txt"
+        new_tles = TLEStore(self.STORE_PATH).add_tles(group, date, lines)
+        self.logger.info(f"Stored {new_tles} new TLEs for {group} on {date}.")
 
-        tmp_file.replace(output_file)
+        tmp_file.unlink()
 
     @classmethod
     def get_tles(cls, date, group=None):
         if isinstance(date, str):
             date = datetime.strptime(date, "%Y/%m/%d")
-        date_str = datetime.strftime(date, "%Y/%m/%d")
-        date_str = datetime.strftime(date, "%Y%m%d")
 
-        if not group:
-            groups = ["galileo", "gps-ops", "glo-ops", "beidou"]
-        else:
-            groups = [group]
+        groups = [group] if group else cls.GROUPS
+        return cls.get_tles_range(date, date, groups)
+
+    @classmethod
+    def get_tles_range(cls, start, end, groups=None):
+        '''
+        Return all TLEs for the provided groups, archived between start and end. Every
+        (group, archive date) missing from the store is read from the legacy directory tree.
+        '''
+        if not groups:
+            groups = cls.GROUPS
+
+        store = TLEStore(cls.STORE_PATH)
+        rows = store.get_tles(start, end, groups)
+        result = [TLE_element(line1, line2, norad_id) for norad_id, line1, line2 in rows]
+
+        archived = store.get_archive_dates(start, end, groups)
+        for date in pd.date_range(start, end):
+            for group in groups:
+                if (group, date.date().isoformat()) not in archived:
+                    result.extend(cls.get_tles_legacy(date, [group]))
+
+        return result
+
+    @classmethod
+    def get_tles_legacy(cls, date, groups):
+        '''
+        Read the TLEs from the legacy downloads/celestrak/YYYY/M/D directory tree.
+        '''
+        date_str = datetime.strftime(date, "%Y%m%d")
 
         result = []
         for group in groups:
@@ -111,18 +134,24 @@ class Celestrak:
 
         return result
 
+    @classmethod
+    def migrate_legacy_archive(cls):
+        '''
+        Import the legacy directory tree into the TLE store.
+        '''
+        return TLEStore(cls.STORE_PATH).migrate(cls.ARCHIVE_PATH, cls.GROUPS)
+
     @classmethod
     def get_norad_ids(cls, date, group=None):
         result = []
         if isinstance(date, str):
             date = datetime.strptime(date, "%Y/%m/%d-%H:%M:%S")
-        indexes = [-2, -1, 0, 1, 2]
-        dates = [date + timedelta(days=i) for i in indexes]
-        for date in dates:
-            tles = cls.get_tles(date, group)
-            for tle in tles:
-                if norad2prn(tle.norad_id):
-                    result.append(tle.norad_id)
+        groups = [group] if group else cls.GROUPS
+        tles = cls.get_tles_range(date - timedelta(days=2), date + timedelta(days=2), groups)
+
+        for tle in tles:
+            if tle.norad_id not in result and norad2prn(tle.norad_id):
+                result.append(tle.norad_id)
 
         return result
 
@@ -136,7 +165,7 @@ class Celestrak:
             return lines
 
         yesterday = datetime.now() - timedelta(days=1)
-        yesterday_str = datetime.strftime(yesterday, "%Y/%m/%d")
+        yesterday_str = datetime.strftime(yesterday, "%Y/%m/%d-%H:%M:%S")
         norad_ids = cls.get_norad_ids(yesterday_str)
         prns = []
         for norad_id in norad_ids:
@@ -170,20 +199,19 @@ class Celestrak:
         df = pd.read_csv(tmp_file)
         epochs = [epoch.date() for epoch in pd.to_datetime(df.EPOCH)]
         date = Counter(epochs).most_common(1)[0][0]
-        date_str = datetime.strftime(date, "%Y%m%d")
-
-        output_dir = Path(self.archive_path) / str(date.year) / \
-                          str(date.month) / str(date.day)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        output_file = output_dir / f"{date_str}_{group}.csv"
+        new_records = TLEStore(self.STORE_PATH).add_csv(group, date, df)
+        self.logger.info(f"Stored {new_records} new CSV records for {group} on {date}.")
 
-        tmp_file.replace(output_file)
+        tmp_file.unlink()
 
     @classmethod
     def get_csv(cls, date, group):
         if isinstance(date, str):
             date = datetime.strptime(date, "%Y/%m/%d")
-        date_str = datetime.strftime(date, "%Y/%m/%d")
+
+        df = TLEStore(cls.STORE_PATH).get_csv(date, group)
+        if not df.empty:
+            return df
 
         date_str = datetime.strftime(date, "%Y%m%d")
         file_dir = Path(cls.ARCHIVE_PATH) / str(date.year) / \
@@ -198,9 +226,13 @@ class Celestrak:
 
 
 class IGS:
+    CSV_PATH = "./tmp/IGS_stations.csv"
+    CATALOG_PATH = "./tmp/IGS_stations_catalog.npz"
+    _catalog = None
+
     @classmethod
     def get_stations_df(cls):
-        tmp_file = Path("./tmp/IGS_stations.csv")
+        tmp_file = Path(cls.CSV_PATH)
         if not tmp_file.exists():
             req = requests.get(
                 "https://files.igs.org/pub/station/general/IGSNetwork.csv")
@@ -212,26 +244,76 @@ class IGS:
         return df
 
     @classmethod
-    def get_IGS_stations_df_full(cls):
+    def get_station_catalog(cls):
+        '''
+        Return the station catalog: a dict of contiguous arrays with the station ids and
+        names, the ECEF positions, the geodetic coordinates and the GRS80 unit normals.
+        The catalog is persisted next to IGSNetwork.csv and only rebuilt when it changes.
+        '''
+        csv_file = Path(cls.CSV_PATH)
+        if not csv_file.exists():
+            cls.get_stations_df()
+        source = np.array([csv_file.stat().st_mtime_ns, csv_file.stat().st_size], dtype=np.int64)
+
+        if cls._catalog is not None and np.array_equal(cls._catalog["source"], source):
+            return cls._catalog
+
+        catalog_file = Path(cls.CATALOG_PATH)
+        if catalog_file.exists():
+            with np.load(catalog_file, allow_pickle=False) as data:
+                catalog = {key: data[key] for key in data.files}
+            if np.array_equal(catalog["source"], source):
+                cls._catalog = catalog
+                return catalog
+
+        cls._catalog = cls.build_station_catalog(source)
+        return cls._catalog
+
+    @classmethod
+    def build_station_catalog(cls, source):
         df = cls.get_stations_df()
-        Xs = list(df.X)
-        Ys = list(df.Y)
-        Zs = list(df.Z)
-        lats = []
-        lons = []
-        for i in range(len(Xs)):
-            new_pos = SpaceVector(Xs[i], Ys[i], Zs[i], skip_llh=False)
-            lats.append(new_pos.lat)
-            lons.append(new_pos.lon)
-
-        new_df = pd.DataFrame(zip(lats, lons), columns=["lat", "lon"])
-        result_df = pd.concat([df, new_df], axis=1)
+        ecef = np.ascontiguousarray(df[["X", "Y", "Z"]].to_numpy(dtype=float))
+        lats, lons, heights = ecef2latlonheight(ecef[:, 0], ecef[:, 1], ecef[:, 2])
+        catalog = {
+            "source": source,
+            "station": df.Station.to_numpy(dtype=str),
+            "station_full": df.StationFull.to_numpy(dtype=str),
+            "receiver": df.ReceiverName.fillna("").to_numpy(dtype=str),
+            "antenna": df.AntennaName.fillna("").to_numpy(dtype=str),
+            "clock": df.ClockType.fillna("").to_numpy(dtype=str),
+            "ecef": ecef,
+            "llh": np.column_stack([lats, lons, heights]),
+            "normals": station_normals(ecef),
+        }
+
+        catalog_file = Path(cls.CATALOG_PATH)
+        tmp_file = catalog_file.with_name(f"{catalog_file.stem}_{os.getpid()}.npz")
+        np.savez(tmp_file, **catalog)
+        tmp_file.replace(catalog_file)
+
+        return catalog
+
+    @classmethod
+    def get_IGS_stations_df_full(cls):
+        catalog = cls.get_station_catalog()
+        result_df = pd.DataFrame.from_dict({
+            "StationFull": catalog["station_full"],
+            "Station": catalog["station"],
+            "X": catalog["ecef"][:, 0],
+            "Y": catalog["ecef"][:, 1],
+            "Z": catalog["ecef"][:, 2],
+            "ReceiverName": catalog["receiver"],
+            "AntennaName": catalog["antenna"],
+            "ClockType": catalog["clock"],
+            "lat": catalog["llh"][:, 0],
+            "lon": catalog["llh"][:, 1],
+            "height": catalog["llh"][:, 2]})
 
         return result_df
 
     @classmethod
     def get_IGS_station_list(cls):
-        return list(pd.unique(cls.get_stations_df().Station))
+        return list(dict.fromkeys(cls.get_station_catalog()["station"].tolist()))
 
 
 class Nasa:
@@ -0,0 +1,203 @@
+'''
+Persisted per-day (epochs x stations) elevation matrices, one per satellite, which allow
+to derive the stations in view for any elevation mask without recalculating.
+Matrices are stored as memory-mappable int16 .npy files (centidegrees), with a JSON file
+describing the epochs, the satellite ground track and the station order.
+'''
+import math
+import json
+import numpy as np
+from pathlib import Path
+from datetime import datetime,timedelta
+
+from snippets import EPOCH_FORMAT,COORDINATE_PRECISION
+from coverage import CONSTELLATIONS
+
+ELEVATION_SCALE = 100
+
+
+class ElevationWriter:
+    '''
+    Write the elevation matrix of a satellite for a day in consecutive epoch chunks. The files
+    are written with a .part suffix and renamed on close.
+    '''
+    def __init__(self,basepath,prn,norad_id,start,sampling,number_of_epochs,stations):
+        self.basepath = Path(basepath)
+        self.basepath.mkdir(parents=True,exist_ok=True)
+        self.prn = prn
+        self.metadata = {
+            "prn":prn,
+            "norad_id":norad_id,
+            "start":datetime.strftime(start,EPOCH_FORMAT),
+            "sampling":sampling,
+            "scale":ELEVATION_SCALE,
+            "stations":list(stations),
+            "lats":[],
+            "lons":[]}
+        self.part_file = self.basepath / f"{prn}.npy.part"
+        self.elevations = np.lib.format.open_memmap(self.part_file,mode="w+",dtype=np.int16,shape=(number_of_epochs,len(stations)))
+        self.index = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+    def write(self,elevations,lats,lons):
+        '''
+        Append the (epochs x stations) elevations in degrees, and the satellite lats and lons.
+        '''
+        number_of_epochs = len(elevations)
+        if self.index+number_of_epochs>len(self.elevations):
+            raise Exception(f"Too many epochs written for {self.prn}: {self.index+number_of_epochs} > {len(self.elevations)}")
+
+        # Rounding down keeps the mask test exact for masks with a resolution of 0.01 degrees
+        self.elevations[self.index:self.index+number_of_epochs] = np.floor(np.asarray(elevations)*ELEVATION_SCALE)
+        self.metadata["lats"].extend(round(lat,COORDINATE_PRECISION) for lat in np.asarray(lats,dtype=float).tolist())
+        self.metadata["lons"].extend(round(lon,COORDINATE_PRECISION) for lon in np.asarray(lons,dtype=float).tolist())
+        self.index += number_of_epochs
+
+    def close(self):
+        if self.elevations is None:
+            return
+        if self.index!=len(self.elevations):
+            self.abort()
+            raise Exception(f"Elevation matrix of {self.prn} incomplete: {self.index} of {len(self.elevations)} epochs written")
+
+        self.elevations.flush()
+        self.elevations = None
+        self.part_file.replace(self.basepath / f"{self.prn}.npy")
+        metadata_file = self.basepath / f"{self.prn}.json.part"
+        with metadata_file.open("w") as f:
+            json.dump(self.metadata,f)
+        metadata_file.replace(self.basepath / f"{self.prn}.json")
+
+    def abort(self):
+        self.elevations = None
+        self.part_file.unlink(missing_ok=True)
+
+
+class ElevationTensor:
+    '''
+    Read access to a stored elevation matrix, the matrix itself is memory-mapped.
+    '''
+    def __init__(self,basepath,prn):
+        basepath = Path(basepath)
+        with (basepath / f"{prn}.json").open("r") as f:
+            self.metadata = json.load(f)
+        self.elevations = np.load(basepath / f"{prn}.npy",mmap_mode="r")
+        self.prn = prn
+        self.stations = np.array(self.metadata["stations"])
+
+    @classmethod
+    def get_path(cls,year,month,day):
+        return Path(f"./output/{year}/{str(month).zfill(2)}/{str(day).zfill(2)}/elevations")
+
+    @classmethod
+    def exists(cls,year,month,day,prn=None):
+        basepath = cls.get_path(year,month,day)
+        if prn:
+            return (basepath / f"{prn}.npy").exists() and (basepath / f"{prn}.json").exists()
+        return basepath.exists() and any(basepath.glob("*.npy"))
+
+    @classmethod
+    def load(cls,year,month,day,prn):
+        '''
+        Return the stored elevation matrix for the provided date and prn, None if not available.
+        '''
+        if not cls.exists(year,month,day,prn):
+            return None
+        return ElevationTensor(cls.get_path(year,month,day),prn)
+
+    def get_epochs(self):
+        start = datetime.strptime(self.metadata["start"],EPOCH_FORMAT)
+        step = timedelta(minutes=self.metadata["sampling"])
+        return [datetime.strftime(start+i*step,EPOCH_FORMAT) for i in range(len(self.elevations))]
+
+    def get_elevations(self):
+        '''
+        Return the elevation matrix in degrees.
+        '''
+        return np.asarray(self.elevations,dtype=float)/self.metadata["scale"]
+
+    def in_view(self,mask):
+        '''
+        Return the boolean (epochs x stations) matrix of stations with an elevation of at least
+        mask degrees (exact for masks with a resolution of 0.01 degrees).
+        '''
+        return np.asarray(self.elevations)>=math.ceil(round(float(mask)*self.metadata["scale"],6))
+
+    def get_sat_points(self,mask):
+        '''
+        Return the sat_points geoJSON for the provided mask.
+        '''
+        in_view = self.in_view(mask)
+        numbers = in_view.sum(axis=1).tolist()
+        features = []
+        for i,(epoch,lat,lon) in enumerate(zip(self.get_epochs(),self.metadata["lats"],self.metadata["lons"])):
+            features.append({
+                "geometry":{"coordinates":[lon,lat],"type":"Point"},
+                "properties":{
+                    "epoch":epoch,
+                    "number_stations_in_view":numbers[i],
+                    "prn":self.prn,
+                    "stations_in_view":" ".join(self.stations[in_view[i]])},
+                "type":"Feature"})
+
+        return {"features":features,"type":"FeatureCollection"}
+
+    def get_timeseries(self,mask):
+        '''
+        Return the number of stations in view per epoch for the provided mask.
+        '''
+        numbers = self.in_view(mask).sum(axis=1).tolist()
+        return [{"epoch":epoch,"stations":number} for epoch,number in zip(self.get_epochs(),numbers)]
+
+
+def get_station_visibility(year,month,day,mask,stations=None):
+    '''
+    Invert the stored elevation matrices of all satellites of the provided date: for every
+    station (or the provided stations only, if known), the visible prns per epoch and the number of
+    visible satellites per constellation per epoch.
+    returns dict: {station:{"epochs":[...],"prns":[[...],...],"counts":{"G":[...],...}},...}
+    '''
+    basepath = ElevationTensor.get_path(year,month,day)
+    if not basepath.exists():
+        return {}
+
+    tensors = [ElevationTensor(basepath,filepath.stem) for filepath in sorted(basepath.glob("*.npy"))]
+    epochs = sorted(set(epoch for tensor in tensors for epoch in tensor.get_epochs()))
+    epoch_indexes = {epoch:i for i,epoch in enumerate(epochs)}
+    known_stations = sorted(set(station for tensor in tensors for station in tensor.metadata["stations"]))
+    if stations is None:
+        stations = known_stations
+    else:
+        stations = [station for station in stations if station in known_stations]
+
+    prns = {station:[[] for _ in epochs] for station in stations}
+    counts = {station:{constellation:np.zeros(len(epochs),dtype=int) for constellation in CONSTELLATIONS} for station in stations}
+    for tensor in tensors:
+        rows = np.array([epoch_indexes[epoch] for epoch in tensor.get_epochs()],dtype=int)
+        columns = {station:i for i,station in enumerate(tensor.metadata["stations"])}
+        selected = [station for station in stations if station in columns]
+        if not selected:
+            continue
+        in_view = tensor.in_view(mask)[:,[columns[station] for station in selected]]
+        constellation = tensor.prn[0]
+        for j,station in enumerate(selected):
+            visible_rows = rows[in_view[:,j]]
+            for row in visible_rows.tolist():
+                prns[station][row].append(tensor.prn)
+            if constellation in counts[station]:
+                counts[station][constellation][visible_rows] += 1
+
+    return {
+        station:{
+            "epochs":epochs,
+            "prns":prns[station],
+            "counts":{constellation:values.tolist() for constellation,values in counts[station].items()}
+        } for station in stations}
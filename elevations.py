@@ -0,0 +1,52 @@
+'''
+Vectorized elevation calculations
+'''
+import numpy as np
+
+EARTH_FLATTE_GRS80 = 1.0/298.257222101
+
+def station_normals(station_xyz):
+    '''
+    Return the GRS80 unit normals (shape (stations,3)) for the provided
+    station ECEF positions (shape (stations,3)). The input is never modified.
+    '''
+    normals = np.array(station_xyz,dtype=float).reshape(-1,3)
+    normals[:,2] /= ((1.0 - EARTH_FLATTE_GRS80) * (1.0 - EARTH_FLATTE_GRS80))
+    normals /= np.linalg.norm(normals,axis=1)[:,np.newaxis]
+    return normals
+
+def elevation_matrix(station_xyz,sat_xyz,normals=None):
+    '''
+    Return the (epochs x stations) elevation matrix in degrees, for the station ECEF
+    positions (shape (stations,3)) and the satellite ECEF positions (shape (epochs,3)).
+    The same normal correction as Geometry.get_elevation is applied.
+    '''
+    station_xyz = np.asarray(station_xyz,dtype=float).reshape(-1,3)
+    sat_xyz = np.asarray(sat_xyz,dtype=float).reshape(-1,3)
+    if normals is None:
+        normals = station_normals(station_xyz)
+
+    station_to_sat = sat_xyz[:,np.newaxis,:] - station_xyz[np.newaxis,:,:]
+    return _elevations(station_to_sat,normals[np.newaxis,:,:])
+
+def elevation_pairs(station_xyz,sat_xyz,normals=None):
+    '''
+    Return the elevations in degrees for pairs of station ECEF positions (shape (n,3))
+    and satellite ECEF positions (shape (n,3)).
+    '''
+    station_xyz = np.asarray(station_xyz,dtype=float).reshape(-1,3)
+    sat_xyz = np.asarray(sat_xyz,dtype=float).reshape(-1,3)
+    if normals is None:
+        normals = station_normals(station_xyz)
+
+    return _elevations(sat_xyz - station_xyz,normals)
+
+def _elevations(station_to_sat,normals):
+    distance = np.linalg.norm(station_to_sat,axis=-1)
+    aux = np.sum(station_to_sat*normals,axis=-1)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        sinE = np.clip(aux/distance,-1.0,1.0)
+    elev = np.degrees(np.arcsin(sinE))
+    elev[distance<1e-10] = 0
+
+    return elev
@@ -0,0 +1,151 @@
+'''
+Chebyshev ephemeris: per-interval Chebyshev coefficients of the ECEF position of a satellite,
+which allow to evaluate its position at any epoch of the day without propagating.
+'''
+import numpy as np
+from pathlib import Path
+from datetime import datetime,timedelta
+from numpy.polynomial import chebyshev
+
+from snippets import EPOCH_FORMAT,COORDINATE_PRECISION
+from projections import ecef2latlonheight
+
+
+class Ephemeris:
+    '''
+    Piecewise Chebyshev representation of the ECEF position (m) between start and end.
+    bounds holds the interval boundaries in seconds from start, coefficients has shape
+    (intervals,3,degree+1). max_error is the largest deviation (m) from the propagated
+    positions found during validation. A rejected ephemeris (error above the tolerance) is
+    stored to mark its day as done, but is not used.
+    '''
+    def __init__(self,prn,start,bounds,coefficients,max_error=None,rejected=False):
+        self.prn = prn
+        self.start = start
+        self.bounds = np.asarray(bounds,dtype=float)
+        self.coefficients = np.asarray(coefficients,dtype=float)
+        self.max_error = max_error
+        self.rejected = rejected
+
+    @property
+    def degree(self):
+        return self.coefficients.shape[2]-1
+
+    @property
+    def end(self):
+        return self.start + timedelta(seconds=float(self.bounds[-1]))
+
+    @classmethod
+    def fit(cls,propagate,prn,start,end,interval=180,degree=14,breaks=None):
+        '''
+        Fit the coefficients to the positions returned by propagate(offsets) (ECEF positions of
+        shape (n,3) at start + offsets in seconds), at the Chebyshev nodes of every interval
+        (in minutes) between start and end. The propagated positions jump when switching TLEs,
+        so the offsets of the switches are provided as additional interval boundaries (breaks).
+        '''
+        duration = (end-start).total_seconds()
+        if duration<=0:
+            raise Exception(f"Bad range provided for the ephemeris of {prn}: {start} - {end}")
+        bounds = np.arange(0.0,duration,interval*60.0)
+        if breaks is not None and len(breaks):
+            bounds = np.union1d(bounds,np.asarray(breaks,dtype=float))
+        bounds = np.append(bounds[bounds<duration],duration)
+
+        # Twice as many nodes as coefficients, which keeps the least squares fit well conditioned
+        number_of_nodes = 2*(degree+1)
+        nodes = np.cos(np.pi*(np.arange(number_of_nodes)+0.5)/number_of_nodes)
+        t0 = bounds[:-1,np.newaxis]
+        t1 = bounds[1:,np.newaxis]
+        offsets = (t0+t1)/2 + nodes*(t1-t0)/2
+        xyz = np.asarray(propagate(offsets.ravel())).reshape(len(t0),number_of_nodes,3)
+
+        coefficients = np.zeros((len(t0),3,degree+1))
+        for i in range(len(t0)):
+            coefficients[i] = chebyshev.chebfit(nodes,xyz[i],degree).T
+
+        return Ephemeris(prn,start,bounds,coefficients)
+
+    def evaluate_offsets(self,offsets):
+        '''
+        Return the ECEF positions (shape (n,3)) at start + offsets (in seconds).
+        '''
+        offsets = np.atleast_1d(np.asarray(offsets,dtype=float))
+        if len(offsets) and (offsets.min()<self.bounds[0] or offsets.max()>self.bounds[-1]):
+            raise Exception(f"Epochs outside of the ephemeris of {self.prn}: {self.start} - {self.end}")
+
+        # An epoch on a boundary belongs to the later interval, as in TLEIndex.get_segments
+        intervals = np.clip(np.searchsorted(self.bounds,offsets,side="right")-1,0,len(self.coefficients)-1)
+        t0 = self.bounds[intervals]
+        t1 = self.bounds[intervals+1]
+        tau = (2*offsets - t0 - t1)/(t1-t0)
+        basis = chebyshev.chebvander(tau,self.degree)
+
+        return np.einsum("nk,nck->nc",basis,self.coefficients[intervals])
+
+    def evaluate(self,epochs):
+        '''
+        Return the ECEF positions (shape (n,3)) at the provided datetime epochs.
+        '''
+        return self.evaluate_offsets([(epoch-self.start).total_seconds() for epoch in epochs])
+
+    def get_positions(self,epochs):
+        '''
+        Return the ECEF and geodetic positions at the provided datetime epochs, together with
+        the error bound (m) of the ephemeris.
+        '''
+        xyz = self.evaluate(epochs)
+        lats,lons,heights = ecef2latlonheight(xyz[:,0],xyz[:,1],xyz[:,2],method="closed_form")
+        return {
+            "prn":self.prn,
+            "max_error":self.max_error,
+            "epochs":[datetime.strftime(epoch,"%Y/%m/%d-%H:%M:%S.%f") for epoch in epochs],
+            "x":xyz[:,0].round(3).tolist(),
+            "y":xyz[:,1].round(3).tolist(),
+            "z":xyz[:,2].round(3).tolist(),
+            "lat":np.round(lats,COORDINATE_PRECISION).tolist(),
+            "lon":np.round(lons,COORDINATE_PRECISION).tolist(),
+            "height":np.round(heights,3).tolist()}
+
+    def validate(self,offsets,xyz):
+        '''
+        Compare the ephemeris with propagated positions (xyz at start + offsets in seconds) and
+        keep the largest deviation (m) as the error bound. The positions can be provided in
+        consecutive chunks, the bound is the largest deviation over all of them.
+        '''
+        errors = np.linalg.norm(self.evaluate_offsets(offsets)-np.asarray(xyz,dtype=float).reshape(-1,3),axis=1)
+        max_error = float(errors.max()) if len(errors) else 0.0
+        self.max_error = max_error if self.max_error is None else max(self.max_error,max_error)
+        return self.max_error
+
+    def save(self,basepath):
+        basepath = Path(basepath)
+        basepath.mkdir(parents=True,exist_ok=True)
+        tmp_file = basepath / (self.prn+".npz.part")
+        with tmp_file.open("wb") as f:
+            np.savez(f,
+                prn=self.prn,
+                start=datetime.strftime(self.start,EPOCH_FORMAT),
+                bounds=self.bounds,
+                coefficients=self.coefficients,
+                max_error=np.nan if self.max_error is None else self.max_error,
+                rejected=self.rejected)
+        tmp_file.replace(basepath / (self.prn+".npz"))
+
+    @classmethod
+    def load(cls,year,month,day,prn):
+        '''
+        Return the stored ephemeris for the provided date and prn, None if not available.
+        '''
+        filepath = Path(f"./output/{year}/{str(month).zfill(2)}/{str(day).zfill(2)}/ephemeris/{prn}.npz")
+        if not filepath.exists():
+            return None
+
+        with np.load(filepath) as data:
+            max_error = float(data["max_error"])
+            return Ephemeris(
+                str(data["prn"]),
+                datetime.strptime(str(data["start"]),EPOCH_FORMAT),
+                data["bounds"],
+                data["coefficients"],
+                None if np.isnan(max_error) else max_error,
+                bool(data["rejected"]) if "rejected" in data else False)
@@ -0,0 +1,270 @@
+'''
+Visibility forecast for an arbitrary receiver location: elevations, azimuths and passes of all
+satellites, evaluated from the stored Chebyshev ephemerides instead of propagating.
+'''
+import math
+import threading
+import configparser
+import numpy as np
+from pathlib import Path
+from collections import OrderedDict
+from datetime import datetime,timedelta,timezone
+
+from snippets import EPOCH_FORMAT
+from ephemeris import Ephemeris
+from coverage import CONSTELLATIONS
+from elevations import elevation_matrix,station_normals
+from projections import latlonheight2ecef
+
+
+class ReceiverForecast:
+    '''
+    Forecasts are computed for the location rounded to location_decimals degrees (and the
+    height to 10 m), on a grid of step seconds anchored at the time bucket of the requested
+    start. The grid of a bucket covers every start within the bucket, so results are cached per
+    rounded location, time bucket and state of the ephemerides, and cut to the requested window.
+    Epochs not covered by the stored ephemerides are left out: passes starting or ending next
+    to them have an unknown (None) rise or set. The cache holds float32 grids and is bounded by
+    forecast_cache_size entries and forecast_cache_mb megabytes.
+    '''
+    def __init__(self,config_file="./config/config.ini"):
+        self.config = configparser.ConfigParser()
+        self.config.read(config_file)
+        self.elevation_mask = self.config.getfloat('general','elevation_mask',fallback=5)
+        self.step = self.config.getfloat('general','forecast_step',fallback=60)
+        self.bucket = self.config.getint('general','forecast_bucket',fallback=300)
+        self.location_decimals = self.config.getint('general','forecast_location_decimals',fallback=2)
+        self.max_hours = self.config.getfloat('general','forecast_max_hours',fallback=24)
+        self.cache_size = self.config.getint('general','forecast_cache_size',fallback=256)
+        self.cache_bytes = self.config.getint('general','forecast_cache_mb',fallback=64)*1024*1024
+        self.ephemeris_days = self.config.getint('general','forecast_ephemeris_days',fallback=4)
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.ephemerides = OrderedDict()
+
+    def get_bucket(self,epoch):
+        midnight = datetime.combine(epoch.date(),datetime.min.time())
+        return midnight + timedelta(seconds=math.floor((epoch-midnight).total_seconds()/self.bucket)*self.bucket)
+
+    def get_ephemeris_dir(self,date):
+        return Path(f"./output/{date.year}/{str(date.month).zfill(2)}/{str(date.day).zfill(2)}/ephemeris")
+
+    def get_sources(self,start,end):
+        '''
+        Return the state of the ephemerides between start and end: the modification time of the
+        ephemeris directory of every day (files are renamed into it once complete).
+        '''
+        sources = []
+        date = start.date()
+        while date<=end.date():
+            basepath = self.get_ephemeris_dir(date)
+            sources.append((date,basepath.stat().st_mtime_ns if basepath.exists() else 0))
+            date += timedelta(days=1)
+        return tuple(sources)
+
+    def load_ephemerides(self,date,mtime):
+        '''
+        Return the stored ephemerides of the date ({prn:Ephemeris}), reloaded when they changed.
+        Only the ephemerides of the ephemeris_days most recently used dates are kept in memory.
+        '''
+        with self.lock:
+            if date in self.ephemerides and self.ephemerides[date][0]==mtime:
+                self.ephemerides.move_to_end(date)
+                return self.ephemerides[date][1]
+
+        ephemerides = {}
+        for filepath in sorted(self.get_ephemeris_dir(date).glob("*.npz")):
+            ephemeris = Ephemeris.load(date.year,date.month,date.day,filepath.stem)
+            if ephemeris and not ephemeris.rejected:
+                ephemerides[ephemeris.prn] = ephemeris
+
+        with self.lock:
+            self.ephemerides[date] = (mtime,ephemerides)
+            self.ephemerides.move_to_end(date)
+            while len(self.ephemerides)>self.ephemeris_days:
+                self.ephemerides.popitem(last=False)
+        return ephemerides
+
+    def get_forecast(self,lat,lon,height=0.0,hours=6,start=None,mask=None):
+        '''
+        Return the forecast for the receiver at lat, lon (degrees) and height (m) between start
+        (now if not provided) and start + hours.
+        '''
+        if not -90<=lat<=90 or not -180<=lon<=180:
+            raise Exception(f"Bad location provided: {lat}, {lon}")
+        if not 0<hours<=self.max_hours:
+            raise Exception(f"The forecast horizon must be between 0 and {self.max_hours} hours.")
+
+        lat = round(lat,self.location_decimals)
+        lon = round(lon,self.location_decimals)
+        height = round(height,-1)
+        mask = self.elevation_mask if mask is None else mask
+        start = start or datetime.now(timezone.utc).replace(tzinfo=None)
+        end = start + timedelta(hours=hours)
+        bucket_start = self.get_bucket(start)
+        bucket_end = bucket_start + timedelta(hours=hours,seconds=self.bucket)
+        sources = self.get_sources(bucket_start,bucket_end)
+
+        key = (lat,lon,height,bucket_start,hours,mask,sources)
+        with self.lock:
+            grid = self.cache.get(key)
+            if grid is not None:
+                self.cache.move_to_end(key)
+
+        if grid is None:
+            ephemerides = {}
+            for date,mtime in sources:
+                for prn,ephemeris in self.load_ephemerides(date,mtime).items():
+                    ephemerides.setdefault(prn,[]).append(ephemeris)
+            if not ephemerides:
+                return None
+
+            grid = self.calculate(lat,lon,height,bucket_start,bucket_end,mask,ephemerides)
+            with self.lock:
+                if key not in self.cache:
+                    self.cache[key] = grid
+                    self.cached_bytes += grid["nbytes"]
+                while len(self.cache)>self.cache_size or (self.cached_bytes>self.cache_bytes and len(self.cache)>1):
+                    self.cached_bytes -= self.cache.popitem(last=False)[1]["nbytes"]
+
+        return self.select(grid,lat,lon,height,mask,start,end)
+
+    def calculate(self,lat,lon,height,start,end,mask,ephemerides):
+        '''
+        Return the elevations, azimuths and passes of all satellites on the grid of the
+        window [start,end]: {"offsets","elevations","azimuths","passes","start","nbytes"}, with
+        float32 elevations and azimuths. Passes are tuples (prn,rise,set,first,last) with rise
+        and set in seconds from start (None if unknown), and first and last the indexes of the
+        grid epochs of the pass.
+        '''
+        receiver_xyz = np.array(latlonheight2ecef(lat,lon,height,method="closed_form"),dtype=float).reshape(1,3)
+        receiver_normal = station_normals(receiver_xyz)
+        lat_rad = math.radians(lat)
+        lon_rad = math.radians(lon)
+        east = np.array([-math.sin(lon_rad),math.cos(lon_rad),0.0])
+        north = np.array([-math.sin(lat_rad)*math.cos(lon_rad),-math.sin(lat_rad)*math.sin(lon_rad),math.cos(lat_rad)])
+
+        def get_elevations(prn,offsets):
+            xyz = self.evaluate(ephemerides[prn],start,offsets)
+            return elevation_matrix(receiver_xyz,xyz,receiver_normal)[:,0],xyz
+
+        duration = (end-start).total_seconds()
+        offsets = np.append(np.arange(0.0,duration,self.step),duration)
+        all_elevations = {}
+        all_azimuths = {}
+        passes = []
+        for prn in sorted(ephemerides):
+            elevations,xyz = get_elevations(prn,offsets)
+            relative = xyz - receiver_xyz
+            all_elevations[prn] = elevations.astype(np.float32)
+            all_azimuths[prn] = (np.degrees(np.arctan2(relative@east,relative@north)) % 360).astype(np.float32)
+            known = ~np.isnan(elevations)
+            visible = known & (elevations>=mask)
+
+            # Mask crossings between known grid epochs are bisected down to a second
+            indexes = np.flatnonzero(known[1:] & known[:-1] & (visible[1:]!=visible[:-1]))
+            a = offsets[indexes]
+            b = offsets[indexes+1]
+            rising = visible[indexes+1]
+            while len(a) and np.max(b-a)>1.0:
+                c = (a+b)/2
+                visible_c = get_elevations(prn,c)[0]>=mask
+                same_as_a = visible_c!=rising
+                a = np.where(same_as_a,c,a)
+                b = np.where(same_as_a,b,c)
+            events = [(index,crossing,rise) for index,crossing,rise in zip(indexes.tolist(),((a+b)/2).tolist(),rising.tolist())]
+
+            # Passes next to epochs without ephemeris start or end at an unknown time
+            for index in np.flatnonzero(known[1:]!=known[:-1]).tolist():
+                if known[index+1] and visible[index+1]:
+                    events.append((index,None,True))
+                elif known[index] and visible[index]:
+                    events.append((index,None,False))
+
+            first = 0 if visible[0] else None
+            rise_time = 0.0
+            for index,crossing,rise in sorted(events,key=lambda event: event[0]):
+                if rise:
+                    first,rise_time = index+1,crossing
+                elif first is not None:
+                    passes.append((prn,rise_time,crossing,first,index))
+                    first = None
+            if first is not None:
+                passes.append((prn,rise_time,duration,first,len(offsets)-1))
+
+        nbytes = offsets.nbytes + sum(values.nbytes for values in all_elevations.values()) + sum(values.nbytes for values in all_azimuths.values())
+        return {"offsets":offsets,"elevations":all_elevations,"azimuths":all_azimuths,"passes":passes,"start":start,"nbytes":nbytes}
+
+    def select(self,grid,lat,lon,height,mask,start,end):
+        '''
+        Cut the forecast of a bucket grid to the window [start,end].
+        '''
+        start_offset = (start-grid["start"]).total_seconds()
+        end_offset = (end-grid["start"]).total_seconds()
+        offsets = grid["offsets"]
+        selection = (offsets>=start_offset) & (offsets<=end_offset)
+        epochs = [grid["start"]+timedelta(seconds=offset) for offset in offsets[selection].tolist()]
+
+        def to_epoch(offset):
+            return datetime.strftime(grid["start"]+timedelta(seconds=offset),EPOCH_FORMAT)
+
+        counts = {constellation:np.zeros(len(epochs),dtype=int) for constellation in CONSTELLATIONS}
+        satellites = []
+        for prn,elevations in grid["elevations"].items():
+            elevations = elevations[selection].astype(float)
+            known = ~np.isnan(elevations)
+            if prn[0] in counts:
+                counts[prn[0]] += known & (elevations>=mask)
+            # Ranges of consecutive grid epochs with ephemerides
+            edges = np.flatnonzero(np.diff(np.concatenate([[False],known,[False]]).astype(int)))
+            satellites.append({
+                "prn":prn,
+                "coverage":[[datetime.strftime(epochs[first],EPOCH_FORMAT),datetime.strftime(epochs[last-1],EPOCH_FORMAT)] for first,last in zip(edges[::2].tolist(),edges[1::2].tolist())],
+                "elevation":[None if np.isnan(value) else value for value in np.round(elevations,2).tolist()],
+                "azimuth":[None if np.isnan(value) else value for value in np.round(grid["azimuths"][prn][selection].astype(float),2).tolist()]})
+
+        passes = []
+        for prn,rise_time,set_time,first,last in grid["passes"]:
+            rise_bound = offsets[first] if rise_time is None else rise_time
+            set_bound = offsets[last] if set_time is None else set_time
+            if set_bound<start_offset or rise_bound>=end_offset:
+                continue
+            if rise_bound<start_offset:
+                rise_time = start_offset
+            if set_bound>end_offset:
+                set_time = end_offset
+            in_window = selection[first:last+1]
+            max_elevation = float(np.max(grid["elevations"][prn][first:last+1][in_window].astype(float))) if in_window.any() else None
+            passes.append({
+                "prn":prn,
+                "rise":None if rise_time is None else to_epoch(rise_time),
+                "set":None if set_time is None else to_epoch(set_time),
+                "max_elevation":None if max_elevation is None else round(max_elevation,2)})
+
+        return {
+            "lat":lat,
+            "lon":lon,
+            "height":height,
+            "elevation_mask":mask,
+            "start":datetime.strftime(start,EPOCH_FORMAT),
+            "end":datetime.strftime(end,EPOCH_FORMAT),
+            "epochs":[datetime.strftime(epoch,EPOCH_FORMAT) for epoch in epochs],
+            "satellites":satellites,
+            "passes":sorted(passes,key=lambda p: (p["rise"] or p["set"] or "",p["prn"])),
+            "counts":{constellation:values.tolist() for constellation,values in counts.items()}}
+
+    def evaluate(self,ephemerides,start,offsets):
+        '''
+        Return the ECEF positions at start + offsets (in seconds) from the ephemerides of
+        consecutive days, NaN where none of them covers the epoch.
+        '''
+        xyz = np.full((len(offsets),3),np.nan)
+        done = np.zeros(len(offsets),dtype=bool)
+        for ephemeris in ephemerides:
+            shifted = offsets - (ephemeris.start-start).total_seconds()
+            selection = ~done & (shifted>=ephemeris.bounds[0]) & (shifted<=ephemeris.bounds[-1])
+            if selection.any():
+                xyz[selection] = ephemeris.evaluate_offsets(shifted[selection])
+                done |= selection
+        return xyz
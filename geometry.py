@@ -1,49 +1,93 @@
 '''
 Positions manager class
 '''
-import os
 import pytz
 import math
+import shutil
+import subprocess
+import contextlib
+import tempfile
 import pandas as pd
 import numpy as np
 import datetime
 import configparser
 from pathlib import Path
-from skyfield.api import EarthSatellite,load
+from concurrent.futures import ProcessPoolExecutor,as_completed
+from skyfield.api import EarthSatellite,load,wgs84
+from skyfield.framelib import itrs
 #import cartopy.crs as ccrs
 #import matplotlib.pyplot as plt
 #from matplotlib.cm import get_cmap
 
 #from plotting import Plotting
 from data_download import Celestrak,IGS
-from basics import SpaceVector
+from basics import SpaceVector,SpaceVectorArray
 from satplots_logging import get_logger
 from grid import Grid
+from tle_index import TLEIndex
+from coverage import CoverageEngine,CONSTELLATIONS
+from elevation_store import ElevationWriter
+from visibility import StationTable,VisibilityBitmap,VisibilityWriter,StationRuns,iter_station_visibility
+from ephemeris import Ephemeris
+from elevations import EARTH_FLATTE_GRS80,elevation_matrix,elevation_pairs,station_normals
 from projections import ecef2latlonheight,latlonheight2ecef
 from conversions import norad2prn
-from snippets import df2geojsonLineString,df2geojsonSatPoints,df2geojsonStationPoints,check_output,write_to_file
+from snippets import PRNProductWriter,intervals2json,station_visibility2json,coverage2npz,check_output,write_to_file
 
-
-EARTH_FLATTE_GRS80 = 1.0/298.257222101
+CPP_BINARY_MAGIC = b"ELEVBIN1"
+# Approximate peak memory of a chunk: per epoch (positions, output rows) and per (epoch,station) pair
+BYTES_PER_EPOCH = 2048
+BYTES_PER_ELEMENT = {"python":8,"numpy":96,"cpp_binary":48,"cpp_text":1024}
+# Approximate memory per epoch kept for a whole day (track to simplify, lats and lons of the elevation track)
+BYTES_PER_DAY_EPOCH = 256
 
 class Geometry:
     def __init__(self,config_file="./config/config.ini"):
-        self.grid_points = 400
 
         conf_file = Path(config_file)
         if not conf_file.exists():
             raise Exception(f"Configuration file {config_file} does not exist, exiting.")
+        self.config_file = config_file
         self.config = configparser.ConfigParser()
         self.config.read(config_file)
 
-        self.use_cpp = self.config.getboolean('general','use_cpp')
+        default_engine = "cpp" if self.config.getboolean('general','use_cpp',fallback=False) else "python"
+        self.elevation_engine = self.config.get('general','elevation_engine',fallback=default_engine)
+        if self.elevation_engine not in ("python","numpy","cpp"):
+            raise Exception(f"Unknown elevation engine {self.elevation_engine}, options are python, numpy and cpp.")
+        self.use_cpp = self.elevation_engine=="cpp"
+        self.cpp_exchange = self.config.get('general','cpp_exchange',fallback="text")
+        if self.cpp_exchange not in ("text","binary"):
+            raise Exception(f"Unknown C++ exchange format {self.cpp_exchange}, options are text and binary.")
+        self.workers = self.config.getint('general','workers',fallback=1)
+        self.pass_prediction = self.config.getboolean('general','pass_prediction',fallback=False)
+        self.pass_coarse_step = self.config.getint('general','pass_coarse_step',fallback=10)
+        self.track_tolerance = self.config.getfloat('general','track_tolerance',fallback=0.0)
+        self.memory_budget_mb = self.config.getfloat('general','memory_budget_mb',fallback=256)
+        self.store_elevations = self.config.getboolean('general','store_elevations',fallback=False)
+        self.store_bitmaps = self.config.getboolean('general','store_bitmaps',fallback=True)
+        self.store_ephemeris = self.config.getboolean('general','store_ephemeris',fallback=False)
+        self.dense_propagation = self.config.getboolean('general','dense_propagation',fallback=False)
+        self.dense_coarse_step = self.config.getfloat('general','dense_coarse_step',fallback=300)
+        self.dense_order = self.config.getint('general','dense_order',fallback=10)
+        self.dense_tolerance = self.config.getfloat('general','dense_tolerance',fallback=0.5)
+        self.ephemeris_interval = self.config.getfloat('general','ephemeris_interval',fallback=180)
+        self.ephemeris_degree = self.config.getint('general','ephemeris_degree',fallback=14)
+        self.ephemeris_tolerance = self.config.getfloat('general','ephemeris_tolerance',fallback=1.0)
+        self.grid_resolution = self.config.getfloat('general','grid_resolution',fallback=10.0)
+        self.batch_propagation = self.config.getboolean('general','batch_propagation',fallback=True)
 
         log_file = "./logs/geometry_log.txt"
         self.logger = get_logger(log_file)
         
         self.ts = load.timescale()
         self.tles_df = pd.DataFrame.from_dict({"norad_id":[],"epoch":[],"line1":[],"line2":[]})
+        self.tle_index = TLEIndex()
+        self.satellites = {}
         self.igs_stations_df = pd.DataFrame.from_dict({"Station":[],"StationFull":[],"X":[],"Y":[],"Z":[],"ReceiverName":[],"AntennaName":[],"ClockType":[]})
+        self.station_xyz = np.zeros((0,3))
+        self.station_normals = np.zeros((0,3))
+        self.station_table = StationTable([])
 
     def load_tles_celestrak(self,start,end):
         self.logger.info("Loading TLEs from Celestrak")
@@ -54,39 +98,46 @@ class Geometry:
 
         tle_start = start - datetime.timedelta(days=14)
         tle_end = end + datetime.timedelta(days=14)
-        dates = pd.date_range(tle_start,tle_end)
 
-        tles_found = False
-        for date in dates:
-            tles = Celestrak.get_tles(date)
-            if not tles:
-                continue
-            tles_found = True
-            df_dict = {"norad_id":[],"epoch":[],"line1":[],"line2":[]}
-            for tle in tles:
-                df_dict["norad_id"].append(tle.norad_id)
-                df_dict["epoch"].append(tle.epoch)
-                df_dict["line1"].append(tle.line1)
-                df_dict["line2"].append(tle.line2)
-            new_df = pd.DataFrame.from_dict(df_dict)
-            self.tles_df = pd.concat([self.tles_df,new_df])
-        
-        if not tles_found:
+        all_tles = Celestrak.get_tles_range(tle_start,tle_end)
+        if not all_tles:
             self.logger.error(f"No TLEs were found for start {start} and end {end}.")
+        self.set_tles(all_tles)
+
+    def set_tles(self,tles):
+        '''
+        Build the TLE dataframe and the per-satellite TLE index from a list of TLE elements.
+        '''
+        self.tles_df = pd.DataFrame.from_dict({
+            "norad_id":[tle.norad_id for tle in tles],
+            "epoch":[tle.epoch for tle in tles],
+            "line1":[tle.line1 for tle in tles],
+            "line2":[tle.line2 for tle in tles]})
+        self.tle_index = TLEIndex.from_tles(tles)
+        self.satellites = {}
 
     def load_IGS_stations(self):
         self.logger.info("Loading IGS stations")
-        self.igs_stations_df = IGS.get_IGS_stations_df_full()
+        catalog = IGS.get_station_catalog()
+        igs_stations_df = IGS.get_IGS_stations_df_full()
 
         stations = [stat.upper() for stat in self.config["general"]["stations"].split(",")]
         if len(stations)==1 and not stations[0]:
-            stations = IGS.get_IGS_station_list()
+            selection = np.ones(len(igs_stations_df),dtype=bool)
+        else:
+            selection = igs_stations_df.Station.isin(stations).to_numpy()
 
-        self.igs_stations_df = self.igs_stations_df[self.igs_stations_df.Station.isin(stations)]
+        self.set_IGS_stations(igs_stations_df[selection],catalog["normals"][selection])
+
+    def set_IGS_stations(self,igs_stations_df,normals=None):
+        self.igs_stations_df = igs_stations_df.reset_index(drop=True)
+        self.station_xyz = self.igs_stations_df[["X","Y","Z"]].to_numpy(dtype=float)
+        self.station_normals = station_normals(self.station_xyz) if normals is None else np.asarray(normals)
+        self.station_table = StationTable(self.igs_stations_df.Station)
 
     def get_closest_tle(self,norad_id,epoch):
         '''
-        Return the closest (epoch-wise) tle that is loaded.
+        Return the closest (epoch-wise) tle that is loaded, using the TLE index.
         '''
         self.logger.debug(f"Getting closest TLE for {norad_id} and {epoch}")
         if isinstance(epoch,str):
@@ -94,15 +145,17 @@ class Geometry:
         if not isinstance(epoch,datetime.datetime):
             raise Exception("Bad epoch provided, fix it")
 
-        df = self.tles_df[self.tles_df.norad_id==norad_id]
-        if df.empty:
-            raise Exception(f"No valid TLE found for {norad_id} and {epoch}")
+        return self.tle_index.get_closest(norad_id,epoch)
+
+    def get_satellite(self,tle):
+        '''
+        Return the (cached) EarthSatellite for the provided TLE element.
+        '''
+        key = (tle.norad_id,tle.epoch)
+        if key not in self.satellites:
+            self.satellites[key] = EarthSatellite(tle.line1, tle.line2, tle.norad_id, self.ts)
+        return self.satellites[key]
 
-        epoch_diff = (df.epoch - epoch).apply(lambda x: abs(x.total_seconds())).rename("epoch_diff")
-        df = pd.concat([df,epoch_diff],axis=1)
-        df.sort_values("epoch_diff",inplace=True)
-        return df.iloc[0]
-      
     def get_sat_pos(self,satellite,epoch):
         self.logger.debug(f"Getting position {epoch}")
         if isinstance(epoch,str):
@@ -116,7 +169,15 @@ class Geometry:
 
         return SpaceVector.from_llh(subpoint.latitude.degrees,subpoint.longitude.degrees,subpoint.elevation.m)
 
-    def get_sat_positions(self,norad_id,start,end,sampling=5):
+    def get_sat_positions(self,norad_id,start,end,sampling=5,batched=None):
+        '''
+        Return a dataframe with columns epoch,x,y,z,lat,lon,height for the provided satellite,
+        sampled every sampling minutes (fractions of minutes are allowed).
+        The batched mode propagates all epochs in a single array call, the per-epoch mode is
+        kept for validation purposes. Use SpaceVectorArray.from_df to get the positions as arrays.
+        In dense mode, samplings finer than the dense coarse step are interpolated (see
+        get_sat_positions_dense). Over long ranges the closest TLE is used for every epoch.
+        '''
         self.logger.info(f"Getting all positions for {norad_id} between {start} and {end}")
         if isinstance(start,str):
             start = datetime.datetime.strptime(start,"%Y/%m/%d-%H:%M:%S")
@@ -127,25 +188,153 @@ class Geometry:
             raise Exception("Funcion get_sat_positions: No datetime object provided for start")
         if not isinstance(end,datetime.datetime):
             raise Exception("Funcion get_sat_positions: No datetime object provided for end")
-        if not isinstance(sampling,int):
-            raise Exception("Funcion get_sat_positions: No int object provided for sampling")
+        if not isinstance(sampling,(int,float)) or sampling<=0:
+            raise Exception("Funcion get_sat_positions: No valid sampling provided")
+        if batched is None:
+            batched = self.batch_propagation
 
         number_of_epochs = (end-start)/datetime.timedelta(minutes=sampling)
         epochs = [(start + datetime.timedelta(minutes=sampling*i)) for i in range(int(number_of_epochs))]
+        if not epochs:
+            return pd.DataFrame(columns=["epoch","x","y","z","lat","lon","height"])
+        if batched and self.dense_propagation and sampling*60<self.dense_coarse_step:
+            return self.get_sat_positions_dense(norad_id,start,epochs)
+
+        segments = self.tle_index.get_segments(norad_id,epochs)
+        if batched:
+            dfs = [self.get_sat_positions_batched(self.get_satellite(tle),start,epochs[i:j]) for tle,i,j in segments]
+            return pd.concat(dfs,ignore_index=True)
+
         positions = []
-        lats = []
-        lons = []
-        tle = self.get_closest_tle(norad_id,start)
-        satellite = EarthSatellite(tle.line1, tle.line2, tle.norad_id, self.ts)
-        for epoch in epochs:
-            new_pos = self.get_sat_pos(satellite,epoch)
-            positions.append(new_pos)
-            lats.append(new_pos.lat)
-            lons.append(new_pos.lon)
-        df = pd.DataFrame(zip(epochs,positions,lats,lons),columns=["epoch","pos","lat","lon"])
+        for tle,i,j in segments:
+            satellite = self.get_satellite(tle)
+            for epoch in epochs[i:j]:
+                new_pos = self.get_sat_pos(satellite,epoch)
+                positions.append(new_pos)
+        positions = SpaceVectorArray.from_vectors(positions)
+        df = pd.DataFrame.from_dict({
+            "epoch":epochs,
+            "x":positions.x,
+            "y":positions.y,
+            "z":positions.z,
+            "lat":positions.lat,
+            "lon":positions.lon,
+            "height":positions.height})
 
         return df
 
+    def get_sat_positions_batched(self,satellite,start,epochs):
+        '''
+        Propagate the satellite over all epochs at once. ECEF coordinates are taken directly
+        from the ITRS frame, without going through the geodetic coordinates.
+        '''
+        offsets = np.array([(epoch-start).total_seconds() for epoch in epochs],dtype=float)
+        seconds = start.second + start.microsecond/1e6
+        t = self.ts.utc(start.year,start.month,start.day,start.hour,start.minute,seconds+offsets)
+        geocentric = satellite.at(t)
+        x,y,z = geocentric.frame_xyz(itrs).m
+        subpoint = wgs84.geographic_position_of(geocentric)
+        df = pd.DataFrame.from_dict({
+            "epoch":epochs,
+            "x":x,
+            "y":y,
+            "z":z,
+            "lat":subpoint.latitude.degrees,
+            "lon":subpoint.longitude.degrees,
+            "height":subpoint.elevation.m})
+
+        return df
+
+    def get_sat_positions_dense(self,norad_id,start,epochs,coarse_step=None,tolerance=None):
+        '''
+        Return the positions dataframe (see get_sat_positions) for the sorted epochs, interpolated
+        (Lagrange, dense_order nodes) between positions propagated on a coarse grid (coarse_step
+        in seconds). Every TLE segment is interpolated separately. The interpolation is validated
+        against direct propagation halfway between coarse nodes (where its error is largest): the
+        coarse step is halved until the error is below the tolerance (m), down to direct propagation.
+        '''
+        coarse_step = coarse_step or self.dense_coarse_step
+        tolerance = tolerance or self.dense_tolerance
+        offsets = np.array([(epoch-start).total_seconds() for epoch in epochs],dtype=float)
+        xyz = np.zeros((len(offsets),3))
+
+        for tle,i,j in self.tle_index.get_segments(norad_id,epochs):
+            step = coarse_step
+            segment_offsets = offsets[i:j]
+            spacing = np.min(np.diff(segment_offsets)) if len(segment_offsets)>1 else 0.0
+            while True:
+                if step<=spacing or len(segment_offsets)<self.dense_order:
+                    xyz[i:j] = self.propagate_tle(tle,start,segment_offsets)
+                    break
+                nodes,node_xyz = self.propagate_nodes(tle,start,segment_offsets,step)
+                checks = self.get_dense_checks(segment_offsets,nodes,step)
+                error = np.linalg.norm(lagrange_interpolate(nodes,node_xyz,checks,self.dense_order)-self.propagate_tle(tle,start,checks),axis=1).max()
+                if error<=tolerance:
+                    xyz[i:j] = lagrange_interpolate(nodes,node_xyz,segment_offsets,self.dense_order)
+                    break
+                self.logger.warning(f"Interpolation error of {error:.4g} m for {norad_id} with a coarse step of {step} s, halving the step")
+                step = step/2
+
+        lats,lons,heights = ecef2latlonheight(xyz[:,0],xyz[:,1],xyz[:,2],method="closed_form")
+        return pd.DataFrame.from_dict({
+            "epoch":epochs,
+            "x":xyz[:,0],
+            "y":xyz[:,1],
+            "z":xyz[:,2],
+            "lat":lats,
+            "lon":lons,
+            "height":heights})
+
+    def propagate_nodes(self,tle,start,offsets,step):
+        '''
+        Propagate the TLE on the coarse grid (multiples of step seconds) covering the offsets,
+        with enough nodes on both sides for the interpolation.
+        '''
+        margin = self.dense_order//2 + 1
+        first = math.floor(offsets[0]/step) - margin
+        last = math.ceil(offsets[-1]/step) + margin
+        nodes = np.arange(first,last+1)*step
+        return nodes,self.propagate_tle(tle,start,nodes)
+
+    def get_dense_checks(self,offsets,nodes,step,number_of_checks=32):
+        '''
+        Return the validation offsets: midpoints between coarse nodes, spread over the offsets.
+        '''
+        midpoints = nodes[:-1] + step/2
+        midpoints = midpoints[(midpoints>=offsets[0]) & (midpoints<=offsets[-1])]
+        if not len(midpoints):
+            return offsets[[0,-1]]
+        return midpoints[np.unique(np.linspace(0,len(midpoints)-1,min(number_of_checks,len(midpoints))).astype(int))]
+
+    def propagate_tle(self,tle,start,offsets):
+        '''
+        Return the ECEF positions (shape (n,3)) of the TLE at start + offsets (in seconds).
+        '''
+        offsets = np.asarray(offsets,dtype=float)
+        if not len(offsets):
+            return np.zeros((0,3))
+        seconds = start.second + start.microsecond/1e6
+        t = self.ts.utc(start.year,start.month,start.day,start.hour,start.minute,seconds+offsets)
+        return self.get_satellite(tle).at(t).frame_xyz(itrs).m.T
+
+    def propagate(self,norad_id,start,offsets):
+        '''
+        Return the ECEF positions (shape (n,3)) of the satellite at start + offsets (in seconds),
+        using the closest TLE for every epoch.
+        '''
+        offsets = np.asarray(offsets,dtype=float)
+        xyz = np.zeros((len(offsets),3))
+        if not len(offsets):
+            return xyz
+
+        order = np.argsort(offsets,kind="stable")
+        epochs = np.datetime64(start,"us") + np.round(offsets[order]*1e6).astype("timedelta64[us]")
+        for tle,i,j in self.tle_index.get_segments(norad_id,epochs):
+            indexes = order[i:j]
+            xyz[indexes] = self.propagate_tle(tle,start,offsets[indexes])
+
+        return xyz
+
     def get_station_pos(self,station):
         self.logger.debug(f"Getting position for station {station}")
         res = self.igs_stations_df[self.igs_stations_df.Station==station]
@@ -165,8 +354,7 @@ class Geometry:
 
         station_to_sat = sat_pos - station_pos
         distance = station_to_sat.norm()
-        station_normal = station_pos
-        station_normal.z /= ((1.0 - EARTH_FLATTE_GRS80) * (1.0 - EARTH_FLATTE_GRS80))
+        station_normal = SpaceVector(station_pos.x,station_pos.y,station_pos.z/((1.0 - EARTH_FLATTE_GRS80) * (1.0 - EARTH_FLATTE_GRS80)))
         aux_norm = station_normal.norm()
         glenny = station_normal/aux_norm
         aux = station_to_sat.dot(glenny)
@@ -193,22 +381,22 @@ class Geometry:
 
         return stations_in_view
 
-    def get_stations_in_view_sat_track(self,norad_id,start,end):
+    def get_stations_in_view_sat_track(self,norad_id,start,end,sampling=5):
         self.logger.info(f"Getting stations in view along the track for {norad_id} between {start} and {end}")
-        sat_pos_df = self.get_sat_positions(norad_id,start,end)
+        sat_pos_df = self.get_sat_positions(norad_id,start,end,sampling)
         self.logger.info(f"Positions calculated!")
         stations_in_view = []
         number_stats_in_view = []
         norad_ids = []
         prns = []
+        prn = norad2prn(norad_id,sat_pos_df.epoch[0].date() if len(sat_pos_df) else None)
         self.logger.info(f"Calculating stations in view for {norad_id}...")
-        for _,row in sat_pos_df.iterrows():
-            sat_pos = row.pos
+        for sat_pos in SpaceVectorArray(sat_pos_df.x,sat_pos_df.y,sat_pos_df.z):
             stats_in_view = self.get_stations_in_view(sat_pos)
             stations_in_view.append(stats_in_view)
             number_stats_in_view.append(len(stats_in_view))
             norad_ids.append(norad_id)
-            prns.append(norad2prn(norad_id))
+            prns.append(prn)
 
         new_df = pd.DataFrame(zip(number_stats_in_view,stations_in_view,norad_ids,prns),columns=["number_stations_in_view","stations_in_view","norad_id","prn"])
 
@@ -216,111 +404,525 @@ class Geometry:
 
         return df
 
-    def calculate_all(self,start,end,norad_ids=None):
-        self.logger.info(f"Calculating results for all norad ids between {start} and {end}")
+    def get_elevations(self,positions):
+        '''
+        Return the (epochs x stations) elevation matrix for the satellite positions (a
+        SpaceVectorArray or a dataframe with x,y,z columns), computed in a single broadcast operation.
+        '''
+        if isinstance(positions,pd.DataFrame):
+            positions = SpaceVectorArray.from_df(positions)
+        return elevation_matrix(self.station_xyz,positions.xyz,self.station_normals)
+
+    def get_stations_in_view_matrix(self,norad_id,sat_pos_df,elevations,station_lists=True):
+        '''
+        Build the stations in view dataframe from an (epochs x stations) elevation matrix.
+        Without station_lists, the stations_in_view column is left out (the visibility is then
+        provided as bitmaps, see get_visibility_bitmap).
+        '''
+        elev_mask = float(self.config["general"]["elevation_mask"])
+        in_view = elevations>=elev_mask
+        prn = norad2prn(norad_id,sat_pos_df.epoch[0].date() if len(sat_pos_df) else None)
+
+        columns = {
+            "number_stations_in_view":in_view.sum(axis=1),
+            "norad_id":[norad_id]*len(sat_pos_df),
+            "prn":[prn]*len(sat_pos_df)}
+        if station_lists:
+            stations = self.igs_stations_df.Station.to_numpy()
+            columns["stations_in_view"] = [list(stations[row]) for row in in_view]
+        new_df = pd.DataFrame.from_dict(columns)
+        df = pd.concat([sat_pos_df.reset_index(drop=True),new_df],axis=1)
+
+        return df
+
+    def get_visibility_intervals(self,norad_id,start,end,coarse_step=None,tolerance=0.5):
+        '''
+        Return the visibility intervals of all stations for the provided satellite, as a list of
+        tuples: [(station,rise,set),...]. Elevation mask crossings are bracketed on a coarse
+        grid (coarse_step in minutes) and refined with the Illinois (regula falsi) method up to
+        the tolerance in seconds. Passes shorter than the coarse step can be missed.
+        '''
         if isinstance(start,str):
             start = datetime.datetime.strptime(start,"%Y/%m/%d-%H:%M:%S")
+        if isinstance(end,str):
+            end = datetime.datetime.strptime(end,"%Y/%m/%d-%H:%M:%S")
+        if coarse_step is None:
+            coarse_step = self.pass_coarse_step
+        elev_mask = float(self.config["general"]["elevation_mask"])
+        stations = self.igs_stations_df.Station.to_numpy()
+
+        duration = (end-start).total_seconds()
+        offsets = np.arange(0.0,duration,coarse_step*60.0)
+        if not len(offsets) or not len(stations):
+            return []
+        offsets = np.append(offsets,duration)
+        elevations = elevation_matrix(self.station_xyz,self.propagate(norad_id,start,offsets),self.station_normals)
+        visible = elevations>=elev_mask
+
+        epoch_indexes,station_indexes = np.nonzero(visible[1:]!=visible[:-1])
+        rising = visible[epoch_indexes+1,station_indexes]
+        crossings = self.refine_crossings(norad_id,start,station_indexes,
+            offsets[epoch_indexes],offsets[epoch_indexes+1],
+            elevations[epoch_indexes,station_indexes]-elev_mask,
+            elevations[epoch_indexes+1,station_indexes]-elev_mask,
+            elev_mask,tolerance)
+
+        events = {}
+        for station_index in np.flatnonzero(visible[0]):
+            events.setdefault(station_index,[]).append((0.0,True))
+        for station_index,crossing,rise in zip(station_indexes,crossings,rising):
+            events.setdefault(station_index,[]).append((crossing,rise))
+
+        result = []
+        for station_index in sorted(events):
+            rise_time = None
+            for crossing,rise in sorted(events[station_index]):
+                if rise:
+                    rise_time = crossing
+                elif rise_time is not None:
+                    result.append((stations[station_index],start+datetime.timedelta(seconds=rise_time),start+datetime.timedelta(seconds=crossing)))
+                    rise_time = None
+            if rise_time is not None:
+                result.append((stations[station_index],start+datetime.timedelta(seconds=rise_time),end))
+
+        return sorted(result,key=lambda interval: (interval[1],interval[0]))
+
+    def refine_crossings(self,norad_id,start,station_indexes,a,b,fa,fb,elev_mask,tolerance,max_iterations=50):
+        '''
+        Find the epochs (in seconds from start) at which the elevation crosses the mask for all
+        brackets [a,b] at once: every iteration propagates the satellite in a single array call.
+        '''
+        a,b,fa,fb = [np.array(values,dtype=float) for values in (a,b,fa,fb)]
+        station_xyz = self.station_xyz[station_indexes]
+        normals = self.station_normals[station_indexes]
+        side = np.zeros(len(a),dtype=int)
+        roots = (a+b)/2
+        active = np.abs(b-a)>tolerance
+        for _ in range(max_iterations):
+            if not active.any():
+                break
+            c = b[active] - fb[active]*(b[active]-a[active])/(fb[active]-fa[active])
+            fc = elevation_pairs(station_xyz[active],self.propagate(norad_id,start,c),normals[active]) - elev_mask
+
+            indexes = np.flatnonzero(active)
+            same_as_b = np.sign(fc)==np.sign(fb[indexes])
+            # Illinois: halve the function value of the endpoint which is retained twice in a row
+            b_retained = indexes[~same_as_b]
+            a_retained = indexes[same_as_b]
+            fb[b_retained] = np.where(side[b_retained]==1,fb[b_retained]/2,fb[b_retained])
+            fa[a_retained] = np.where(side[a_retained]==-1,fa[a_retained]/2,fa[a_retained])
+            a[b_retained],fa[b_retained] = c[~same_as_b],fc[~same_as_b]
+            b[a_retained],fb[a_retained] = c[same_as_b],fc[same_as_b]
+            side[b_retained] = 1
+            side[a_retained] = -1
+
+            roots[indexes] = c
+            active[indexes] = (np.abs(b[indexes]-a[indexes])>tolerance) & (fc!=0)
+
+        return roots
+
+    def calculate_coverage(self,start,end,norad_ids=None):
+        '''
+        Calculate the coverage raster (number of satellites per constellation above the
+        elevation mask, for every grid cell and epoch) for every day between start and end.
+        '''
+        self.logger.info(f"Calculating coverage between {start} and {end}")
+        if isinstance(start,str):
+            start = datetime.datetime.strptime(start,"%Y/%m/%d-%H:%M:%S")
+        if isinstance(end,str):
+            end = datetime.datetime.strptime(end,"%Y/%m/%d-%H:%M:%S")
         if norad_ids:
             norad_ids = norad_ids.split(",")
         else:
             norad_ids = Celestrak.get_norad_ids(start.date())
 
-        basepath = Path("./output") / str(start.date().year) / str(start.date().month).zfill(2) / str(start.date().day).zfill(2)
-        basepath.mkdir(parents=True,exist_ok=True)
+        engine = CoverageEngine(
+            resolution=self.config.getfloat('general','coverage_resolution',fallback=5.0),
+            layout=self.config.get('general','coverage_layout',fallback="equal_angle"),
+            elevation_mask=float(self.config["general"]["elevation_mask"]),
+            batch_mb=self.config.getint('general','coverage_batch_mb',fallback=64))
+        step = self.config.getint('general','coverage_step',fallback=10)
+
+        for day_start,day_end in self.get_day_chunks(start,end,step):
+            offsets = np.arange(0.0,(day_end-day_start).total_seconds(),step*60.0)
+            epochs = [day_start+datetime.timedelta(seconds=offset) for offset in offsets]
+
+            positions = []
+            constellations = []
+            for norad_id in norad_ids:
+                prn = norad2prn(norad_id,day_start.date())
+                if not prn or norad_id not in self.tle_index:
+                    continue
+                positions.append(self.propagate(norad_id,day_start,offsets))
+                constellations.append(prn[0])
+
+            if positions:
+                counts = engine.count_visible(np.stack(positions),constellations)
+                coverage2npz(counts,epochs,engine.grid,engine.elevation_mask,self.get_output_dir(day_start.date()) / "coverage")
+            else:
+                self.logger.warning(f"No satellites available for the coverage of {day_start.date()}")
 
+    def calculate_all(self,start,end,norad_ids=None,sampling=5):
+        '''
+        Calculate the results of all norad ids between start and end. The range is split in
+        days, every day is written to its own output directory. Day boundaries are aligned with
+        the sampling grid starting at start, so the concatenation of all days equals a single
+        continuous propagation (switching TLEs halfway between consecutive TLE epochs).
+        '''
+        self.logger.info(f"Calculating results for all norad ids between {start} and {end}")
+        todo = self.get_todo(start,end,norad_ids,sampling)
 
-        for norad_id in norad_ids:
-            sat = norad2prn(norad_id)
-            sat_points_check = check_output("sat_points",start.date(),sat)
-            sat_track_check = check_output("sat_track",start.date(),sat)
-            stations_check = check_output("stations",start.date())
+        if self.workers<=1:
+            for task in todo:
+                self.calculate_satellite(*task,sampling=sampling)
+        else:
+            self.logger.info(f"Calculating {len(todo)} satellite days using {self.workers} workers")
+            initargs = (self.config_file,self.tles_df,self.tle_index,self.igs_stations_df)
+            with ProcessPoolExecutor(max_workers=self.workers,initializer=_init_worker,initargs=initargs) as executor:
+                futures = {executor.submit(_calculate_satellite_worker,*task,sampling):task for task in todo}
+                for future in as_completed(futures):
+                    norad_id,day_start,_,_ = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.logger.error(f"Calculation for norad id {norad_id} on {day_start.date()} failed: {e}")
+
+        for date in sorted(set(day_start.date() for _,day_start,_,_ in todo)):
+            self.calculate_station_products(date)
+
+    def calculate_station_products(self,date):
+        '''
+        Write the station-centric products (visible prns and number of satellites per
+        constellation, per epoch) of the provided date, by merging the station runs written
+        by calculate_satellite for all satellites of the date.
+        '''
+        self.logger.info(f"Calculating station products for {date}")
+        elev_mask = float(self.config["general"]["elevation_mask"])
+        visibility = iter_station_visibility(date.year,date.month,date.day,CONSTELLATIONS,logger=self.logger)
+        station_visibility2json(visibility,elev_mask,self.get_output_dir(date) / "station_view")
 
-            if sat_points_check and sat_track_check and stations_check:
-                self.logger.info(f"Skipping norad id {norad_id} as results are already present.")
-                continue
-            elif not sat:
-                self.logger.warning(f"Skipping norad id {norad_id}, norad2prn returned and error.")
+    def get_todo(self,start,end,norad_ids=None,sampling=5):
+        '''
+        Return the (satellite, day) chunks between start and end for which results are missing:
+        list of tuples [(norad_id,day_start,day_end,basepath),...]
+        '''
+        if isinstance(start,str):
+            start = datetime.datetime.strptime(start,"%Y/%m/%d-%H:%M:%S")
+        if isinstance(end,str):
+            end = datetime.datetime.strptime(end,"%Y/%m/%d-%H:%M:%S")
+        if isinstance(norad_ids,str):
+            norad_ids = norad_ids.split(",")
+        if not norad_ids:
+            norad_ids = Celestrak.get_norad_ids(start.date())
+
+        days = self.get_day_chunks(start,end,sampling)
+        for day_start,_ in days:
+            self.get_output_dir(day_start.date()).mkdir(parents=True,exist_ok=True)
+
+        todo = []
+        for norad_id in norad_ids:
+            if norad_id not in self.tle_index:
+                self.logger.warning(f"Skipping norad id {norad_id} as no TLE is loaded.")
                 continue
+            for day_start,day_end in days:
+                date = day_start.date()
+                sat = norad2prn(norad_id,date)
+                if not sat:
+                    self.logger.warning(f"Skipping norad id {norad_id} for {date}, norad2prn returned and error.")
+                    continue
+                if self.check_results(norad_id,date):
+                    self.logger.info(f"Skipping norad id {norad_id} for {date} as results are already present.")
+                    continue
+                todo.append((norad_id,day_start,day_end,self.get_output_dir(date)))
+
+        return todo
+
+    def check_results(self,norad_id,date):
+        '''
+        Check if the results of the satellite for the provided date are already present, for
+        all products enabled in the config (days calculated before a product was enabled are
+        calculated again). The JSON metadata of the bitmaps and elevations is written last.
+        '''
+        sat = norad2prn(norad_id,date)
+        if not sat:
+            return False
+
+        products = [("sat_points","json"),("sat_track","json")]
+        if self.track_tolerance:
+            products.append(("sat_track_raw","json"))
+        if len(self.station_table):
+            products.append(("station_runs","npz"))
+            if self.store_bitmaps:
+                products.append(("bitmaps","json"))
+        if self.store_elevations:
+            products.append(("elevations","json"))
+        if self.store_ephemeris:
+            products.append(("ephemeris","npz"))
+        if self.pass_prediction:
+            products.append(("visibility","json"))
+        return all(check_output(product,date,sat,extension) for product,extension in products) and check_output("stations",date)
+
+    def get_day_chunks(self,start,end,sampling=5):
+        '''
+        Split [start,end) in days: returns list of tuples [(day_start,day_end),...]. Every chunk
+        starts at the first epoch of the sampling grid (in minutes, anchored at start) of its day.
+        '''
+        step = datetime.timedelta(minutes=sampling)
+        chunks = []
+        day_start = start
+        while day_start<end:
+            midnight = datetime.datetime.combine(day_start.date()+datetime.timedelta(days=1),datetime.time())
+            day_end = min(start + math.ceil((midnight-start)/step)*step,end)
+            chunks.append((day_start,day_end))
+            day_start = day_end
 
-            if self.use_cpp:
-                self.logger.info(f"Calculating all elevations for {norad_id}")
-                self.remove_cpp_tmp_files()
-                sat_pos_df = self.get_sat_positions(norad_id,start,end)
-                self.write_positions(start,end,norad_id,sat_pos_df)
-                self.launch_cpp()
-                cpp_df = pd.read_csv("./tmp/cpp_data_out.txt")
-                df = self.get_cpp_df(norad_id,sat_pos_df,cpp_df)
-                df2geojsonSatPoints(df,basepath / "sat_points")
-                df2geojsonLineString(df,basepath / "sat_track")
-                
-            else:
-                df = self.get_stations_in_view_sat_track(norad_id,start,end)
-                df2geojsonSatPoints(df,basepath / "sat_points")
-                df2geojsonLineString(df,basepath / "sat_track")
+        return chunks
+
+    def get_output_dir(self,date):
+        return Path("./output") / str(date.year) / str(date.month).zfill(2) / str(date.day).zfill(2)
+
+    def calculate_satellite(self,norad_id,start,end,basepath,sampling=5):
+        '''
+        Calculate and write the sat_points and sat_track results for a single satellite.
+        Epochs are processed in chunks sized to the memory budget, every chunk is appended to
+        the outputs (and validates the ephemeris) before the next one is propagated.
+        All temporary files are written to a scratch directory owned by this calculation.
+        '''
+        scratch_dir = Path(tempfile.mkdtemp(prefix="geometry_",dir=self.get_tmp_dir()))
+        try:
+            step = datetime.timedelta(minutes=sampling)
+            number_of_epochs = int((end-start)/step)
+            chunk_size = self.get_chunk_size(number_of_epochs)
+            writer = PRNProductWriter(
+                sat_points=basepath / "sat_points",
+                sat_track=basepath / "sat_track",
+                sat_track_raw=basepath / "sat_track_raw" if self.track_tolerance else None,
+                track_tolerance=self.track_tolerance)
+            prn = norad2prn(norad_id,start.date())
+            elevation_writer = None
+            if self.store_elevations:
+                elevation_writer = ElevationWriter(basepath / "elevations",prn,norad_id,start,sampling,number_of_epochs,self.igs_stations_df.Station)
+            visibility_writer = None
+            if self.store_bitmaps and len(self.station_table):
+                visibility_writer = VisibilityWriter(basepath / "bitmaps",prn,start,sampling,number_of_epochs,self.station_table)
+            station_runs = StationRuns(prn,start,sampling,self.station_table) if len(self.station_table) else None
+            ephemeris = self.fit_ephemeris(norad_id,prn,start,end) if self.store_ephemeris else None
+            with writer,elevation_writer or contextlib.nullcontext(),visibility_writer or contextlib.nullcontext():
+                chunk_start = start
+                while chunk_start<end:
+                    chunk_end = min(chunk_start + chunk_size*step,end)
+                    df,elevations = self.calculate_chunk(norad_id,chunk_start,chunk_end,scratch_dir,sampling)
+                    visibility = self.get_visibility_bitmap(df,elevations)
+                    writer.write(df,visibility)
+                    if visibility_writer:
+                        visibility_writer.write(visibility)
+                    if station_runs:
+                        station_runs.add(visibility)
+                    if ephemeris:
+                        offsets = (pd.to_datetime(df.epoch)-start).dt.total_seconds().to_numpy()
+                        ephemeris.validate(offsets,df[["x","y","z"]].to_numpy(dtype=float))
+                    if elevation_writer:
+                        if elevations is None:
+                            elevations = self.get_elevations(df)
+                        elevation_writer.write(elevations,df.lat,df.lon)
+                    chunk_start = chunk_end
+
+            if station_runs:
+                station_runs.save(basepath / "station_runs")
+            if ephemeris:
+                self.save_ephemeris(ephemeris,basepath / "ephemeris")
+
+            if self.pass_prediction:
+                intervals = self.get_visibility_intervals(norad_id,start,end)
+                elev_mask = float(self.config["general"]["elevation_mask"])
+                intervals2json(intervals,norad2prn(norad_id,start.date()),elev_mask,basepath / "visibility")
+        finally:
+            shutil.rmtree(scratch_dir,ignore_errors=True)
+
+    def fit_ephemeris(self,norad_id,prn,start,end):
+        '''
+        Fit the Chebyshev ephemeris of the satellite between start and end, with the TLE
+        switches as interval boundaries. It still has to be validated (see Ephemeris.validate).
+        '''
+        switches = self.tle_index.get_switch_epochs(norad_id,start,end)
+        breaks = (switches-np.datetime64(start,"us"))/np.timedelta64(1,"s")
+        return Ephemeris.fit(lambda offsets: self.propagate(norad_id,start,offsets),prn,start,end,self.ephemeris_interval,self.ephemeris_degree,breaks)
+
+    def save_ephemeris(self,ephemeris,basepath):
+        '''
+        Store the validated ephemeris. If its error exceeds the ephemeris tolerance (m) it is
+        stored as rejected, so the day is not calculated again but the ephemeris is not used.
+        '''
+        if ephemeris.max_error is None or ephemeris.max_error>self.ephemeris_tolerance:
+            self.logger.error(f"Ephemeris of {ephemeris.prn} between {ephemeris.start} and {ephemeris.end} rejected: error of {ephemeris.max_error} m")
+            ephemeris.rejected = True
+
+        ephemeris.save(basepath)
+        return ephemeris
+
+    def get_visibility_bitmap(self,df,elevations=None):
+        '''
+        Return the visibility bitmaps of the rows of the df, from the elevation matrix if
+        provided (or else from the stations_in_view lists of the df).
+        '''
+        if elevations is not None:
+            elev_mask = float(self.config["general"]["elevation_mask"])
+            return VisibilityBitmap.from_matrix(elevations>=elev_mask,self.station_table)
+        return VisibilityBitmap.from_lists(df.stations_in_view,self.station_table)
 
-    def remove_cpp_tmp_files(self):
-        tmp_file = Path("./tmp/cpp_data.txt")
-        if tmp_file.exists():
-            tmp_file.unlink()
-        tmp_file_output = Path("./tmp/cpp_data_out.txt")
-        if tmp_file_output.exists():
-            tmp_file_output.unlink()
+    def calculate_chunk(self,norad_id,start,end,scratch_dir,sampling=5):
+        '''
+        Return the stations in view dataframe of the satellite between start and end, using
+        the configured elevation engine, and the (epochs x stations) elevation matrix if the
+        engine provides it (None otherwise).
+        '''
+        if self.use_cpp:
+            self.logger.info(f"Calculating all elevations for {norad_id} between {start} and {end}")
+            sat_pos_df = self.get_sat_positions(norad_id,start,end,sampling)
+            positions = SpaceVectorArray.from_df(sat_pos_df)
+            # The text exchange file is appended to, so the files of the previous chunk are removed first
+            self.remove_cpp_tmp_files(scratch_dir)
+            if self.cpp_exchange=="binary":
+                self.write_positions(start,end,norad_id,sat_pos_df,binary=True,scratch_dir=scratch_dir,positions=positions)
+                self.launch_cpp(binary=True,scratch_dir=scratch_dir)
+                elevations = self.read_elevations_binary(scratch_dir / "cpp_data_out.bin",len(sat_pos_df))
+                return self.get_stations_in_view_matrix(norad_id,sat_pos_df,elevations,station_lists=False),elevations
+
+            self.write_positions(start,end,norad_id,sat_pos_df,scratch_dir=scratch_dir,positions=positions)
+            self.launch_cpp(scratch_dir=scratch_dir)
+            cpp_df = pd.read_csv(scratch_dir / "cpp_data_out.txt")
+            return self.get_cpp_df(norad_id,sat_pos_df,cpp_df),None
+
+        if self.elevation_engine=="numpy":
+            self.logger.info(f"Calculating all elevations for {norad_id} between {start} and {end}")
+            sat_pos_df = self.get_sat_positions(norad_id,start,end,sampling)
+            elevations = self.get_elevations(SpaceVectorArray.from_df(sat_pos_df))
+            return self.get_stations_in_view_matrix(norad_id,sat_pos_df,elevations,station_lists=False),elevations
+
+        return self.get_stations_in_view_sat_track(norad_id,start,end,sampling),None
+
+    def get_chunk_size(self,number_of_epochs=0):
+        '''
+        Return the number of epochs per chunk which fits in the memory budget, based on the
+        approximate peak memory per (epoch,station) pair of the elevation engine. The buffers
+        kept for all number_of_epochs of the day (track simplification and elevation track)
+        are taken from the budget first.
+        '''
+        if self.use_cpp:
+            engine = "cpp_binary" if self.cpp_exchange=="binary" else "cpp_text"
+        else:
+            engine = self.elevation_engine
+        bytes_per_epoch = BYTES_PER_EPOCH + BYTES_PER_ELEMENT.get(engine,BYTES_PER_ELEMENT["numpy"])*max(len(self.station_xyz),1)
+
+        budget = self.memory_budget_mb*1024*1024
+        day_buffers = number_of_epochs*BYTES_PER_DAY_EPOCH
+        if day_buffers>budget/2:
+            self.logger.warning(f"The buffers of {number_of_epochs} epochs ({day_buffers/1024/1024:.0f} MB) take more than half of the memory budget")
+        budget = max(budget-day_buffers,budget/10)
+
+        return max(1,int(budget/bytes_per_epoch))
+
+    def get_tmp_dir(self):
+        tmp_dir = Path("./tmp")
+        tmp_dir.mkdir(parents=True,exist_ok=True)
+        return tmp_dir
+
+    def remove_cpp_tmp_files(self,scratch_dir="./tmp"):
+        for filename in ["cpp_data.txt","cpp_data_out.txt","cpp_data.bin","cpp_data_out.bin"]:
+            tmp_file = Path(scratch_dir) / filename
+            if tmp_file.exists():
+                tmp_file.unlink()
 
-    def write_positions(self,start,end,norad_id,sat_pos_df):
+    def write_positions(self,start,end,norad_id,sat_pos_df,binary=False,scratch_dir="./tmp",positions=None):
         '''
         Write all station-sat positions in order to calculate the elevations using the C++ binary.
         '''
-        epochs = sat_pos_df.epoch
-        pos_sat = sat_pos_df.pos
-        stations = self.igs_stations_df.Station
-        stat_pos_x = self.igs_stations_df.X
-        stat_pos_y = self.igs_stations_df.Y
-        stat_pos_z = self.igs_stations_df.Z
-
-        result = {'epoch':[],'station':[],'sat':[],'x_stat':[],'y_stat':[],'z_stat':[],'x_sat':[],'y_sat':[],'z_sat':[]}
-        for i in range(len(epochs)):
-            epoch = epochs[i]
-            sat_pos = pos_sat[i]
-            for j in range(len(stations)):
-                station = stations[j]
-                result['epoch'].append(epoch)
-                result['station'].append(station)
-                result['sat'].append(norad_id)
-                result['x_stat'].append(stat_pos_x[j])
-                result['y_stat'].append(stat_pos_y[j])
-                result['z_stat'].append(stat_pos_z[j])
-                result['x_sat'].append(sat_pos.x)
-                result['y_sat'].append(sat_pos.y)
-                result['z_sat'].append(sat_pos.z)
-        
-        df = pd.DataFrame.from_dict(result)
+        if positions is None:
+            positions = SpaceVectorArray.from_df(sat_pos_df)
+        if binary:
+            self.write_positions_binary(positions,Path(scratch_dir) / "cpp_data.bin")
+            return
+
+        number_of_epochs = len(positions)
+        number_of_stations = len(self.igs_stations_df)
+        df = pd.DataFrame.from_dict({
+            'epoch':np.repeat(sat_pos_df.epoch.to_numpy(),number_of_stations),
+            'station':np.tile(self.igs_stations_df.Station.to_numpy(),number_of_epochs),
+            'sat':[norad_id]*(number_of_epochs*number_of_stations),
+            'x_stat':np.tile(self.igs_stations_df.X.to_numpy(dtype=float),number_of_epochs),
+            'y_stat':np.tile(self.igs_stations_df.Y.to_numpy(dtype=float),number_of_epochs),
+            'z_stat':np.tile(self.igs_stations_df.Z.to_numpy(dtype=float),number_of_epochs),
+            'x_sat':np.repeat(positions.x,number_of_stations),
+            'y_sat':np.repeat(positions.y,number_of_stations),
+            'z_sat':np.repeat(positions.z,number_of_stations)})
+
+        write_to_file(df,scratch_dir,"cpp_data.txt")
+
+    def write_positions_binary(self,positions,filepath):
+        '''
+        Write the packed float64 station and satellite positions (a SpaceVectorArray) to a
+        memory-mapped file, using the binary exchange format understood by cpp/main --binary.
+        '''
+        if isinstance(positions,pd.DataFrame):
+            positions = SpaceVectorArray.from_df(positions)
+        sat_xyz = positions.xyz.astype("<f8")
+        stat_xyz = self.station_xyz.astype("<f8")
+        header_size = len(CPP_BINARY_MAGIC) + 16
+        size = header_size + stat_xyz.nbytes + sat_xyz.nbytes
+
+        filepath = Path(filepath)
+        filepath.parent.mkdir(parents=True,exist_ok=True)
+        buffer = np.memmap(filepath,dtype=np.uint8,mode="w+",shape=(size,))
+        buffer[:len(CPP_BINARY_MAGIC)] = np.frombuffer(CPP_BINARY_MAGIC,dtype=np.uint8)
+        buffer[len(CPP_BINARY_MAGIC):header_size].view("<u8")[:] = [len(stat_xyz),len(sat_xyz)]
+        buffer[header_size:header_size+stat_xyz.nbytes].view("<f8")[:] = stat_xyz.ravel()
+        buffer[header_size+stat_xyz.nbytes:].view("<f8")[:] = sat_xyz.ravel()
+        buffer.flush()
+        del buffer
+
+    def read_elevations_binary(self,filepath,number_of_epochs):
+        '''
+        Read the float32 (epochs x stations) elevation matrix written by cpp/main --binary.
+        '''
+        shape = (number_of_epochs,len(self.station_xyz))
+        if not shape[0] or not shape[1]:
+            return np.zeros(shape,dtype=np.float32)
+        elevations = np.memmap(filepath,dtype="<f4",mode="r",shape=shape)
+        result = np.array(elevations)
+        del elevations
 
-        write_to_file(df,"./tmp","cpp_data.txt")
+        return result
 
-    def launch_cpp(self):
+    def launch_cpp(self,binary=False,scratch_dir="./tmp"):
         self.logger.info("Launching C++...")
-        os.system("./cpp/main ./tmp/cpp_data.txt ./tmp/cpp_data_out.txt")
+        scratch_dir = Path(scratch_dir)
+        if binary:
+            command = ["./cpp/main","--binary",str(scratch_dir / "cpp_data.bin"),str(scratch_dir / "cpp_data_out.bin")]
+        else:
+            command = ["./cpp/main",str(scratch_dir / "cpp_data.txt"),str(scratch_dir / "cpp_data_out.txt")]
+        try:
+            subprocess.run(command,check=True,capture_output=True,text=True)
+        except subprocess.CalledProcessError as e:
+            raise Exception(f"C++ elevation calculation failed with code {e.returncode}: {e.stderr.strip()}")
+        except OSError as e:
+            raise Exception(f"C++ elevation calculation could not be started, build cpp/main from cpp/ (see the README): {e}")
         self.logger.info("C++ done!")
 
     def get_cpp_df(self,norad_id,sat_pos_df:pd.DataFrame,cpp_df:pd.DataFrame):
-        elev_mask = float(self.config["general"]["elevation_mask"])        
+        elev_mask = float(self.config["general"]["elevation_mask"])
         epochs = sat_pos_df.epoch
-        stations_in_view = []
-        number_stations_in_view = []
-        norad_ids = []
-        prns = []
-        for i in range(len(epochs)):
-            epoch = str(epochs[i])
-            cpp_filtered = cpp_df[(cpp_df.epoch==epoch) & (cpp_df.sat==norad_id) & (cpp_df.elev>=elev_mask)]
-            stats = list(cpp_filtered.station)
-            prn = norad2prn(norad_id)
-
-            stations_in_view.append(stats)
-            number_stations_in_view.append(len(stats))
-            norad_ids.append(norad_id)
-            prns.append(prn)
-
-        new_df = pd.DataFrame(zip(number_stations_in_view,stations_in_view,norad_ids,prns),columns=["number_stations_in_view","stations_in_view","norad_id","prn"])
+        prn = norad2prn(norad_id,epochs[0].date() if len(epochs) else None)
+
+        # Group the stations in view per epoch once, instead of filtering the full output for every epoch
+        cpp_filtered = cpp_df[(cpp_df.sat.astype(str)==str(norad_id)) & (cpp_df.elev>=elev_mask)]
+        stations_per_epoch = cpp_filtered.groupby(cpp_filtered.epoch.astype(str),sort=False).station.apply(list).to_dict()
+        stations_in_view = [stations_per_epoch.get(str(epoch),[]) for epoch in epochs]
+
+        new_df = pd.DataFrame.from_dict({
+            "number_stations_in_view":[len(stats) for stats in stations_in_view],
+            "stations_in_view":stations_in_view,
+            "norad_id":[norad_id]*len(epochs),
+            "prn":[prn]*len(epochs)})
         df = pd.concat([sat_pos_df,new_df],axis=1)
         return df
     
@@ -363,24 +965,44 @@ class Geometry:
 
     def calculate_elevations(self,sat_pos):
         self.logger.info("Calculating elevations...")
-        grid,_,_ = Grid.get_plane_grid(number_of_points=self.grid_points,height=6371*1000)
-        elevs = []
-        lats = []
-        lons = []
-        for pos_tuple in grid:
-            lat,lon,alt = pos_tuple
-            lats.append(lat)
-            lons.append(lon)
-            x,y,z = latlonheight2ecef(lat,lon,alt)
-            pos_vect = SpaceVector(x,y,z)
-            elev = self.get_elevation(pos_vect,sat_pos)
-            elevs.append(elev)
-
-        df_elev = pd.DataFrame(zip(lats,lons,elevs),columns=['lat','lon','elev'])
+        grid = Grid.get_grid(resolution=self.grid_resolution,height=6371*1000)
+        elevs = elevation_matrix(grid.ecef,[sat_pos.x,sat_pos.y,sat_pos.z],grid.normals)[0]
 
-        return df_elev
-
-        
+        df_elev = pd.DataFrame(zip(grid.lat,grid.lon,elevs),columns=['lat','lon','elev'])
 
+        return df_elev
 
 
+def lagrange_interpolate(nodes,values,offsets,order=10):
+    '''
+    Interpolate the values (shape (nodes,3)) given on the equally spaced nodes at the offsets,
+    using the order nodes closest to every offset.
+    '''
+    step = nodes[1]-nodes[0]
+    order = min(order,len(nodes))
+    first = np.clip(np.floor((offsets-nodes[0])/step).astype(int)-(order-1)//2,0,len(nodes)-order)
+    u = (offsets-nodes[first])/step
+    weights = np.ones((len(offsets),order))
+    for j in range(order):
+        for m in range(order):
+            if m!=j:
+                weights[:,j] *= (u-m)/(j-m)
+    indexes = first[:,np.newaxis] + np.arange(order)
+    return np.einsum("nk,nkc->nc",weights,values[indexes])
+
+
+_worker_geometry = None
+
+def _init_worker(config_file,tles_df,tle_index,igs_stations_df):
+    '''
+    Initialize the Geometry instance used by a calculate_all worker process.
+    '''
+    global _worker_geometry
+    _worker_geometry = Geometry(config_file)
+    _worker_geometry.tles_df = tles_df
+    _worker_geometry.tle_index = tle_index
+    _worker_geometry.set_IGS_stations(igs_stations_df)
+
+def _calculate_satellite_worker(norad_id,start,end,basepath,sampling=5):
+    _worker_geometry.calculate_satellite(norad_id,start,end,basepath,sampling)
+    return norad_id
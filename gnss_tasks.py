@@ -0,0 +1,171 @@
+'''
+Celery tasks distributing the geometry pipeline over (satellite, day) chunks.
+This module is independent of the server (and its audio classifier), workers are started with:
+    celery -A gnss_tasks worker
+The broker and result backend are read from the [celery] section of the config file and can be
+overridden with the CELERY_BROKER_URL and CELERY_RESULT_BACKEND environment variables
+(e.g. memory:// and cache+memory:// for local tests).
+'''
+import os
+import datetime
+import flask
+import configparser
+from pathlib import Path
+from celery import group,chord
+from celery.result import GroupResult
+from celery.utils import uuid
+from celery.utils.log import get_task_logger
+
+from tasks import make_celery
+from data_download import IGS
+from geometry import Geometry
+from snippets import df2geojsonStationPoints,check_output
+
+DATE_FORMAT = "%Y/%m/%d-%H:%M:%S"
+CONFIG_FILE = "./config/config.ini"
+
+
+def make_gnss_celery(config_file=CONFIG_FILE):
+    '''
+    Build the Celery app of the GNSS workers with the make_celery factory of the server, from a
+    minimal Flask app: the server app itself loads the audio classifier at import.
+    '''
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    app = flask.Flask("gnss_tasks")
+    app.config['CELERY_BROKER_URL'] = os.environ.get("CELERY_BROKER_URL",config.get('celery','broker_url',fallback="redis://localhost:6379/0"))
+    app.config['result_backend'] = os.environ.get("CELERY_RESULT_BACKEND",config.get('celery','result_backend',fallback="redis://localhost:6379/0"))
+    app.config.update(
+        task_acks_late=True,
+        worker_prefetch_multiplier=1,
+        result_extended=True)
+    return make_celery(app,"gnss_tasks")
+
+celery = make_gnss_celery()
+logger = get_task_logger(__name__)
+
+_geometry = None
+_tle_range = None
+
+def get_geometry(start_date,end_date):
+    '''
+    Return the Geometry instance of this worker process. Stations are loaded once, TLEs are
+    (re)loaded when the requested date range is not covered by the loaded range.
+    '''
+    global _geometry,_tle_range
+    if _geometry is None:
+        _geometry = Geometry(CONFIG_FILE)
+        _geometry.load_IGS_stations()
+    if _tle_range is None or start_date<_tle_range[0] or end_date>_tle_range[1]:
+        _geometry.load_tles_celestrak(start_date,end_date)
+        _tle_range = (start_date,end_date)
+    return _geometry
+
+@celery.task(bind=True,name="gnss_tasks.calculate_satellite_day",max_retries=3,default_retry_delay=60)
+def calculate_satellite_day(self,norad_id,day_start,day_end,range_start,range_end,sampling=5):
+    '''
+    Calculate the results of a single satellite for a single day chunk [day_start,day_end).
+    range_start and range_end are the dates of the whole backfill, so every worker loads the
+    same TLEs. Results which are already present are not calculated again.
+    Once its retries are exhausted, a failed calculation is reported as a "failed" result
+    instead of an exception, so the station products of the day are still built.
+    '''
+    day_start = datetime.datetime.strptime(day_start,DATE_FORMAT)
+    day_end = datetime.datetime.strptime(day_end,DATE_FORMAT)
+    range_start = datetime.datetime.strptime(range_start,DATE_FORMAT).date()
+    range_end = datetime.datetime.strptime(range_end,DATE_FORMAT).date()
+    date = day_start.date()
+
+    try:
+        geom = get_geometry(range_start,range_end)
+        if geom.check_results(norad_id,date):
+            logger.info(f"Skipping norad id {norad_id} for {date} as results are already present.")
+            return {"norad_id":norad_id,"date":str(date),"status":"skipped"}
+        geom.calculate_satellite(norad_id,day_start,day_end,geom.get_output_dir(date),sampling)
+    except Exception as e:
+        if self.request.retries<self.max_retries:
+            logger.warning(f"Calculation for norad id {norad_id} on {date} failed, retrying: {e}")
+            raise self.retry(exc=e)
+        logger.error(f"Calculation for norad id {norad_id} on {date} failed: {e}")
+        return {"norad_id":norad_id,"date":str(date),"status":"failed","error":str(e)}
+
+    return {"norad_id":norad_id,"date":str(date),"status":"done"}
+
+@celery.task(name="gnss_tasks.write_stations_day")
+def write_stations_day(date):
+    '''
+    Write the stations product for the provided date (YYYY/MM/DD-HH:MM:SS).
+    '''
+    date = datetime.datetime.strptime(date,DATE_FORMAT).date()
+    if check_output("stations",date):
+        return {"date":str(date),"status":"skipped"}
+
+    basepath = Path("./output") / str(date.year) / str(date.month).zfill(2) / str(date.day).zfill(2)
+    basepath.mkdir(parents=True,exist_ok=True)
+    df2geojsonStationPoints(IGS.get_IGS_stations_df_full(),basepath / "stations")
+    return {"date":str(date),"status":"done"}
+
+@celery.task(name="gnss_tasks.calculate_station_products")
+def calculate_station_products(results,date):
+    '''
+    Write the station-centric products of the provided date (YYYY/MM/DD-HH:MM:SS), once all
+    satellite tasks of the day are done (results are the results of these tasks).
+    '''
+    failed = [result["norad_id"] for result in results if result.get("status")=="failed"]
+    if failed:
+        logger.error(f"Station products of {date} built without the failed satellites: {', '.join(failed)}")
+
+    geom = Geometry(CONFIG_FILE)
+    geom.calculate_station_products(datetime.datetime.strptime(date,DATE_FORMAT).date())
+    return {"date":date,"status":"done","failed":failed}
+
+def backfill(start,end,norad_ids=None,sampling=5):
+    '''
+    Fan out the calculation of all missing (satellite, day) chunks between start and end to the
+    Celery workers. Returns the id of the group result, to be used with backfill_status.
+    '''
+    if isinstance(start,str):
+        start = datetime.datetime.strptime(start,DATE_FORMAT)
+    if isinstance(end,str):
+        end = datetime.datetime.strptime(end,DATE_FORMAT)
+
+    geom = Geometry(CONFIG_FILE)
+    # The stations are needed to know which station products a complete day holds
+    geom.load_IGS_stations()
+    geom.load_tles_celestrak(start.date(),end.date())
+    range_start = start.strftime(DATE_FORMAT)
+    range_end = end.strftime(DATE_FORMAT)
+
+    days = {day_start.strftime(DATE_FORMAT):[] for day_start,_ in geom.get_day_chunks(start,end,sampling)}
+    for norad_id,day_start,day_end,_ in geom.get_todo(start,end,norad_ids,sampling):
+        days[day_start.strftime(DATE_FORMAT)].append(calculate_satellite_day.si(norad_id,day_start.strftime(DATE_FORMAT),day_end.strftime(DATE_FORMAT),range_start,range_end,sampling))
+
+    # The station products of a day are built once all its satellites are done, independently
+    # of the other days. Satellite tasks report failures as results, so the callback always runs.
+    tasks = []
+    for date,signatures in days.items():
+        if signatures:
+            callback = chord(group([write_stations_day.si(date)]+signatures))(calculate_station_products.s(date))
+            # The chord bookkeeping uses (and deletes) the group of the header, the backfill is saved separately
+            tasks += callback.parent.results + [callback]
+        else:
+            tasks.append(write_stations_day.si(date).delay())
+    result = GroupResult(uuid(),tasks,app=celery)
+    result.save()
+    logger.info(f"Backfill {result.id} between {start} and {end}: {len(tasks)} tasks submitted")
+    return result.id
+
+def backfill_status(group_id):
+    '''
+    Return the progress of the backfill with the provided group id.
+    '''
+    result = GroupResult.restore(group_id,app=celery)
+    if result is None:
+        raise Exception(f"No backfill found with id {group_id}")
+
+    return {
+        "id":group_id,
+        "total":len(result.results),
+        "completed":result.completed_count(),
+        "failed":sum(1 for task in result.results if task.failed() or (task.successful() and task.result.get("status")=="failed")),
+        "ready":result.ready()}
@@ -1,19 +1,113 @@
+import os
 import math
+import numpy as np
+from pathlib import Path
+
+from projections import latlonheight2ecef
+from elevations import station_normals
+
+
+class GridCells:
+    '''
+    Arrays describing the cells of a grid: lat, lon and height (shape (cells,)), ecef and
+    normals (shape (cells,3)). For the equal angle layout, the cells are ordered row by row
+    and shape is (len(lats),len(lons)); for the equal area layout shape is None.
+    '''
+    def __init__(self,layout,resolution,lat,lon,height,ecef,normals,lats=None,lons=None):
+        self.layout = layout
+        self.resolution = resolution
+        self.lat = lat
+        self.lon = lon
+        self.height = height
+        self.ecef = ecef
+        self.normals = normals
+        self.lats = lats
+        self.lons = lons
+        self.shape = (len(lats),len(lons)) if lats is not None and lons is not None else None
+
+    def __len__(self):
+        return len(self.lat)
+
 
 class Grid:
+    CACHE_PATH = "./tmp/grids"
+    LAYOUTS = ["equal_angle","equal_area"]
+    _cache = {}
 
     @classmethod
     def get_plane_grid(cls,number_of_points=1200,height=0):
         '''
         get grid as a list of tuples: [(lat0,lon0,0),(lat1,lon1,0),...]
         '''
-        interval_lon = int(360/math.sqrt(number_of_points)-1)
-        interval_lat = int(180/math.sqrt(number_of_points)-1)
+        # Number of intervals per axis, rounded rather than truncating the spacing to whole degrees
+        intervals = max(1,int(round(math.sqrt(number_of_points))))
         grid = []
-        lats = list(range(-90,90,interval_lat))+[90]
-        lons = list(range(0,360,interval_lon))+[360]
+        lats = np.linspace(-90,90,intervals+1).tolist()
+        lons = np.linspace(0,360,intervals+1).tolist()
         for current_lat in lats:
             for current_lon in lons:
                 grid.append((current_lat,current_lon,height))
 
-        return grid,lats,lons
\ No newline at end of file
+        return grid,lats,lons
+
+    @classmethod
+    def get_grid(cls,resolution=5.0,height=0,layout="equal_angle"):
+        '''
+        Get the grid cells (cell centres) for the requested resolution (degrees), height and
+        layout ("equal_angle" or "equal_area"). Grids are memoized in memory and on disk.
+        '''
+        if layout not in cls.LAYOUTS:
+            raise Exception(f"Unknown grid layout {layout}, options are {', '.join(cls.LAYOUTS)}.")
+        if resolution<=0:
+            raise Exception(f"Bad grid resolution provided: {resolution}")
+
+        key = (float(resolution),float(height),layout)
+        if key in cls._cache:
+            return cls._cache[key]
+
+        cache_file = Path(cls.CACHE_PATH) / f"grid_{layout}_{float(resolution)}_{float(height)}.npz"
+        if cache_file.exists():
+            with np.load(cache_file,allow_pickle=False) as data:
+                arrays = {name:data[name] for name in data.files}
+            grid = GridCells(layout,float(resolution),**arrays)
+        else:
+            grid = cls.build_grid(float(resolution),float(height),layout)
+            arrays = {"lat":grid.lat,"lon":grid.lon,"height":grid.height,"ecef":grid.ecef,"normals":grid.normals}
+            if grid.shape:
+                arrays["lats"] = grid.lats
+                arrays["lons"] = grid.lons
+            cache_file.parent.mkdir(parents=True,exist_ok=True)
+            tmp_file = cache_file.with_name(f"{cache_file.stem}_{os.getpid()}.npz")
+            np.savez(tmp_file,**arrays)
+            tmp_file.replace(cache_file)
+
+        cls._cache[key] = grid
+        return grid
+
+    @classmethod
+    def build_grid(cls,resolution,height,layout):
+        number_of_lats = max(1,int(round(180/resolution)))
+        lats = -90 + (np.arange(number_of_lats)+0.5)*180/number_of_lats
+
+        if layout=="equal_angle":
+            number_of_lons = max(1,int(round(360/resolution)))
+            lons = -180 + (np.arange(number_of_lons)+0.5)*360/number_of_lons
+            cell_lat = np.repeat(lats,number_of_lons)
+            cell_lon = np.tile(lons,number_of_lats)
+        else:
+            # The number of cells per latitude band scales with cos(lat), so all cells have about the same area
+            cell_lats = []
+            cell_lons = []
+            for lat in lats:
+                number_of_lons = max(1,int(round(360*math.cos(math.radians(lat))/resolution)))
+                cell_lats.append(np.full(number_of_lons,lat))
+                cell_lons.append(-180 + (np.arange(number_of_lons)+0.5)*360/number_of_lons)
+            cell_lat = np.concatenate(cell_lats)
+            cell_lon = np.concatenate(cell_lons)
+            lats,lons = None,None
+
+        cell_height = np.full(len(cell_lat),height)
+        xs,ys,zs = latlonheight2ecef(cell_lat,cell_lon,cell_height)
+        ecef = np.column_stack([xs,ys,zs])
+
+        return GridCells(layout,resolution,cell_lat,cell_lon,cell_height,ecef,station_normals(ecef),lats,lons)
@@ -0,0 +1,148 @@
+'''
+Live positions of the whole constellation: a per-process pool of EarthSatellite objects built
+from the latest TLEs, evaluated for all satellites at once with the sgp4 SatrecArray.
+'''
+import threading
+import configparser
+import numpy as np
+from pathlib import Path
+from datetime import datetime,timedelta,timezone
+from sgp4.api import SatrecArray,jday
+from skyfield.api import EarthSatellite,load
+from skyfield.framelib import itrs
+from skyfield.sgp4lib import TEME
+
+from data_download import Celestrak,IGS
+from conversions import norad2prn
+from elevations import elevation_matrix
+from projections import ecef2latlonheight
+from snippets import COORDINATE_PRECISION
+from satplots_logging import get_logger
+
+
+class LiveConstellation:
+    '''
+    Latest TLE of every satellite of Celestrak.get_prns, as EarthSatellite objects and as a
+    single SatrecArray. The pool is rebuilt when the TLE store changes (or on a new day), and
+    published as a single tuple so concurrent requests never see a partially rebuilt pool.
+    Epochs further than TLE_DAYS from the TLE epochs of the pool are not propagated.
+    '''
+    TLE_DAYS = 3
+
+    def __init__(self,config_file="./config/config.ini"):
+        self.config = configparser.ConfigParser()
+        self.config.read(config_file)
+        self.elevation_mask = self.config.getfloat('general','elevation_mask',fallback=5)
+        self.logger = get_logger("./logs/live_log.txt")
+        self.ts = load.timescale()
+        self.source = None
+        self.lock = threading.Lock()
+        # (prns,satellites,satrecs,tle_epochs)
+        self.pool = ([],[],None,np.array([],dtype="datetime64[us]"))
+
+    def get_source(self):
+        store_file = Path(Celestrak.STORE_PATH)
+        mtime = store_file.stat().st_mtime_ns if store_file.exists() else 0
+        return (mtime,datetime.now(timezone.utc).date())
+
+    def refresh(self):
+        '''
+        Rebuild the pool if new TLEs landed in the store since the last build.
+        '''
+        source = self.get_source()
+        if source==self.source:
+            return
+        with self.lock:
+            if source!=self.source:
+                self.build(source)
+
+    def build(self,source):
+        self.logger.info(f"Building the live satellite pool for {source[1]}")
+
+        today = source[1]
+        start = today - timedelta(days=self.TLE_DAYS)
+        tles = Celestrak.get_tles_range(start,today)
+
+        latest = {}
+        for tle in tles:
+            if tle.norad_id not in latest or tle.epoch>latest[tle.norad_id].epoch:
+                latest[tle.norad_id] = tle
+
+        prns = set(Celestrak.get_prns())
+        pool = {}
+        for norad_id,tle in latest.items():
+            prn = norad2prn(norad_id,today)
+            if prn in prns and (prn not in pool or tle.epoch>pool[prn].epoch):
+                pool[prn] = tle
+        if not pool:
+            self.logger.error(f"No TLEs were found for the live satellite pool of {today}.")
+
+        prns = sorted(pool)
+        satellites = [EarthSatellite(pool[prn].line1,pool[prn].line2,pool[prn].norad_id,self.ts) for prn in prns]
+        satrecs = SatrecArray([satellite.model for satellite in satellites]) if satellites else None
+        tle_epochs = np.array([pool[prn].epoch for prn in prns],dtype="datetime64[us]")
+        self.pool = (prns,satellites,satrecs,tle_epochs)
+        self.source = source
+
+    def covers(self,epoch):
+        '''
+        Check if the epoch is within TLE_DAYS of the TLE epochs of the pool.
+        '''
+        self.refresh()
+        tle_epochs = self.pool[3]
+        if not len(tle_epochs):
+            return False
+        margin = np.timedelta64(self.TLE_DAYS,"D")
+        epoch = np.datetime64(epoch,"us")
+        return bool(tle_epochs.min()-margin<=epoch<=tle_epochs.max()+margin)
+
+    def get_positions(self,epoch=None):
+        '''
+        Return the prns and ECEF positions (shape (satellites,3), m) of all satellites at the
+        epoch (UTC datetime, now if not provided), and a mask of the satellites propagated
+        without error from a TLE within TLE_DAYS of the epoch.
+        '''
+        self.refresh()
+        prns,_,satrecs,tle_epochs = self.pool
+        if epoch is None:
+            epoch = datetime.now(timezone.utc).replace(tzinfo=None)
+        if satrecs is None:
+            return epoch,prns,np.zeros((0,3)),np.zeros(0,dtype=bool)
+
+        seconds = epoch.second + epoch.microsecond/1e6
+        jd,fr = jday(epoch.year,epoch.month,epoch.day,epoch.hour,epoch.minute,seconds)
+        errors,teme,_ = satrecs.sgp4(np.array([jd]),np.array([fr]))
+        recent = np.abs(tle_epochs-np.datetime64(epoch,"us"))<=np.timedelta64(self.TLE_DAYS,"D")
+
+        # Same TEME -> ITRS rotation as EarthSatellite.at(t).frame_xyz(itrs)
+        t = self.ts.utc(epoch.year,epoch.month,epoch.day,epoch.hour,epoch.minute,seconds)
+        rotation = itrs.rotation_at(t) @ TEME.rotation_at(t).T
+        xyz = teme[:,0,:] @ rotation.T * 1000.0
+
+        return epoch,prns,xyz,(errors[:,0]==0) & recent
+
+    def get_now(self,epoch=None,mask=None):
+        '''
+        Return the positions of all satellites and the number of IGS stations which see them
+        above the elevation mask (degrees), at the epoch (now if not provided).
+        '''
+        mask = self.elevation_mask if mask is None else mask
+        epoch,prns,xyz,valid = self.get_positions(epoch)
+        prns = [prn for prn,ok in zip(prns,valid) if ok]
+        xyz = xyz[valid]
+
+        catalog = IGS.get_station_catalog()
+        numbers = (elevation_matrix(catalog["ecef"],xyz,catalog["normals"])>=mask).sum(axis=1)
+        lats,lons,heights = ecef2latlonheight(xyz[:,0],xyz[:,1],xyz[:,2],method="closed_form")
+
+        return {
+            "epoch":datetime.strftime(epoch,"%Y/%m/%d-%H:%M:%S.%f"),
+            "elevation_mask":mask,
+            "prns":prns,
+            "x":xyz[:,0].round(3).tolist(),
+            "y":xyz[:,1].round(3).tolist(),
+            "z":xyz[:,2].round(3).tolist(),
+            "lat":np.round(lats,COORDINATE_PRECISION).tolist(),
+            "lon":np.round(lons,COORDINATE_PRECISION).tolist(),
+            "height":np.round(heights,3).tolist(),
+            "number_stations_in_view":numbers.tolist()}
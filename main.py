@@ -1,4 +1,5 @@
 import os
+import time
 import argparse
 from pathlib import Path
 from datetime import datetime
@@ -14,10 +15,14 @@ if __name__=="__main__":
     parser.add_argument('-t','--download_tles',action="store_true",help="Activate this option in order to download the latest TLEs available on Celestrak.")
     parser.add_argument('-v','--download_csv',action="store_true",help="Activate this option in order to download the latest CSV files available on Celestrak.")
     parser.add_argument('-g','--download_glonass_info',action="store_true",help="Activate this option in order to download the latest CUS message from the Glonass website.")
+    parser.add_argument('-m','--migrate_tles',action="store_true",help="Activate this option in order to import the legacy Celestrak download directories into the TLE store.")
     parser.add_argument('-a','--download_apod',action='store_true',help="Activate this option in order to download the latest APOD.")
     parser.add_argument('-c','--calculate',action="store_true",help="Calculate data necessary for plotting.")
+    parser.add_argument('-d','--distributed',action="store_true",help="Activate this option in order to distribute the calculation over the Celery workers (see gnss_tasks.py).")
+    parser.add_argument('-o','--coverage',action="store_true",help="Calculate the global coverage rasters.")
     parser.add_argument('-s','--start',help="Start date.")
     parser.add_argument('-e','--end',help="End date.")
+    parser.add_argument('-p','--sampling',type=float,default=5,help="Sampling of the results in minutes (fractions of minutes are allowed, see the dense_propagation option).")
     parser.add_argument('-n','--norad_ids',help="List of norad IDs. If not provided, results are calculated for all available spacecraft.")
 
     args = parser.parse_args()
@@ -32,6 +37,9 @@ if __name__=="__main__":
     if args.download_csv:
         celestrak.download_all_csv()
 
+    if args.migrate_tles:
+        Celestrak.migrate_legacy_archive()
+
     if args.download_glonass_info:
         GlonassInfo.download_cus_message()
 
@@ -44,13 +52,31 @@ if __name__=="__main__":
         start_date = start.date()
         end_date = end.date()
 
-        geom = Geometry()
-        geom.load_IGS_stations()
-        geom.load_tles_celestrak(start_date,end_date)
-        df_stations = IGS.get_IGS_stations_df_full()
-        basepath = Path("./output") / str(start_date.year) / str(start_date.month).zfill(2) / str(start_date.day).zfill(2)
-        basepath.mkdir(parents=True,exist_ok=True)
-        df2geojsonStationPoints(df_stations,basepath / "stations")
-        geom.calculate_all(start,end,args.norad_ids)
+        if args.distributed:
+            from gnss_tasks import backfill,backfill_status
+            group_id = backfill(start,end,args.norad_ids,args.sampling)
+            status = backfill_status(group_id)
+            while not status["ready"]:
+                print(f"Backfill {group_id}: {status['completed']}/{status['total']} tasks completed, {status['failed']} failed")
+                time.sleep(30)
+                status = backfill_status(group_id)
+            print(f"Backfill {group_id} done: {status['completed']}/{status['total']} tasks completed, {status['failed']} failed")
+        else:
+            # Stations and TLEs are loaded once for the whole range, results are split per day
+            geom = Geometry()
+            geom.load_IGS_stations()
+            geom.load_tles_celestrak(start_date,end_date)
+            df_stations = IGS.get_IGS_stations_df_full()
+            for day_start,_ in geom.get_day_chunks(start,end,args.sampling):
+                basepath = geom.get_output_dir(day_start.date())
+                basepath.mkdir(parents=True,exist_ok=True)
+                df2geojsonStationPoints(df_stations,basepath / "stations")
+            geom.calculate_all(start,end,args.norad_ids,args.sampling)
 
+    if args.coverage:
+        start = datetime.strptime(args.start,"%Y/%m/%d-%H:%M:%S")
+        end = datetime.strptime(args.end,"%Y/%m/%d-%H:%M:%S")
 
+        geom = Geometry()
+        geom.load_tles_celestrak(start.date(),end.date())
+        geom.calculate_coverage(start,end,args.norad_ids)
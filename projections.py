@@ -1,26 +1,110 @@
 '''
 Basic geometry projections
 '''
+import threading
 import numpy as np
 import pyproj
 
-def ecef2latlonheight(x,y,z):
+WGS84_A = 6378137.0
+WGS84_F = 1.0/298.257223563
+WGS84_B = WGS84_A*(1.0-WGS84_F)
+WGS84_E2 = WGS84_F*(2.0-WGS84_F)
+WGS84_EP2 = WGS84_E2/(1.0-WGS84_E2)
+
+ECEF_CRS = {"proj":"geocent","ellps":"WGS84","datum":"WGS84"}
+LLA_CRS = {"proj":"latlong","ellps":"WGS84","datum":"WGS84"}
+
+# pyproj transformers are not thread safe, so they are cached per thread (the server runs threaded)
+_local = threading.local()
+
+def get_transformer(direction):
+    '''
+    Return the cached transformer for the provided direction ("ecef2lla" or "lla2ecef").
+    '''
+    transformers = getattr(_local,"transformers",None)
+    if transformers is None:
+        transformers = {}
+        _local.transformers = transformers
+
+    if direction not in transformers:
+        if direction=="ecef2lla":
+            transformers[direction] = pyproj.Transformer.from_crs(ECEF_CRS,LLA_CRS,always_xy=True)
+        elif direction=="lla2ecef":
+            transformers[direction] = pyproj.Transformer.from_crs(LLA_CRS,ECEF_CRS,always_xy=True)
+        else:
+            raise Exception(f"Unknown transformation {direction}, options are ecef2lla and lla2ecef.")
+
+    return transformers[direction]
+
+def _as_result(values,scalar):
+    if scalar:
+        return tuple(float(value) for value in values)
+    return values
+
+def ecef2latlonheight(x,y,z,method="pyproj"):
     '''
     returns tuple : (lat,lon,height)
+    Scalars or arrays are accepted. The method is either "pyproj" or "closed_form" (Heikkinen).
     '''
-    ecef = pyproj.Proj(proj='geocent', ellps='WGS84', datum='WGS84')
-    lla = pyproj.Proj(proj='latlong', ellps='WGS84', datum='WGS84')
-    lon, lat, alt = pyproj.transform(ecef, lla, x, y, z, radians=False)
-    #alt_geom = np.linalg.norm([x,y,z])
-    #print("Glenny alt geom:",alt_geom)
-    #print("Glenny alt proj:",alt)
-    return (lat,lon,alt)
+    scalar = np.ndim(x)==0 and np.ndim(y)==0 and np.ndim(z)==0
+    if method=="closed_form":
+        return _as_result(_ecef2latlonheight_closed_form(x,y,z),scalar)
+    if method!="pyproj":
+        raise Exception(f"Unknown method {method}, options are pyproj and closed_form.")
+
+    lon, lat, alt = get_transformer("ecef2lla").transform(np.asarray(x,dtype=float),np.asarray(y,dtype=float),np.asarray(z,dtype=float))
+    return _as_result((lat,lon,alt),scalar)
 
-def latlonheight2ecef(lat,lon,alt):
+def latlonheight2ecef(lat,lon,alt,method="pyproj"):
     '''
     returns tuple : (x,y,z)
+    Scalars or arrays are accepted. The method is either "pyproj" or "closed_form".
     '''
-    ecef = pyproj.Proj(proj='geocent', ellps='WGS84', datum='WGS84')
-    lla = pyproj.Proj(proj='latlong', ellps='WGS84', datum='WGS84')
-    x,y,z = pyproj.transform(lla, ecef, lon, lat, alt, radians=False)
+    scalar = np.ndim(lat)==0 and np.ndim(lon)==0 and np.ndim(alt)==0
+    if method=="closed_form":
+        return _as_result(_latlonheight2ecef_closed_form(lat,lon,alt),scalar)
+    if method!="pyproj":
+        raise Exception(f"Unknown method {method}, options are pyproj and closed_form.")
+
+    x,y,z = get_transformer("lla2ecef").transform(np.asarray(lon,dtype=float),np.asarray(lat,dtype=float),np.asarray(alt,dtype=float))
+    return _as_result((x,y,z),scalar)
+
+def _ecef2latlonheight_closed_form(x,y,z):
+    '''
+    Heikkinen's closed form solution for the WGS84 ellipsoid.
+    '''
+    x = np.asarray(x,dtype=float)
+    y = np.asarray(y,dtype=float)
+    z = np.asarray(z,dtype=float)
+    a, b, e2 = WGS84_A, WGS84_B, WGS84_E2
+
+    p = np.hypot(x,y)
+    F = 54.0*b*b*z*z
+    G = p*p + (1.0-e2)*z*z - e2*(a*a-b*b)
+    c = e2*e2*F*p*p/(G*G*G)
+    s = np.cbrt(1.0 + c + np.sqrt(c*c+2.0*c))
+    k = s + 1.0 + 1.0/s
+    P = F/(3.0*k*k*G*G)
+    Q = np.sqrt(1.0 + 2.0*e2*e2*P)
+    r0 = -(P*e2*p)/(1.0+Q) + np.sqrt(np.maximum(0.5*a*a*(1.0+1.0/Q) - P*(1.0-e2)*z*z/(Q*(1.0+Q)) - 0.5*P*p*p,0.0))
+    U = np.hypot(p-e2*r0,z)
+    V = np.sqrt((p-e2*r0)**2 + (1.0-e2)*z*z)
+    z0 = b*b*z/(a*V)
+
+    height = U*(1.0 - b*b/(a*V))
+    lat = np.degrees(np.arctan2(z + WGS84_EP2*z0,p))
+    lon = np.degrees(np.arctan2(y,x))
+
+    return (lat,lon,height)
+
+def _latlonheight2ecef_closed_form(lat,lon,alt):
+    lat = np.radians(np.asarray(lat,dtype=float))
+    lon = np.radians(np.asarray(lon,dtype=float))
+    alt = np.asarray(alt,dtype=float)
+
+    N = WGS84_A/np.sqrt(1.0 - WGS84_E2*np.sin(lat)**2)
+    x = (N+alt)*np.cos(lat)*np.cos(lon)
+    y = (N+alt)*np.cos(lat)*np.sin(lon)
+    z = (N*(1.0-WGS84_E2)+alt)*np.sin(lat)
+
     return (x,y,z)
@@ -1,9 +1,14 @@
 
+import os
 import logging
 
 def get_logger(log_file):
     logger = logging.getLogger(__name__)
 
+    # Avoid duplicate handlers when the same log file is requested again (e.g. in worker processes)
+    if any(getattr(handler,"baseFilename",None)==os.path.abspath(log_file) for handler in logger.handlers):
+        return logger
+
     # Create handlers
     c_handler = logging.StreamHandler()
     f_handler = logging.FileHandler(log_file)
@@ -2,6 +2,7 @@ import io
 import os
 import flask
 import json
+import math
 import time
 import random
 import librosa
@@ -15,8 +16,13 @@ from flask_cors import CORS
 
 from data_download import Celestrak,IGS,Nasa
 from conversions import norad2prn
-from snippets import send_mail,get_apod
+from snippets import send_mail,get_apod,get_coverage
 from file_utils import get_temp_file
+from elevation_store import ElevationTensor,get_station_visibility
+from visibility import StationTable,get_visibility,get_visibility_union
+from ephemeris import Ephemeris
+from live import LiveConstellation
+from forecast import ReceiverForecast
 from music_classification import MusicClassification,MusicConfig
 from tasks import make_celery,load_cnn_model
 
@@ -38,6 +44,10 @@ load_cnn_model(app,36)
 logger = get_task_logger(__name__)
 celery = make_celery(app)
 
+MAX_EPHEMERIS_EPOCHS = 86400
+live_constellation = LiveConstellation()
+receiver_forecast = ReceiverForecast()
+
 @app.route('/servercheck',methods=["GET"])
 def check_server():
     return jsonify({"message":"ok!"})
@@ -64,7 +74,8 @@ def get_earth_data():
 @app.route('/check',methods=["GET"])
 def check_data():
     '''
-    Check if any data is available for the provided date (year, month and day)
+    Check if any data is available for the provided date (year, month and day). If an
+    elevation mask (degrees) is provided, the sat_points are served from the stored elevations.
     '''
     args = request.args
     year = args.get("year")
@@ -75,6 +86,7 @@ def check_data():
     stations_path = Path(f"./output/{year}/{month}/{day}/stations")
 
     satellite = args.get("sat")
+    mask = args.get("mask")
     if not satellite:
         sat_points_bool,sat_track_bool,stations_bool = False,False,False
         if sat_points_path.exists() and sat_points_path.stat().st_size>64:
@@ -83,6 +95,8 @@ def check_data():
             sat_track_bool = True
         if stations_path.exists() and stations_path.stat().st_size>64:
             stations_bool = True
+        if mask:
+            sat_points_bool = ElevationTensor.exists(year,month,day)
         result = {
             "sat_points":sat_points_bool,
             "sat_track":sat_track_bool,
@@ -99,6 +113,8 @@ def check_data():
             sat_track_bool = True
         if stations_path.exists() and stations_path.stat().st_size>0:
             stations_bool = True
+        if mask:
+            sat_points_bool = ElevationTensor.exists(year,month,day,satellite)
         result = {
             "sat_points":sat_points_bool,
             "sat_track":sat_track_bool,
@@ -122,15 +138,36 @@ def get_data(data_id,prn):
         igs_stations
         sat_points
         timeseries
-        sat_track
+        sat_track (simplified, the raw track is returned with raw=true, 404 if it was not stored)
+        visibility
+    If an elevation mask (degrees) is provided, sat_points and timeseries are derived from
+    the stored elevations for that mask.
     '''
     args = request.args
     year = args.get("year")
     month = args.get("month").zfill(2)
     day = args.get("day").zfill(2)
 
+    mask = args.get("mask")
+    if mask and data_id in ["sat_points","timeseries"]:
+        try:
+            mask = float(mask)
+        except ValueError:
+            abort(400,f"Bad elevation mask provided: {mask}")
+        if not math.isfinite(mask):
+            abort(400,f"Bad elevation mask provided: {mask}")
+        tensor = ElevationTensor.load(year,month,day,prn)
+        if not tensor:
+            abort(404,"That's an error. We didn't find the data you are looking for.")
+        if data_id=="sat_points":
+            return jsonify(tensor.get_sat_points(mask))
+        return jsonify(tensor.get_timeseries(mask))
+
     if data_id=="igs_stations":
         filepath = Path(f"./output/{year}/{month}/{day}/stations/stations.json")
+    elif data_id=="sat_track" and args.get("raw")=="true":
+        # No fallback to the simplified track, which clients would mistake for the raw one
+        filepath = Path(f"./output/{year}/{month}/{day}/sat_track_raw/{prn}.json")
     else:
         filepath = Path(f"./output/{year}/{month}/{day}/{data_id}/{prn}.json")
 
@@ -141,6 +178,203 @@ def get_data(data_id,prn):
         data = json.load(f)
     return jsonify(data)
 
+@app.route('/data/station/<string:station>',methods=["GET"])
+def get_station_data(station):
+    '''
+    Get the visible prns and the number of satellites in view per constellation, per epoch,
+    for the provided station and date (year, month and day). If an elevation mask (degrees) is
+    provided, the result is derived from the stored elevations for that mask.
+    '''
+    args = request.args
+    year = args.get("year")
+    month = args.get("month").zfill(2)
+    day = args.get("day").zfill(2)
+
+    mask = args.get("mask")
+    if mask:
+        try:
+            mask = float(mask)
+        except ValueError:
+            abort(400,f"Bad elevation mask provided: {mask}")
+        if not math.isfinite(mask):
+            abort(400,f"Bad elevation mask provided: {mask}")
+        visibility = get_station_visibility(year,month,day,mask,[station])
+        if station not in visibility:
+            abort(404,"That's an error. We didn't find the data you are looking for.")
+        return jsonify({"station":station,"elevation_mask":mask,**visibility[station]})
+
+    filepath = Path(f"./output/{year}/{month}/{day}/station_view/{station}.json")
+    if not filepath.exists():
+        abort(404,"That's an error. We didn't find the data you are looking for.")
+
+    with filepath.open("r") as f:
+        data = json.load(f)
+    return jsonify(data)
+
+@app.route('/bitmaps/<string:prn>',methods=["GET"])
+def get_bitmaps(prn):
+    '''
+    Get the visibility bitmaps (hex encoded, one per epoch) and the number of stations in view
+    for the provided prn and date (year, month and day). With prn "union", the union over the
+    prns argument (comma separated, all prns if not provided) is returned. Prns whose bitmaps
+    use another station table or other epochs than the majority are listed in "skipped", or
+    rejected with a 409 when the prns were requested explicitly. Optional arguments:
+        expand=true: add the names of the stations in view
+        stations: comma separated stations, add per epoch whether any of them is in view
+    The bits refer to the station table (see /stations/table/<version>).
+    '''
+    args = request.args
+    year = args.get("year")
+    month = args.get("month").zfill(2)
+    day = args.get("day").zfill(2)
+
+    skipped = {}
+    if prn=="union":
+        prns = args.get("prns")
+        result = get_visibility_union(year,month,day,prns.split(",") if prns else None)
+        if result:
+            visibility,epochs,skipped = result
+            if prns and skipped:
+                abort(409,"The bitmaps of the requested prns cannot be combined: "+"; ".join(f"{prn}: {reason}" for prn,reason in skipped.items()))
+    else:
+        result = get_visibility(year,month,day,prn)
+        if result:
+            visibility,epochs = result
+    if not result:
+        abort(404,"That's an error. We didn't find the data you are looking for.")
+
+    data = {
+        "prn":prn,
+        "station_table":visibility.table.version,
+        "epochs":epochs,
+        "bitmaps":visibility.to_hex(),
+        "counts":visibility.counts().tolist()}
+    if prn=="union":
+        data["skipped"] = skipped
+    if args.get("expand")=="true":
+        data["stations_in_view"] = visibility.expand()
+    if args.get("stations"):
+        data["any_in_view"] = visibility.any_of(args.get("stations").split(",")).tolist()
+
+    return jsonify(data)
+
+@app.route('/stations/table/<string:version>',methods=["GET"])
+def get_station_table(version):
+    table = StationTable.load(version)
+    if not table:
+        abort(404,"That's an error. We didn't find the data you are looking for.")
+    return jsonify({"version":table.version,"stations":table.stations.tolist()})
+
+@app.route('/ephemeris/<string:prn>',methods=["GET"])
+def get_ephemeris_positions(prn):
+    '''
+    Evaluate the stored Chebyshev ephemeris of the prn for the provided date (year, month and
+    day), either at a single epoch t or between start and end (YYYY/mm/dd-HH:MM:SS) with a step
+    in seconds. The positions are accurate up to the returned max_error (m).
+    '''
+    args = request.args
+    year = args.get("year")
+    month = args.get("month").zfill(2)
+    day = args.get("day").zfill(2)
+
+    ephemeris = Ephemeris.load(year,month,day,prn)
+    if not ephemeris:
+        abort(404,"That's an error. We didn't find the data you are looking for.")
+    if ephemeris.rejected:
+        abort(404,f"The ephemeris of {prn} was rejected: error of {ephemeris.max_error} m.")
+
+    try:
+        t = datetime.strptime(args.get("t"),"%Y/%m/%d-%H:%M:%S") if args.get("t") else None
+        start = datetime.strptime(args.get("start"),"%Y/%m/%d-%H:%M:%S") if args.get("start") else ephemeris.start
+        end = datetime.strptime(args.get("end"),"%Y/%m/%d-%H:%M:%S") if args.get("end") else ephemeris.end
+        step = float(args.get("step",60))
+    except ValueError:
+        abort(400,"Bad epoch or step provided.")
+
+    if t:
+        epochs = [t]
+    else:
+        if not math.isfinite(step) or step<=0 or (end-start).total_seconds()/step>MAX_EPHEMERIS_EPOCHS:
+            abort(400,f"At most {MAX_EPHEMERIS_EPOCHS} epochs can be requested, increase the step.")
+        epochs = [start+timedelta(seconds=i*step) for i in range(int((end-start).total_seconds()/step)+1)]
+    if not epochs or epochs[0]<ephemeris.start or epochs[-1]>ephemeris.end:
+        abort(400,f"Epochs must be between {ephemeris.start} and {ephemeris.end}.")
+
+    return jsonify(ephemeris.get_positions(epochs))
+
+@app.route('/now',methods=["GET"])
+def get_now():
+    '''
+    Positions of all satellites and the number of IGS stations which see them, at the current
+    time or at the provided epoch t (YYYY/mm/dd-HH:MM:SS), which has to be within a few days of
+    the latest TLEs. The elevation mask (degrees) defaults to the configured one.
+    '''
+    args = request.args
+    try:
+        t = datetime.strptime(args.get("t"),"%Y/%m/%d-%H:%M:%S") if args.get("t") else None
+        mask = float(args.get("mask")) if args.get("mask") else None
+    except ValueError:
+        abort(400,"Bad epoch or elevation mask provided.")
+    if mask is not None and not math.isfinite(mask):
+        abort(400,f"Bad elevation mask provided: {mask}")
+    if t and not live_constellation.covers(t):
+        abort(400,f"No TLEs within {LiveConstellation.TLE_DAYS} days of the provided epoch.")
+
+    return jsonify(live_constellation.get_now(t,mask))
+
+@app.route('/forecast',methods=["GET"])
+def get_forecast():
+    '''
+    Elevations, azimuths and passes of all satellites for a receiver at lat, lon (degrees) and
+    height (m), for the next hours (from the epoch t if provided, YYYY/mm/dd-HH:MM:SS). Computed
+    from the stored ephemerides, the elevation mask (degrees) defaults to the configured one.
+    Epochs without ephemeris are outside the "coverage" ranges of a satellite (null elevations),
+    passes starting or ending next to them have a null rise or set.
+    '''
+    args = request.args
+    try:
+        lat = float(args.get("lat"))
+        lon = float(args.get("lon"))
+        height = float(args.get("height",0))
+        hours = float(args.get("hours",6))
+        t = datetime.strptime(args.get("t"),"%Y/%m/%d-%H:%M:%S") if args.get("t") else None
+        mask = float(args.get("mask")) if args.get("mask") else None
+    except (TypeError,ValueError):
+        abort(400,"Bad location, horizon, epoch or elevation mask provided.")
+    if mask is not None and not math.isfinite(mask):
+        abort(400,f"Bad elevation mask provided: {mask}")
+    if not -90<=lat<=90 or not -180<=lon<=180 or not math.isfinite(height):
+        abort(400,f"Bad location provided: {lat}, {lon}, {height}")
+    if not 0<hours<=receiver_forecast.max_hours:
+        abort(400,f"The forecast horizon must be between 0 and {receiver_forecast.max_hours} hours.")
+
+    result = receiver_forecast.get_forecast(lat,lon,height,hours,t,mask)
+    if not result:
+        abort(404,"That's an error. We didn't find the data you are looking for.")
+
+    return jsonify(result)
+
+@app.route('/coverage',methods=["GET"])
+def get_coverage_data():
+    '''
+    Get the coverage raster for the provided date (year, month and day). Optional arguments
+    are the constellation (G, E, R or C) and the epoch (YYYY/mm/dd-HH:MM:SS).
+    '''
+    args = request.args
+    year = args.get("year")
+    month = args.get("month").zfill(2)
+    day = args.get("day").zfill(2)
+    try:
+        epoch = datetime.strptime(args.get("epoch"),"%Y/%m/%d-%H:%M:%S") if args.get("epoch") else None
+    except ValueError:
+        abort(400,"Bad epoch provided.")
+
+    result = get_coverage(year,month,day,args.get("constellation"),epoch)
+    if not result:
+        abort(404,"That's an error. We didn't find the data you are looking for.")
+
+    return jsonify(result)
+
 @app.route('/apod/<string:data>',methods=["GET"])
 def get_APOD(data):
     if data=="dates":
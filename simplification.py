@@ -0,0 +1,80 @@
+'''
+Ground track simplification
+'''
+import numpy as np
+
+
+def split_antimeridian(lons):
+    '''
+    Return the index ranges [(start,end),...] of the parts of the track which
+    don't cross the antimeridian.
+    '''
+    lons = np.asarray(lons, dtype=float)
+    if not len(lons):
+        return []
+    jumps = (np.flatnonzero(np.abs(np.diff(lons)) > 180.0) + 1).tolist()
+    bounds = [0] + jumps + [len(lons)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _unit_vectors(lons, lats):
+    lons = np.radians(np.asarray(lons, dtype=float))
+    lats = np.radians(np.asarray(lats, dtype=float))
+    return np.column_stack([np.cos(lats)*np.cos(lons), np.cos(lats)*np.sin(lons), np.sin(lats)])
+
+
+def _angle(vector, vectors):
+    return np.arctan2(np.linalg.norm(np.cross(vectors, vector), axis=-1), vectors @ vector)
+
+
+def douglas_peucker(lons, lats, tolerance):
+    '''
+    Return the indices of the points kept by the Douglas-Peucker algorithm on the sphere.
+    The distance of a point to a segment is the angular distance (in degrees) to the
+    great circle arc between the segment end points.
+    '''
+    vectors = _unit_vectors(lons, lats)
+    n = len(vectors)
+    if n <= 2:
+        return np.arange(n)
+
+    tolerance = np.radians(tolerance)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n-1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i+1:
+            continue
+        points = vectors[i+1:j]
+        distances = np.minimum(_angle(vectors[i], points), _angle(vectors[j], points))
+        normal = np.cross(vectors[i], vectors[j])
+        normal_norm = np.linalg.norm(normal)
+        if normal_norm > 1e-12:
+            normal /= normal_norm
+            # Points projecting onto the arc use the cross-track distance, others the distance to the closest end point
+            on_arc = (np.cross(vectors[i], points) @ normal >= 0) & (np.cross(points, vectors[j]) @ normal >= 0)
+            cross_track = np.abs(np.arcsin(np.clip(points @ normal, -1.0, 1.0)))
+            distances = np.where(on_arc, cross_track, distances)
+
+        k = int(np.argmax(distances))
+        if distances[k] > tolerance:
+            keep[i+1+k] = True
+            stack.append((i, i+1+k))
+            stack.append((i+1+k, j))
+
+    return np.flatnonzero(keep)
+
+
+def simplify_track(lons, lats, tolerance):
+    '''
+    Return the indices of the points kept after simplifying the track to the provided
+    angular tolerance (degrees). The track is split at the antimeridian first, so the
+    simplification never bridges the +-180 degrees boundary.
+    '''
+    indices = []
+    for start, end in split_antimeridian(lons):
+        indices.append(start + douglas_peucker(lons[start:end], lats[start:end], tolerance))
+    if not indices:
+        return np.zeros(0, dtype=int)
+    return np.concatenate(indices)
@@ -2,40 +2,167 @@
 import os
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
+import numpy as np
 import pandas as pd 
 import json
 import geojson
 from pathlib import Path
 from datetime import datetime
 
+from simplification import simplify_track
+from coverage import CONSTELLATIONS
+
 from dotenv import load_dotenv
 load_dotenv()
 
+EPOCH_FORMAT = "%Y/%m/%d-%H:%M:%S"
+# Fractional seconds, for epochs refined below a second (e.g. rise and set times)
+PRECISE_EPOCH_FORMAT = "%Y/%m/%d-%H:%M:%S.%f"
+COORDINATE_PRECISION = 6
+
+class PRNProductWriter:
+    '''
+    Streaming writer for the per-PRN products: sat_points and sat_track (geoJSON) and
+    timeseries (JSON). Every call to write makes a single grouped pass over the columnar
+    data and appends to the files of each PRN, which are finalized on close. The output
+    is identical to dumping the complete geojson objects at once.
+    If a track tolerance (degrees) is provided, the sat_track is simplified on close and
+    the complete track is written to sat_track_raw (if provided).
+    Files are written with a .part suffix and renamed on close, so an interrupted calculation
+    never leaves a product which looks complete.
+    '''
+    def __init__(self,sat_points=None,sat_track=None,timeseries=None,sat_track_raw=None,track_tolerance=None):
+        self.basepaths = {}
+        for product,basepath in [("sat_points",sat_points),("sat_track",sat_track),("timeseries",timeseries),("sat_track_raw",sat_track_raw)]:
+            if basepath:
+                self.basepaths[product] = Path(basepath)
+        self.track_tolerance = track_tolerance
+        self.tracks = {}
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+    def get_file(self,product,prn):
+        '''
+        Return the open file for the product and prn, and whether it is still empty.
+        '''
+        key = (product,prn)
+        if key not in self.files:
+            basepath = self.basepaths[product]
+            basepath.mkdir(parents=True,exist_ok=True)
+            f = (basepath / (prn+".json.part")).open("w")
+            if product=="sat_points":
+                f.write('{"features": [')
+            elif product in ("sat_track","sat_track_raw"):
+                f.write('{"features": [{"geometry": {"coordinates": [')
+            else:
+                f.write('[')
+            self.files[key] = f
+            return f,True
+        return self.files[key],False
+
+    def write(self,df:pd.DataFrame,visibility=None):
+        '''
+        Append the rows of the df (with columns: prn,epoch,lat,lon,number_stations_in_view
+        and stations_in_view) to the outputs. If the visibility bitmaps of the rows are
+        provided, the station names are expanded from them instead of the stations_in_view column.
+        '''
+        if df.empty:
+            return
+
+        prns = df.prn.to_numpy()
+        order = np.argsort(prns,kind="stable")
+        sorted_prns = prns[order]
+        boundaries = np.flatnonzero(sorted_prns[1:]!=sorted_prns[:-1])+1
+        starts = np.concatenate([[0],boundaries])
+        ends = np.concatenate([boundaries,[len(order)]])
+
+        epochs = pd.to_datetime(df.epoch).dt.strftime(EPOCH_FORMAT).to_numpy()[order]
+        lons = [round(lon,COORDINATE_PRECISION) for lon in df.lon.to_numpy(dtype=float)[order].tolist()]
+        lats = [round(lat,COORDINATE_PRECISION) for lat in df.lat.to_numpy(dtype=float)[order].tolist()]
+        if "sat_points" in self.basepaths or "timeseries" in self.basepaths:
+            numbers = df.number_stations_in_view.to_numpy()[order].tolist()
+        if "sat_points" in self.basepaths:
+            if visibility is not None:
+                stations = [visibility.table.stations[row] for row in visibility.to_matrix()[order]]
+            else:
+                stations = df.stations_in_view.to_numpy()[order]
+
+        for start,end in zip(starts,ends):
+            prn = sorted_prns[start]
+            if "sat_points" in self.basepaths:
+                f,first = self.get_file("sat_points",prn)
+                prn_json = json.dumps(prn,ensure_ascii=False)
+                features = [
+                    '{"geometry": {"coordinates": [%r, %r], "type": "Point"}, "properties": {"epoch": "%s", "number_stations_in_view": %d, "prn": %s, "stations_in_view": %s}, "type": "Feature"}' %
+                    (lons[i],lats[i],epochs[i],numbers[i],prn_json,json.dumps(" ".join(stations[i]),ensure_ascii=False))
+                    for i in range(start,end)]
+                f.write(("" if first else ", ")+", ".join(features))
+            if "sat_track" in self.basepaths and self.track_tolerance:
+                track_lons,track_lats = self.tracks.setdefault(prn,([],[]))
+                track_lons.extend(lons[start:end])
+                track_lats.extend(lats[start:end])
+            for product in ["sat_track","sat_track_raw"]:
+                if product not in self.basepaths or (product=="sat_track" and self.track_tolerance):
+                    continue
+                f,first = self.get_file(product,prn)
+                coordinates = ["[%r, %r]" % (lons[i],lats[i]) for i in range(start,end)]
+                f.write(("" if first else ", ")+", ".join(coordinates))
+            if "timeseries" in self.basepaths:
+                f,first = self.get_file("timeseries",prn)
+                data = ['{"epoch": "%s", "stations": %d}' % (epochs[i],numbers[i]) for i in range(start,end)]
+                f.write(("" if first else ", ")+", ".join(data))
+
+    def close(self):
+        for prn,(track_lons,track_lats) in self.tracks.items():
+            indices = simplify_track(np.array(track_lons),np.array(track_lats),self.track_tolerance)
+            f,_ = self.get_file("sat_track",prn)
+            f.write(", ".join("[%r, %r]" % (track_lons[i],track_lats[i]) for i in indices))
+        self.tracks = {}
+
+        for (product,prn),f in self.files.items():
+            if product=="sat_points":
+                f.write('], "type": "FeatureCollection"}')
+            elif product in ("sat_track","sat_track_raw"):
+                f.write('], "type": "LineString"}, "properties": {"prn": %s}, "type": "Feature"}], "type": "FeatureCollection"}' % json.dumps(prn,ensure_ascii=False))
+            else:
+                f.write(']')
+            f.close()
+            filepath = Path(f.name)
+            filepath.replace(filepath.with_suffix(""))
+        self.files = {}
+
+    def abort(self):
+        '''
+        Discard all partially written files.
+        '''
+        for f in self.files.values():
+            f.close()
+            Path(f.name).unlink(missing_ok=True)
+        self.files = {}
+        self.tracks = {}
+
+def df2prnproducts(df:pd.DataFrame,sat_points=None,sat_track=None,timeseries=None,sat_track_raw=None,track_tolerance=None):
+    '''
+    Write the sat_points, sat_track and timeseries products (for the basepaths which
+    are provided) in a single pass over the df.
+    '''
+    with PRNProductWriter(sat_points,sat_track,timeseries,sat_track_raw,track_tolerance) as writer:
+        writer.write(df)
+
 def df2geojsonSatPoints(df:pd.DataFrame,basepath):
     '''
     Convert the df (with columns: epoch,lat,lon,number_stations_in_view and stations_in_view)
     to geoJSON format.
     '''
-    for prn in pd.unique(df.prn):
-        features = []
-        insert_features = lambda x: features.append(
-            geojson.Feature(
-                geometry=geojson.Point(coordinates=[x["lon"],x["lat"]]),
-                properties={
-                    "prn":x["prn"],
-                    "epoch":datetime.strftime(x["epoch"],"%Y/%m/%d-%H:%M:%S"),
-                    "number_stations_in_view":x["number_stations_in_view"],
-                    "stations_in_view":" ".join(x["stations_in_view"])
-                }
-            )
-        )
-        df[df.prn==prn].apply(insert_features,axis=1)
-        basepath = Path(basepath)
-        basepath.mkdir(parents=True,exist_ok=True)
-        filename = prn+".json"
-        output = Path(basepath) / filename
-        with output.open("w") as f:
-            geojson.dump(geojson.FeatureCollection(features),f,sort_keys=True, ensure_ascii=False)
+    df2prnproducts(df,sat_points=basepath)
 
 def df2geojsonStationPoints(df:pd.DataFrame,basepath):
     '''
@@ -66,48 +193,122 @@ def df2geojsonLineString(df:pd.DataFrame,basepath):
     Convert the df (with columns: epoch,lat,lon,number_stations_in_view and stations_in_view)
     to geoJSON format.
     '''
-    for prn in pd.unique(df.prn):
-        coordinates = []
-        add_coordinates = lambda x: coordinates.append([x["lon"],x["lat"]])
-        df[df.prn==prn].apply(add_coordinates,axis=1)
-
-        features = [geojson.Feature(
-            geometry=geojson.LineString(coordinates=coordinates),
-            properties={"prn":prn}
-        )]
-        #print(df[df.prn==prn])
-        
-        basepath = Path(basepath)
-        basepath.mkdir(parents=True,exist_ok=True)
-        filename = prn+".json"
-        output = basepath / filename
-        with output.open("w") as f:
-            geojson.dump(geojson.FeatureCollection(features),f,sort_keys=True,ensure_ascii=False)
+    df2prnproducts(df,sat_track=basepath)
 
 def df2timeseriesdata(df:pd.DataFrame,basepath):
 
     '''
     Convert the df to JSON format ready to be read by the TS files.
     '''
-    for prn in pd.unique(df.prn):
-        data = []
-        add_data = lambda x : data.append(
+    df2prnproducts(df,timeseries=basepath)
+
+def intervals2json(intervals,prn,elevation_mask,basepath):
+    '''
+    Write the visibility intervals ([(station,rise,set),...]) of a satellite to JSON format.
+    Rise and set times keep their fractional seconds, they are refined below a second.
+    '''
+    data = {
+        "prn":prn,
+        "elevation_mask":elevation_mask,
+        "intervals":[
             {
-                "epoch":datetime.strftime(x["epoch"],"%Y/%m/%d-%H:%M:%S"),
-                "stations":x["number_stations_in_view"]
-            }
-        )
+                "station":station,
+                "rise":datetime.strftime(rise,PRECISE_EPOCH_FORMAT),
+                "set":datetime.strftime(set_epoch,PRECISE_EPOCH_FORMAT)
+            } for station,rise,set_epoch in intervals
+        ]
+    }
 
-        df[df.prn==prn].apply(add_data,axis=1)
+    basepath = Path(basepath)
+    basepath.mkdir(parents=True,exist_ok=True)
+    output = basepath / (prn+".json")
+    with output.open("w") as f:
+        json.dump(data,f)
 
-        basepath = Path(basepath)
-        basepath.mkdir(parents=True,exist_ok=True)
-        filename = prn+".json"
-        output = basepath / filename
+def station_visibility2json(visibility,elevation_mask,basepath):
+    '''
+    Write the station-centric visibility ({station:{"epochs","prns","counts"}}, or an iterable
+    of (station,data) tuples) to one JSON file per station.
+    '''
+    basepath = Path(basepath)
+    basepath.mkdir(parents=True,exist_ok=True)
+    if isinstance(visibility,dict):
+        visibility = visibility.items()
+    for station,data in visibility:
+        output = basepath / (station+".json.part")
         with output.open("w") as f:
-            json.dump(data,f)
+            json.dump({"station":station,"elevation_mask":elevation_mask,**data},f)
+        output.replace(output.with_suffix(""))
+
+def coverage2npz(counts,epochs,grid,elevation_mask,basepath):
+    '''
+    Write the coverage raster (counts of shape (constellations,epochs,cells)) for the
+    provided grid to a compressed npz file.
+    '''
+    basepath = Path(basepath)
+    basepath.mkdir(parents=True,exist_ok=True)
+    np.savez_compressed(
+        basepath / "coverage.npz",
+        counts=counts.astype(np.uint8),
+        epochs=np.array([datetime.strftime(epoch,EPOCH_FORMAT) for epoch in epochs]),
+        layout=grid.layout,
+        resolution=grid.resolution,
+        cell_lats=grid.lat,
+        cell_lons=grid.lon,
+        shape=np.array(grid.shape if grid.shape else [-1,-1]),
+        constellations=np.array(CONSTELLATIONS),
+        elevation_mask=elevation_mask)
+
+def get_coverage(year,month,day,constellation=None,epoch=None):
+    '''
+    Get the coverage raster for the provided date: the number of satellites in view for the
+    provided constellation (all constellations if not provided), at the epoch closest to the
+    provided epoch or averaged over the day if no epoch is provided. For the equal angle
+    layout the counts are returned as rows (lats) of columns (lons), for the equal area
+    layout as a flat list with the lat and lon of every cell.
+    '''
+    filepath = Path(f"./output/{year}/{month}/{day}/coverage/coverage.npz")
+    if not filepath.exists():
+        return None
+
+    with np.load(filepath) as data:
+        counts = data["counts"]
+        epochs = list(data["epochs"])
+        constellations = list(data["constellations"])
+        shape = tuple(int(n) for n in data["shape"])
+        cell_lats = data["cell_lats"]
+        cell_lons = data["cell_lons"]
+        result = {"layout":str(data["layout"]),"elevation_mask":float(data["elevation_mask"])}
+
+    if constellation:
+        if constellation not in constellations:
+            return None
+        counts = counts[constellations.index(constellation)]
+    else:
+        counts = counts.sum(axis=0,dtype=np.uint16)
+
+    if epoch:
+        if isinstance(epoch,str):
+            epoch = datetime.strptime(epoch,EPOCH_FORMAT)
+        index = int(np.argmin([abs((datetime.strptime(e,EPOCH_FORMAT)-epoch).total_seconds()) for e in epochs]))
+        result["epoch"] = epochs[index]
+        counts = counts[index]
+    else:
+        result["epoch"] = None
+        counts = np.round(counts.mean(axis=0),2)
+
+    if shape[0]>0:
+        result["lats"] = cell_lats.reshape(shape)[:,0].tolist()
+        result["lons"] = cell_lons.reshape(shape)[0].tolist()
+        result["counts"] = counts.reshape(shape).tolist()
+    else:
+        result["lats"] = cell_lats.tolist()
+        result["lons"] = cell_lons.tolist()
+        result["counts"] = counts.tolist()
+
+    return result
 
-def check_output(product,date,sat=None):
+def check_output(product,date,sat=None,extension="json"):
     '''
     Check if output exists for the provided product, date and 
     satellite (if applicable).
@@ -117,9 +318,9 @@ def check_output(product,date,sat=None):
     day = str(date.day).zfill(2)
     filepath = Path(f"./output/{year}/{month}/{day}/{product}")
     if sat:
-        filepath = filepath / f"{sat}.json"
+        filepath = filepath / f"{sat}.{extension}"
     else:
-        filepath = filepath / f"{product}.json"
+        filepath = filepath / f"{product}.{extension}"
 
     if filepath.exists() and filepath.stat().st_size>0:
         return True
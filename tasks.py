@@ -1,9 +1,8 @@
 from celery import Celery
-from music_classification import MusicClassification,MusicConfig
 
-def make_celery(app):
+def make_celery(app,name="server"):
     celery = Celery(
-        "server",
+        name,
         backend=app.config['result_backend'],
         broker=app.config['CELERY_BROKER_URL']
     )
@@ -18,6 +17,8 @@ def make_celery(app):
     return celery
 
 def load_cnn_model(app,number):
+    # Imported here, so that the GNSS workers can share make_celery without the audio classifier
+    from music_classification import MusicClassification,MusicConfig
     config_file = f"./machine_learning/model_results/results_{number}/model_config.txt"
     config = MusicConfig.read_config(config_file)
     mclas = MusicClassification(config)
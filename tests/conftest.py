@@ -0,0 +1,45 @@
+import sys
+from pathlib import Path
+from datetime import date
+
+import pytest
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0,str(REPO_PATH))
+
+# Synthetic GPS TLEs one day apart (day 101 is April 10th 2024)
+NAME = "GPS BIIR-2  (PRN 13)"
+LINE1 = "1 24876U 97035A   24101.00000000  .00000000  00000-0  00000-0 0  9990"
+LINE1_NEXT = "1 24876U 97035A   24102.00000000  .00000000  00000-0  00000-0 0  9990"
+LINE2 = "2 24876  55.6000 170.0000 0050000 100.0000 260.0000  2.00561000 12345"
+
+STATIONS_CSV = """#stn,X,Y,Z,Latitude,Longitude,Height,ReceiverName,AntennaName,ClockType
+BRUX00BEL,4027881.628,306998.537,4919499.036,50.798,4.359,158.2,SEPT POLARX5,JAVRINGANT_DM,INTERNAL
+MAS100ESP,5439192.193,-1522055.328,2953454.891,27.764,-15.633,197.3,SEPT POLARX5,LEIAR25.R4,EXTERNAL CESIUM
+HRAO00ZAF,5084625.434,2670366.474,-2768493.982,-25.890,27.687,1414.2,SEPT POLARX5TR,ASH701945E_M,EXTERNAL H-MASER
+"""
+
+
+@pytest.fixture
+def workdir(tmp_path,monkeypatch):
+    '''
+    Run the test from an empty directory holding the repository config, a small station
+    network and a TLE store with the synthetic TLEs, as all paths are relative.
+    '''
+    from tle_store import TLEStore
+    from data_download import Celestrak,IGS
+    import conversions
+
+    for directory in ["config","logs","tmp"]:
+        (tmp_path / directory).mkdir()
+    (tmp_path / "config" / "config.ini").write_text((REPO_PATH / "config" / "config.ini").read_text())
+    (tmp_path / "tmp" / "IGS_stations.csv").write_text(STATIONS_CSV)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(IGS,"_catalog",None)
+    monkeypatch.setattr(conversions,"_prn_cache",{})
+    monkeypatch.setattr(conversions,"_cus_tables",{})
+
+    store = TLEStore(Celestrak.STORE_PATH)
+    store.add_tles("gps-ops",date(2024,4,10),[NAME,LINE1,LINE2])
+    store.add_tles("gps-ops",date(2024,4,11),[NAME,LINE1_NEXT,LINE2])
+    return tmp_path
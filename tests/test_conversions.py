@@ -0,0 +1,30 @@
+import os
+from datetime import date
+
+from conversions import GlonassInfo,norad2prn
+
+NORAD_ID = "COSMOS 2456 (747)"
+DATE = date(2024,4,10)
+
+
+def write_cus_message(slot,day=DATE,mtime=None):
+    filepath = GlonassInfo.get_cus_path(day)
+    filepath.parent.mkdir(parents=True,exist_ok=True)
+    filepath.write_text(f"|  747  | 2456 | 1/{slot} |  -2  | 26.04.2010 | 02.12.2010 | 158.5 | 00:00 | In operation\n")
+    if mtime:
+        os.utime(filepath,ns=(mtime,mtime))
+
+def test_norad2prn_follows_cus_message_updates(workdir):
+    write_cus_message("02",mtime=1_000_000_000)
+    assert norad2prn(NORAD_ID,DATE)=="R02"
+
+    # Rewritten by another process, e.g. the daily download
+    write_cus_message("07",mtime=2_000_000_000)
+    assert norad2prn(NORAD_ID,DATE)=="R07"
+
+def test_norad2prn_prefers_the_message_of_the_date(workdir):
+    write_cus_message("03",day=date(2024,4,9))
+    assert norad2prn(NORAD_ID,DATE)=="R03"
+
+    write_cus_message("05")
+    assert norad2prn(NORAD_ID,DATE)=="R05"
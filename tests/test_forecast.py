@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import pytest
+
+import gnss_tasks
+from forecast import ReceiverForecast
+from conftest import NAME
+
+# Brussels, with the GPS BIIR-2 ephemeris of April 10th only
+LAT,LON = 50.8,4.36
+
+
+@pytest.fixture
+def forecast_workdir(workdir,monkeypatch):
+    monkeypatch.setattr(gnss_tasks,"_geometry",None)
+    monkeypatch.setattr(gnss_tasks,"_tle_range",None)
+    args = (NAME,"2024/04/10-00:00:00","2024/04/11-00:00:00","2024/04/10-00:00:00","2024/04/12-00:00:00",30)
+    assert gnss_tasks.calculate_satellite_day.apply(args=args).get()["status"]=="done"
+    return workdir
+
+def test_forecast_starts_at_the_requested_epoch(forecast_workdir):
+    forecast = ReceiverForecast().get_forecast(LAT,LON,hours=2,start=datetime(2024,4,10,6,2,30))
+    assert forecast["start"]=="2024/04/10-06:02:30"
+    assert forecast["epochs"][0]=="2024/04/10-06:03:00"
+    assert forecast["epochs"][-1]=="2024/04/10-08:02:00"
+    for satellite_pass in forecast["passes"]:
+        assert satellite_pass["rise"]>="2024/04/10-06:02:30"
+        assert satellite_pass["max_elevation"]>=forecast["elevation_mask"]
+
+def test_forecast_without_ephemeris_leaves_passes_open(forecast_workdir):
+    forecast = ReceiverForecast().get_forecast(LAT,LON,hours=24,start=datetime(2024,4,10,12))
+    satellite = forecast["satellites"][0]
+    assert satellite["coverage"]==[["2024/04/10-12:00:00","2024/04/11-00:00:00"]]
+    assert all(value is None for value in satellite["elevation"][12*60+1:])
+    # No pass ends at midnight, where the ephemeris ends
+    assert all(satellite_pass["set"]!="2024/04/11-00:00:00" for satellite_pass in forecast["passes"])
+    if satellite["elevation"][12*60]>=forecast["elevation_mask"]:
+        assert forecast["passes"][-1]["set"] is None
+
+def test_ephemerides_are_evicted(forecast_workdir):
+    receiver_forecast = ReceiverForecast()
+    receiver_forecast.ephemeris_days = 1
+    receiver_forecast.get_forecast(LAT,LON,hours=24,start=datetime(2024,4,10,12))
+    assert len(receiver_forecast.ephemerides)==1
+
+def test_cache_is_bounded_by_size(forecast_workdir):
+    receiver_forecast = ReceiverForecast()
+    receiver_forecast.cache_bytes = 1
+    for hour in [6,7,8]:
+        receiver_forecast.get_forecast(LAT,LON,hours=1,start=datetime(2024,4,10,hour))
+    assert len(receiver_forecast.cache)==1
+    assert receiver_forecast.cached_bytes==next(iter(receiver_forecast.cache.values()))["nbytes"]
@@ -0,0 +1,108 @@
+import os
+import json
+
+import pytest
+from celery.contrib.testing.worker import start_worker
+from celery.result import GroupResult
+
+# In-memory broker and result backend, read when gnss_tasks builds its Celery app
+os.environ["CELERY_BROKER_URL"] = "memory://"
+os.environ["CELERY_RESULT_BACKEND"] = "cache+memory://"
+
+import gnss_tasks
+from ephemeris import Ephemeris
+from conftest import NAME
+
+START = "2024/04/10-00:00:00"
+END = "2024/04/12-00:00:00"
+SAMPLING = 30
+
+
+@pytest.fixture
+def tasks_workdir(workdir,monkeypatch):
+    # The Geometry of the worker process is cached per process, start from scratch
+    monkeypatch.setattr(gnss_tasks,"_geometry",None)
+    monkeypatch.setattr(gnss_tasks,"_tle_range",None)
+    return workdir
+
+def test_calculate_satellite_day_is_idempotent(tasks_workdir):
+    args = (NAME,"2024/04/10-00:00:00","2024/04/11-00:00:00",START,END,SAMPLING)
+    # A day is only complete once its stations product is present as well
+    gnss_tasks.write_stations_day.apply(args=("2024/04/10-00:00:00",)).get()
+
+    first = gnss_tasks.calculate_satellite_day.apply(args=args).get()
+    assert first=={"norad_id":NAME,"date":"2024-04-10","status":"done"}
+    sat_points = tasks_workdir / "output/2024/04/10/sat_points/G13.json"
+    with sat_points.open("r") as f:
+        assert len(json.load(f)["features"])==24*60//SAMPLING
+    modified = sat_points.stat().st_mtime_ns
+
+    second = gnss_tasks.calculate_satellite_day.apply(args=args).get()
+    assert second["status"]=="skipped"
+    assert sat_points.stat().st_mtime_ns==modified
+
+def test_calculate_satellite_day_recalculates_missing_products(tasks_workdir):
+    args = (NAME,"2024/04/10-00:00:00","2024/04/11-00:00:00",START,END,SAMPLING)
+    gnss_tasks.write_stations_day.apply(args=("2024/04/10-00:00:00",)).get()
+    gnss_tasks.calculate_satellite_day.apply(args=args).get()
+
+    # E.g. a day calculated before the bitmaps were enabled
+    (tasks_workdir / "output/2024/04/10/bitmaps/G13.json").unlink()
+    assert gnss_tasks.calculate_satellite_day.apply(args=args).get()["status"]=="done"
+    assert (tasks_workdir / "output/2024/04/10/bitmaps/G13.json").exists()
+
+def test_backfill_fans_out_and_reports_status(tasks_workdir):
+    with start_worker(gnss_tasks.celery,pool="solo",perform_ping_check=False):
+        group_id = gnss_tasks.backfill(START,END,[NAME],SAMPLING)
+        GroupResult.restore(group_id,app=gnss_tasks.celery).get(timeout=120)
+        status = gnss_tasks.backfill_status(group_id)
+
+    # One stations task, one satellite task and one station products callback per day
+    assert status=={"id":group_id,"total":6,"completed":6,"failed":0,"ready":True}
+    for day in ["10","11"]:
+        assert (tasks_workdir / f"output/2024/04/{day}/sat_points/G13.json").exists()
+        assert (tasks_workdir / f"output/2024/04/{day}/stations/stations.json").exists()
+        with (tasks_workdir / f"output/2024/04/{day}/station_view/BRUX.json").open("r") as f:
+            station_view = json.load(f)
+        assert len(station_view["epochs"])==24*60//SAMPLING
+        assert station_view["counts"]["G"]==[len(prns) for prns in station_view["prns"]]
+
+def test_backfill_failed_satellite_does_not_block_other_days(tasks_workdir,monkeypatch):
+    calculate_satellite = gnss_tasks.Geometry.calculate_satellite
+    def fail_on_first_day(self,norad_id,start,end,basepath,sampling=5):
+        if start.day==10:
+            raise Exception("Propagation failed")
+        return calculate_satellite(self,norad_id,start,end,basepath,sampling)
+    monkeypatch.setattr(gnss_tasks.Geometry,"calculate_satellite",fail_on_first_day)
+    monkeypatch.setattr(gnss_tasks.calculate_satellite_day,"max_retries",0)
+
+    with start_worker(gnss_tasks.celery,pool="solo",perform_ping_check=False):
+        group_id = gnss_tasks.backfill(START,END,[NAME],SAMPLING)
+        GroupResult.restore(group_id,app=gnss_tasks.celery).get(timeout=120)
+        status = gnss_tasks.backfill_status(group_id)
+
+    assert status=={"id":group_id,"total":6,"completed":6,"failed":1,"ready":True}
+    assert not (tasks_workdir / "output/2024/04/10/sat_points/G13.json").exists()
+    assert (tasks_workdir / "output/2024/04/11/station_view/BRUX.json").exists()
+
+def test_backfill_skips_present_days(tasks_workdir):
+    with start_worker(gnss_tasks.celery,pool="solo",perform_ping_check=False):
+        GroupResult.restore(gnss_tasks.backfill(START,END,[NAME],SAMPLING),app=gnss_tasks.celery).get(timeout=120)
+        group_id = gnss_tasks.backfill(START,END,[NAME],SAMPLING)
+        results = GroupResult.restore(group_id,app=gnss_tasks.celery).get(timeout=120)
+
+    assert [result["status"] for result in results]==["skipped","skipped"]
+
+def test_backfill_status_unknown_id():
+    with pytest.raises(Exception):
+        gnss_tasks.backfill_status("unknown")
+
+def test_rejected_ephemeris_counts_as_done(tasks_workdir):
+    config_file = tasks_workdir / "config" / "config.ini"
+    config_file.write_text(config_file.read_text().replace("ephemeris_tolerance = 1.0","ephemeris_tolerance = 0.0"))
+    args = (NAME,"2024/04/10-00:00:00","2024/04/11-00:00:00",START,END,SAMPLING)
+    gnss_tasks.write_stations_day.apply(args=("2024/04/10-00:00:00",)).get()
+
+    assert gnss_tasks.calculate_satellite_day.apply(args=args).get()["status"]=="done"
+    assert Ephemeris.load(2024,4,10,"G13").rejected
+    assert gnss_tasks.calculate_satellite_day.apply(args=args).get()["status"]=="skipped"
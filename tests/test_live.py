@@ -0,0 +1,22 @@
+from datetime import date,datetime
+
+from live import LiveConstellation
+
+
+def make_constellation(workdir,monkeypatch):
+    (workdir / "tmp" / "prns.txt").write_text("G13\n")
+    constellation = LiveConstellation()
+    monkeypatch.setattr(constellation,"get_source",lambda: (0,date(2024,4,11)))
+    return constellation
+
+def test_now_from_the_pool(workdir,monkeypatch):
+    constellation = make_constellation(workdir,monkeypatch)
+    now = constellation.get_now(datetime(2024,4,11,12))
+    assert now["prns"]==["G13"]
+    assert len(now["number_stations_in_view"])==1
+
+def test_epochs_far_from_the_tles_are_rejected(workdir,monkeypatch):
+    constellation = make_constellation(workdir,monkeypatch)
+    assert constellation.covers(datetime(2024,4,13))
+    assert not constellation.covers(datetime(2024,6,1))
+    assert constellation.get_now(datetime(2024,6,1))["prns"]==[]
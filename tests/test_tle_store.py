@@ -0,0 +1,16 @@
+from datetime import datetime
+
+from tle_store import tle_epoch
+from conftest import LINE1
+
+
+def test_tle_epoch_day_of_year_is_one_based():
+    line1 = "1 24876U 97035A   24001.50000000  .00000000  00000-0  00000-0 0  9990"
+    assert tle_epoch(line1)==datetime(2024,1,1,12)
+
+def test_tle_epoch_before_2000():
+    line1 = "1 24876U 97035A   98032.25000000  .00000000  00000-0  00000-0 0  9990"
+    assert tle_epoch(line1)==datetime(1998,2,1,6)
+
+def test_tle_epoch_leap_year():
+    assert tle_epoch(LINE1)==datetime(2024,4,10)
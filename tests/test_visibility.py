@@ -0,0 +1,28 @@
+from datetime import datetime
+
+import numpy as np
+
+from visibility import StationTable,VisibilityBitmap,VisibilityWriter,get_visibility_union
+
+START = datetime(2024,4,10)
+
+
+def write_bitmaps(workdir,prn,table,in_view,start=START,sampling=5):
+    in_view = np.asarray(in_view,dtype=bool)
+    with VisibilityWriter(workdir / "output/2024/04/10/bitmaps",prn,start,sampling,len(in_view),table) as writer:
+        writer.write(VisibilityBitmap.from_matrix(in_view,table))
+
+def test_union_skips_mismatched_prns(workdir):
+    table = StationTable(["BRUX","HRAO","MAS1"])
+    other_table = StationTable(["BRUX","HRAO"])
+    write_bitmaps(workdir,"G01",table,[[1,0,0],[0,0,0]])
+    write_bitmaps(workdir,"G02",table,[[0,0,1],[0,1,0]])
+    write_bitmaps(workdir,"G03",other_table,[[1,1],[1,1]])
+    write_bitmaps(workdir,"G04",table,[[1,1,1],[1,1,1]],start=datetime(2024,4,10,0,1))
+
+    visibility,epochs,skipped = get_visibility_union(2024,4,10)
+
+    assert visibility.expand()==[["BRUX","MAS1"],["HRAO"]]
+    assert epochs==["2024/04/10-00:00:00","2024/04/10-00:05:00"]
+    assert sorted(skipped)==["G03","G04"]
+    assert "station table" in skipped["G03"]
@@ -0,0 +1,94 @@
+'''
+Per-satellite TLE index
+'''
+import bisect
+import numpy as np
+
+
+class TLEIndex:
+    '''
+    For every satellite (norad id), an epoch-sorted list of TLE elements.
+    '''
+    def __init__(self):
+        self.tles = {}
+        self.epochs = {}
+
+    @classmethod
+    def from_tles(cls, tles):
+        '''
+        Build the index in one pass over the provided TLE elements. Duplicate
+        epochs for the same satellite are only stored once.
+        '''
+        index = cls()
+        grouped = {}
+        for tle in tles:
+            grouped.setdefault(tle.norad_id, {})[tle.epoch] = tle
+
+        for norad_id, sat_tles in grouped.items():
+            epochs = sorted(sat_tles)
+            index.tles[norad_id] = [sat_tles[epoch] for epoch in epochs]
+            index.epochs[norad_id] = epochs
+
+        return index
+
+    def __contains__(self, norad_id):
+        return norad_id in self.tles
+
+    def __len__(self):
+        return sum(len(tles) for tles in self.tles.values())
+
+    def norad_ids(self):
+        return list(self.tles)
+
+    def get_closest(self, norad_id, epoch):
+        '''
+        Return the TLE element with the epoch closest to the provided epoch.
+        '''
+        epochs = self.epochs.get(norad_id)
+        if not epochs:
+            raise Exception(f"No valid TLE found for {norad_id} and {epoch}")
+
+        i = bisect.bisect_left(epochs, epoch)
+        if i == 0:
+            return self.tles[norad_id][0]
+        if i == len(epochs):
+            return self.tles[norad_id][-1]
+        if epochs[i] - epoch <= epoch - epochs[i-1]:
+            return self.tles[norad_id][i]
+        return self.tles[norad_id][i-1]
+
+    def get_segments(self, norad_id, epochs):
+        '''
+        Split the sorted epochs according to the closest TLE, switching TLEs halfway
+        between two consecutive TLE epochs (an epoch exactly halfway uses the later TLE).
+        returns list of tuples : [(tle,start_index,end_index),...]
+        '''
+        tle_epochs = self.epochs.get(norad_id)
+        if not tle_epochs:
+            raise Exception(f"No valid TLE found for {norad_id}")
+
+        tle_epochs = np.array(tle_epochs, dtype="datetime64[us]")
+        midpoints = tle_epochs[:-1] + (tle_epochs[1:] - tle_epochs[:-1])/2
+        tle_numbers = np.searchsorted(midpoints, np.array(epochs, dtype="datetime64[us]"), side="right")
+
+        result = []
+        start_index = 0
+        for i in range(1, len(tle_numbers)+1):
+            if i == len(tle_numbers) or tle_numbers[i] != tle_numbers[start_index]:
+                result.append((self.tles[norad_id][tle_numbers[start_index]], start_index, i))
+                start_index = i
+
+        return result
+
+    def get_switch_epochs(self, norad_id, start, end):
+        '''
+        Return the epochs (datetime64) strictly between start and end at which get_segments
+        switches to the next TLE of the satellite.
+        '''
+        tle_epochs = self.epochs.get(norad_id)
+        if not tle_epochs:
+            raise Exception(f"No valid TLE found for {norad_id}")
+
+        tle_epochs = np.array(tle_epochs, dtype="datetime64[us]")
+        midpoints = tle_epochs[:-1] + (tle_epochs[1:] - tle_epochs[:-1])/2
+        return midpoints[(midpoints > np.datetime64(start, "us")) & (midpoints < np.datetime64(end, "us"))]
@@ -0,0 +1,189 @@
+'''
+Consolidated, append-only TLE archive
+'''
+import json
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from datetime import datetime, timedelta, date as date_type
+
+import pandas as pd
+
+
+def tle_epoch(line1):
+    '''
+    Return the epoch of the provided TLE line 1 as a datetime object.
+    '''
+    elems1 = line1.split()
+    year = int(elems1[3][:2])
+    year = year + 1900 if year>=57 else year + 2000
+    # The day of year is 1-based: day 1.5 is January 1st at noon
+    return datetime(year, 1, 1) + timedelta(days=float(elems1[3][2:])-1)
+
+
+def _date_str(date):
+    if isinstance(date, datetime):
+        date = date.date()
+    if isinstance(date, str):
+        date = datetime.strptime(date, "%Y/%m/%d").date()
+    if not isinstance(date, date_type):
+        raise Exception(f"Bad date provided: {date}")
+    return date.isoformat()
+
+
+class TLEStore:
+    '''
+    SQLite archive of all downloaded TLEs (and Celestrak CSV records), indexed on
+    group/archive date and on norad id/epoch. The archive date is the date under
+    which a download used to be stored in the legacy directory tree.
+    '''
+    DEFAULT_PATH = "./downloads/celestrak/celestrak.sqlite"
+    # Databases whose schema was already created by this process
+    _initialized = set()
+
+    def __init__(self, db_file=None):
+        self.db_file = Path(db_file if db_file else self.DEFAULT_PATH)
+        key = str(self.db_file.resolve())
+        if key in self._initialized and self.db_file.exists():
+            return
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as connection:
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS tles (
+                    group_name TEXT NOT NULL,
+                    archive_date TEXT NOT NULL,
+                    norad_id TEXT NOT NULL,
+                    catalog_number INTEGER,
+                    epoch TEXT NOT NULL,
+                    line1 TEXT NOT NULL,
+                    line2 TEXT NOT NULL,
+                    UNIQUE (group_name, archive_date, norad_id, epoch)
+                );
+                CREATE INDEX IF NOT EXISTS tles_group_date ON tles (group_name, archive_date);
+                CREATE INDEX IF NOT EXISTS tles_norad_epoch ON tles (norad_id, epoch);
+                CREATE TABLE IF NOT EXISTS omm (
+                    group_name TEXT NOT NULL,
+                    archive_date TEXT NOT NULL,
+                    catalog_number INTEGER NOT NULL,
+                    object_name TEXT,
+                    epoch TEXT NOT NULL,
+                    record TEXT NOT NULL,
+                    UNIQUE (group_name, archive_date, catalog_number, epoch)
+                );
+                CREATE INDEX IF NOT EXISTS omm_group_date ON omm (group_name, archive_date);
+            ''')
+        self._initialized.add(key)
+
+    @contextmanager
+    def connect(self):
+        # A new connection per operation, sqlite connections can't be shared between threads
+        connection = sqlite3.connect(str(self.db_file))
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def add_tles(self, group, archive_date, lines):
+        '''
+        Append the TLEs contained in the provided (3-line format) lines.
+        Returns the number of new TLEs.
+        '''
+        archive_date = _date_str(archive_date)
+        rows = []
+        for i in range(0, len(lines)-2, 3):
+            name = lines[i].replace('\n', '').strip()
+            line1 = lines[i+1]
+            line2 = lines[i+2]
+            if not line1.startswith("1 ") or not line2.startswith("2 "):
+                continue
+            rows.append((group, archive_date, name, int(line1[2:7]), tle_epoch(line1).isoformat(), line1, line2))
+
+        with self.connect() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO tles (group_name, archive_date, norad_id, catalog_number, epoch, line1, line2) VALUES (?,?,?,?,?,?,?)", rows)
+            return connection.total_changes - before
+
+    def add_csv(self, group, archive_date, df):
+        '''
+        Append the records of a Celestrak CSV (OMM) dataframe. Returns the number of new records.
+        '''
+        archive_date = _date_str(archive_date)
+        rows = []
+        for record in df.to_dict(orient="records"):
+            rows.append((group, archive_date, int(record["NORAD_CAT_ID"]), record.get("OBJECT_NAME"),
+                         str(pd.Timestamp(record["EPOCH"]).isoformat()), json.dumps(record, default=str)))
+
+        with self.connect() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO omm (group_name, archive_date, catalog_number, object_name, epoch, record) VALUES (?,?,?,?,?,?)", rows)
+            return connection.total_changes - before
+
+    def get_tles(self, start, end, groups):
+        '''
+        Return all TLEs for the provided groups archived between start and end (both included).
+        returns list of tuples : [(norad_id,line1,line2),...]
+        '''
+        placeholders = ",".join("?"*len(groups))
+        with self.connect() as connection:
+            rows = connection.execute(
+                f"SELECT norad_id, line1, line2 FROM tles WHERE group_name IN ({placeholders}) "
+                "AND archive_date BETWEEN ? AND ? ORDER BY archive_date, rowid",
+                list(groups) + [_date_str(start), _date_str(end)]).fetchall()
+        return rows
+
+    def get_archive_dates(self, start, end, groups):
+        '''
+        Return the (group, archive date) pairs with TLEs between start and end (both included).
+        returns set of tuples : {(group,"YYYY-mm-dd"),...}
+        '''
+        placeholders = ",".join("?"*len(groups))
+        with self.connect() as connection:
+            rows = connection.execute(
+                f"SELECT DISTINCT group_name, archive_date FROM tles WHERE group_name IN ({placeholders}) "
+                "AND archive_date BETWEEN ? AND ?",
+                list(groups) + [_date_str(start), _date_str(end)]).fetchall()
+        return set(rows)
+
+    def get_csv(self, date, group):
+        '''
+        Return the CSV (OMM) records archived for the provided date and group as a dataframe.
+        '''
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT record FROM omm WHERE group_name = ? AND archive_date = ? ORDER BY rowid",
+                (group, _date_str(date))).fetchall()
+        if not rows:
+            return pd.DataFrame()
+
+        df = pd.DataFrame([json.loads(row[0]) for row in rows])
+        df["EPOCH"] = pd.to_datetime(df.EPOCH)
+        return df
+
+    def migrate(self, archive_path, groups):
+        '''
+        Import the legacy downloads/celestrak/YYYY/M/D directory tree into the store.
+        Returns the number of new TLEs and CSV records.
+        '''
+        count = 0
+        for day_dir in sorted(Path(archive_path).glob("*/*/*")):
+            if not day_dir.is_dir():
+                continue
+            try:
+                archive_date = datetime(int(day_dir.parent.parent.name), int(day_dir.parent.name), int(day_dir.name)).date()
+            except ValueError:
+                continue
+            date_str = datetime.strftime(archive_date, "%Y%m%d")
+            for group in groups:
+                for filename in [f"TLE_{date_str}_{group}.txt", f"{date_str}_{group}.txt"]:
+                    filepath = day_dir / filename
+                    if filepath.exists() and filepath.stat().st_size > 0:
+                        with filepath.open('r') as f:
+                            count += self.add_tles(group, archive_date, f.readlines())
+                csv_file = day_dir / f"{date_str}_{group}.csv"
+                if csv_file.exists() and csv_file.stat().st_size > 0:
+                    count += self.add_csv(group, archive_date, pd.read_csv(csv_file))
+
+        return count
@@ -0,0 +1,373 @@
+'''
+Bitset encoded station visibility: one bitmap per epoch, indexed against a versioned
+station table. Bit j of a bitmap is set when station j of the table is in view.
+'''
+import json
+import hashlib
+import numpy as np
+from pathlib import Path
+from datetime import datetime,timedelta
+
+from snippets import EPOCH_FORMAT
+
+# Number of set bits for every byte value
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)],dtype=np.uint8)
+
+
+class StationTable:
+    '''
+    Ordered list of stations, identified by a version derived from its contents. Tables are
+    stored once in ./output/station_tables and referenced by version from the bitmaps.
+    '''
+    TABLES_PATH = "./output/station_tables"
+    _cache = {}
+
+    def __init__(self,stations):
+        self.stations = np.array([str(station) for station in stations])
+        self.version = hashlib.sha1("\n".join(self.stations).encode("utf-8")).hexdigest()[:12]
+        self.indexes = {station:i for i,station in enumerate(self.stations)}
+        self.number_of_bytes = (len(self.stations)+7)//8
+
+    def __len__(self):
+        return len(self.stations)
+
+    def save(self):
+        filepath = Path(self.TABLES_PATH) / f"{self.version}.json"
+        if filepath.exists():
+            return
+        filepath.parent.mkdir(parents=True,exist_ok=True)
+        tmp_file = filepath.with_suffix(".json.part")
+        with tmp_file.open("w") as f:
+            json.dump({"version":self.version,"stations":self.stations.tolist()},f)
+        tmp_file.replace(filepath)
+
+    @classmethod
+    def load(cls,version):
+        '''
+        Return the stored station table with the provided version, None if not available.
+        '''
+        if version in cls._cache:
+            return cls._cache[version]
+        filepath = Path(cls.TABLES_PATH) / f"{version}.json"
+        if not filepath.exists():
+            return None
+        with filepath.open("r") as f:
+            table = StationTable(json.load(f)["stations"])
+        if table.version!=version:
+            raise Exception(f"Station table {filepath} does not match its version")
+        cls._cache[version] = table
+        return table
+
+    def get_bitmap(self,stations):
+        '''
+        Return the bitmap (uint8 array) with the bits of the provided stations set. Unknown
+        stations are ignored.
+        '''
+        in_table = np.zeros(len(self.stations),dtype=bool)
+        in_table[[self.indexes[station] for station in stations if station in self.indexes]] = True
+        return np.packbits(in_table,bitorder="little")
+
+
+class VisibilityBitmap:
+    '''
+    Visibility of a satellite (or a union of satellites) for consecutive epochs, as an
+    (epochs x bytes) uint8 array of packed bits against a station table.
+    '''
+    def __init__(self,bits,table):
+        self.bits = np.asarray(bits,dtype=np.uint8).reshape(-1,table.number_of_bytes)
+        self.table = table
+
+    def __len__(self):
+        return len(self.bits)
+
+    @classmethod
+    def from_matrix(cls,in_view,table):
+        '''
+        Build the bitmaps from a boolean (epochs x stations) matrix, with the table order.
+        '''
+        in_view = np.asarray(in_view,dtype=bool).reshape(-1,len(table))
+        return VisibilityBitmap(np.packbits(in_view,axis=1,bitorder="little"),table)
+
+    @classmethod
+    def from_lists(cls,stations_in_view,table):
+        '''
+        Build the bitmaps from lists of station names (one list per epoch).
+        '''
+        return VisibilityBitmap(np.array([table.get_bitmap(stations) for stations in stations_in_view],dtype=np.uint8),table)
+
+    @classmethod
+    def concatenate(cls,bitmaps):
+        return VisibilityBitmap(np.concatenate([bitmap.bits for bitmap in bitmaps]),bitmaps[0].table)
+
+    def check_table(self,other):
+        if self.table.version!=other.table.version:
+            raise Exception(f"Bitmaps use different station tables: {self.table.version} and {other.table.version}")
+
+    def __or__(self,other):
+        self.check_table(other)
+        return VisibilityBitmap(self.bits|other.bits,self.table)
+
+    def __and__(self,other):
+        self.check_table(other)
+        return VisibilityBitmap(self.bits&other.bits,self.table)
+
+    def counts(self):
+        '''
+        Return the number of stations in view per epoch.
+        '''
+        return POPCOUNT[self.bits].sum(axis=1,dtype=np.int64)
+
+    def any_of(self,stations):
+        '''
+        Return per epoch whether any of the provided stations is in view.
+        '''
+        return np.any(self.bits & self.table.get_bitmap(stations),axis=1)
+
+    def to_matrix(self):
+        return np.unpackbits(self.bits,axis=1,count=len(self.table),bitorder="little").astype(bool)
+
+    def expand(self):
+        '''
+        Return the names of the stations in view, as a list per epoch.
+        '''
+        return [self.table.stations[row].tolist() for row in self.to_matrix()]
+
+    def to_hex(self):
+        return [row.tobytes().hex() for row in self.bits]
+
+
+class VisibilityWriter:
+    '''
+    Write the visibility bitmaps of a satellite for a day in consecutive epoch chunks, to a
+    memory-mapped .npy file and a JSON file referencing the station table (which is stored
+    as well). The files are written with a .part suffix and renamed on close.
+    '''
+    def __init__(self,basepath,prn,start,sampling,number_of_epochs,table):
+        self.basepath = Path(basepath)
+        self.basepath.mkdir(parents=True,exist_ok=True)
+        self.prn = prn
+        self.table = table
+        self.metadata = {
+            "prn":prn,
+            "station_table":table.version,
+            "start":datetime.strftime(start,EPOCH_FORMAT),
+            "sampling":sampling}
+        self.part_file = self.basepath / f"{prn}.npy.part"
+        self.bits = np.lib.format.open_memmap(self.part_file,mode="w+",dtype=np.uint8,shape=(number_of_epochs,table.number_of_bytes))
+        self.index = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+    def write(self,visibility):
+        if visibility.table.version!=self.table.version:
+            raise Exception(f"Bitmaps of {self.prn} use station table {visibility.table.version} instead of {self.table.version}")
+        number_of_epochs = len(visibility)
+        if self.index+number_of_epochs>len(self.bits):
+            raise Exception(f"Too many epochs written for {self.prn}: {self.index+number_of_epochs} > {len(self.bits)}")
+        self.bits[self.index:self.index+number_of_epochs] = visibility.bits
+        self.index += number_of_epochs
+
+    def close(self):
+        if self.bits is None:
+            return
+        if self.index!=len(self.bits):
+            self.abort()
+            raise Exception(f"Bitmaps of {self.prn} incomplete: {self.index} of {len(self.bits)} epochs written")
+
+        self.bits.flush()
+        self.bits = None
+        self.table.save()
+        self.part_file.replace(self.basepath / f"{self.prn}.npy")
+        metadata_file = self.basepath / f"{self.prn}.json.part"
+        with metadata_file.open("w") as f:
+            json.dump(self.metadata,f)
+        metadata_file.replace(self.basepath / f"{self.prn}.json")
+
+    def abort(self):
+        self.bits = None
+        self.part_file.unlink(missing_ok=True)
+
+class StationRuns:
+    '''
+    Station-centric index of the visibility of a satellite for a day, built chunk by chunk in
+    the same pass as the bitmaps: for every station, the runs [first,last) of epochs in view.
+    Merging the runs of all satellites gives the station products without reading the bitmaps
+    or the elevations again.
+    '''
+    def __init__(self,prn,start,sampling,table):
+        self.prn = prn
+        self.start = start
+        self.sampling = sampling
+        self.table = table
+        self.number_of_epochs = 0
+        # First epoch of the run in progress per station, -1 if not in view
+        self.open_runs = np.full(len(table),-1,dtype=np.int64)
+        self.stations = []
+        self.firsts = []
+        self.lasts = []
+
+    def add(self,visibility):
+        '''
+        Append the visibility bitmaps of the next epochs.
+        '''
+        in_view = np.concatenate([(self.open_runs>=0)[np.newaxis],visibility.to_matrix()])
+        # Epochs at which the stations start or stop seeing the satellite, in epoch order per station
+        stations,epochs = np.nonzero((in_view[1:]!=in_view[:-1]).T)
+        for station,epoch in zip(stations.tolist(),(epochs+self.number_of_epochs).tolist()):
+            if self.open_runs[station]<0:
+                self.open_runs[station] = epoch
+            else:
+                self.close_run(station,epoch)
+        self.number_of_epochs += len(in_view)-1
+
+    def close_run(self,station,epoch):
+        self.stations.append(station)
+        self.firsts.append(int(self.open_runs[station]))
+        self.lasts.append(epoch)
+        self.open_runs[station] = -1
+
+    def close(self):
+        for station in np.flatnonzero(self.open_runs>=0).tolist():
+            self.close_run(station,self.number_of_epochs)
+
+    def save(self,basepath):
+        self.close()
+        self.table.save()
+        basepath = Path(basepath)
+        basepath.mkdir(parents=True,exist_ok=True)
+        tmp_file = basepath / (self.prn+".npz.part")
+        with tmp_file.open("wb") as f:
+            np.savez(f,
+                prn=self.prn,
+                station_table=self.table.version,
+                start=datetime.strftime(self.start,EPOCH_FORMAT),
+                sampling=self.sampling,
+                number_of_epochs=self.number_of_epochs,
+                stations=np.array(self.stations,dtype=np.int64),
+                firsts=np.array(self.firsts,dtype=np.int64),
+                lasts=np.array(self.lasts,dtype=np.int64))
+        tmp_file.replace(basepath / (self.prn+".npz"))
+
+    @classmethod
+    def load(cls,filepath):
+        with np.load(filepath) as data:
+            table = StationTable.load(str(data["station_table"]))
+            if table is None:
+                raise Exception(f"Station table {data['station_table']} referenced by {filepath} is missing")
+            runs = StationRuns(str(data["prn"]),datetime.strptime(str(data["start"]),EPOCH_FORMAT),float(data["sampling"]),table)
+            runs.number_of_epochs = int(data["number_of_epochs"])
+            runs.stations = data["stations"].tolist()
+            runs.firsts = data["firsts"].tolist()
+            runs.lasts = data["lasts"].tolist()
+        return runs
+
+
+def iter_station_visibility(year,month,day,constellations,stations=None,logger=None):
+    '''
+    Merge the station runs of all satellites of the provided date: for every station (or the
+    provided stations only), the visible prns per epoch and the number of visible satellites
+    per constellation per epoch. Satellites computed on another epoch grid than the majority
+    of the day are skipped.
+    yields tuples: (station,{"epochs":[...],"prns":[[...],...],"counts":{"G":[...],...}})
+    '''
+    basepath = Path(f"./output/{year}/{str(month).zfill(2)}/{str(day).zfill(2)}/station_runs")
+    all_runs = [StationRuns.load(filepath) for filepath in sorted(basepath.glob("*.npz"))]
+    if not all_runs:
+        return
+
+    grids = [(runs.start,runs.sampling,runs.number_of_epochs) for runs in all_runs]
+    grid = max(set(grids),key=grids.count)
+    for runs in all_runs:
+        if (runs.start,runs.sampling,runs.number_of_epochs)!=grid and logger:
+            logger.warning(f"Skipping {runs.prn} in the station products of {year}/{month}/{day}: computed on another epoch grid")
+    all_runs = [runs for runs in all_runs if (runs.start,runs.sampling,runs.number_of_epochs)==grid]
+
+    start,sampling,number_of_epochs = grid
+    epochs = [datetime.strftime(start+i*timedelta(minutes=sampling),EPOCH_FORMAT) for i in range(number_of_epochs)]
+
+    # Runs of all satellites by station name, in prn order
+    by_station = {}
+    for runs in sorted(all_runs,key=lambda runs: runs.prn):
+        names = runs.table.stations
+        for station,first,last in zip(runs.stations,runs.firsts,runs.lasts):
+            by_station.setdefault(names[station],[]).append((runs.prn,first,last))
+
+    if stations is None:
+        stations = sorted(set(station for runs in all_runs for station in runs.table.stations))
+    for station in stations:
+        prns = [[] for _ in epochs]
+        changes = {constellation:np.zeros(number_of_epochs+1,dtype=int) for constellation in constellations}
+        for prn,first,last in sorted(by_station.get(station,[])):
+            for i in range(first,last):
+                prns[i].append(prn)
+            if prn[0] in changes:
+                changes[prn[0]][first] += 1
+                changes[prn[0]][last] -= 1
+        yield station,{
+            "epochs":epochs,
+            "prns":prns,
+            "counts":{constellation:np.cumsum(values[:-1]).tolist() for constellation,values in changes.items()}}
+
+def get_visibility(year,month,day,prn):
+    '''
+    Read the (memory-mapped) visibility bitmaps of a satellite for the provided date.
+    returns tuple: (VisibilityBitmap,epochs) or None if not available
+    '''
+    basepath = Path(f"./output/{year}/{str(month).zfill(2)}/{str(day).zfill(2)}/bitmaps")
+    if not (basepath / f"{prn}.npy").exists() or not (basepath / f"{prn}.json").exists():
+        return None
+
+    with (basepath / f"{prn}.json").open("r") as f:
+        metadata = json.load(f)
+    bits = np.load(basepath / f"{prn}.npy",mmap_mode="r")
+    start = datetime.strptime(metadata["start"],EPOCH_FORMAT)
+    sampling = float(metadata["sampling"])
+
+    table = StationTable.load(metadata["station_table"])
+    if table is None:
+        raise Exception(f"Station table {metadata['station_table']} referenced by {basepath / prn} is missing")
+    epochs = [datetime.strftime(start+i*timedelta(minutes=sampling),EPOCH_FORMAT) for i in range(len(bits))]
+
+    return VisibilityBitmap(bits,table),epochs
+
+def get_visibility_union(year,month,day,prns=None):
+    '''
+    Union of the visibility bitmaps of the provided prns (all prns of the date if not provided):
+    the stations which see at least one of the satellites, per epoch. Only satellites with the
+    station table and epochs of the majority of the satellites are combined, the others are
+    returned as skipped with the reason.
+    returns tuple: (VisibilityBitmap,epochs,{prn:reason}) or None if not available
+    '''
+    basepath = Path(f"./output/{year}/{str(month).zfill(2)}/{str(day).zfill(2)}/bitmaps")
+    if not prns:
+        prns = sorted(filepath.stem for filepath in basepath.glob("*.npy"))
+
+    results = {}
+    for prn in prns:
+        visibility = get_visibility(year,month,day,prn)
+        if visibility is not None:
+            results[prn] = visibility
+    if not results:
+        return None
+
+    grids = [(visibility.table.version,tuple(epochs)) for visibility,epochs in results.values()]
+    table_version,epochs = max(set(grids),key=grids.count)
+
+    union = None
+    skipped = {}
+    for prn,(visibility,prn_epochs) in results.items():
+        if visibility.table.version!=table_version:
+            skipped[prn] = f"station table {visibility.table.version} instead of {table_version}"
+        elif tuple(prn_epochs)!=epochs:
+            skipped[prn] = f"{len(prn_epochs)} epochs from {prn_epochs[0] if prn_epochs else None} instead of {len(epochs)} from {epochs[0] if epochs else None}"
+        else:
+            union = visibility if union is None else union|visibility
+
+    return union,list(epochs),skipped